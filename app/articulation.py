@@ -0,0 +1,75 @@
+import math
+
+DEG_TO_RAD = math.pi / 180
+
+
+class ArticulationAssist:
+    # off-road mode: warps the suspension (one diagonal pair down, the other up) so all four wheels stay loaded
+    # the twist of the terrain can't be seen in the attitude while all wheels touch, a warp then only moves load
+    # between the diagonals; once a wheel lifts, the chassis stands on three wheels and the same warp tilts it
+    # a small square wave is added to the warp and the roll and pitch that follow it are picked out (lock-in);
+    # how the response splits between the diagonals tells which one is unloaded, the terrain's own tilting doesn't
+    # follow the square wave and averages out
+    # the output is the warp input of the suspension mixing matrix: + lowers fl and rr, - lowers fr and rl
+    def __init__(self, dt, trackwidth = 125, wheelbase = 197, warp_gain = 0.05, dither = 0.03, dither_period = 0.6,
+                 deadband_mm = 6.0, slip_gain = 1.0, leak = 0.05, max_warp = 0.5):
+        self.dt = dt
+        self.half_track = trackwidth / 2
+        self.half_wheelbase = wheelbase / 2
+        self.warp_gain = warp_gain # warp per second, per mm of response to a whole warp unit
+        self.dither = dither # square wave amplitude, normalized corner travel
+        # the square wave goes +, -, -, + so a steady drift of the attitude cancels out; ticks per quarter
+        self.quarter_ticks = max(1, round(dither_period / 4 / dt))
+        self.deadband_mm = deadband_mm # response of a car on all four wheels, from the lag and the noise
+        self.slip_gain = slip_gain # the warp moves this much faster again while the motor shows wheel slip
+        self.leak = leak # 1/s, the warp relaxes with this rate while all wheels are down
+        self.max_warp = max_warp # a corner pair can move at most half of the travel away from the other one
+        self.tick = 0
+        self.roll_sum = 0.0
+        self.pitch_sum = 0.0
+        self.response_mm = 0.0 # > 0: standing on the fl-rr diagonal, < 0: on fr-rl
+        self.warp = 0.0
+        self.output = 0.0
+
+    def reset(self):
+        self.tick = 0
+        self.roll_sum = 0.0
+        self.pitch_sum = 0.0
+        self.response_mm = 0.0
+        self.warp = 0.0
+        self.output = 0.0
+
+    def _diagonal(self, roll, pitch):
+        # corner heights from the angles are roll_mm * (-1, 1, -1, 1) + pitch_mm * (1, 1, -1, -1) for fl, fr, rl, rr;
+        # warping a car standing on fl-rr and one of the others tilts it with roll_mm == pitch_mm,
+        # on fr-rl with roll_mm == -pitch_mm
+        roll_mm = roll * DEG_TO_RAD * self.half_track
+        pitch_mm = pitch * DEG_TO_RAD * self.half_wheelbase
+        return abs(roll_mm + pitch_mm) - abs(roll_mm - pitch_mm)
+
+    def update(self, roll, pitch, traction_loss = 0.0):
+        # angles in degrees, traction_loss from 0 (none) to 1 (wheels spinning freely); returns the warp input
+        quarter = self.tick // self.quarter_ticks
+        sign = 1 if quarter == 0 or quarter == 3 else -1
+        self.roll_sum += sign * roll
+        self.pitch_sum += sign * pitch
+        self.tick += 1
+        if self.tick >= 4 * self.quarter_ticks:
+            # mean over the high half minus the low half, per whole warp unit
+            scale = 1 / (2 * self.quarter_ticks * 2 * self.dither)
+            self.response_mm = self._diagonal(self.roll_sum * scale, self.pitch_sum * scale)
+            self.tick = 0
+            self.roll_sum = 0.0
+            self.pitch_sum = 0.0
+
+        if self.response_mm > self.deadband_mm:
+            self.warp += self.warp_gain * (self.response_mm - self.deadband_mm) * self.dt * (1 + self.slip_gain * traction_loss)
+        elif self.response_mm < -self.deadband_mm:
+            self.warp += self.warp_gain * (self.response_mm + self.deadband_mm) * self.dt * (1 + self.slip_gain * traction_loss)
+        else:
+            self.warp -= self.warp * self.leak * self.dt
+        self.warp = max(min(self.warp, self.max_warp), -self.max_warp)
+        # the square wave leads the samples it is compared with by one tick, the corners need that time to move
+        quarter = self.tick // self.quarter_ticks
+        self.output = self.warp + (self.dither if quarter == 0 or quarter == 3 else -self.dither)
+        return self.output
@@ -0,0 +1,96 @@
+import math
+
+RAD_TO_DEG = 180.0 / math.pi
+
+
+class MahonyFilter:
+    # quaternion attitude estimate (Mahony): the gyro rates are integrated and corrected towards the
+    # accelerometer's gravity direction with a PI feedback, the integral part is the gyro bias estimate
+    # body frame: x forward, y left, z up; gyro in rad/s, accel in any unit, one fixed-cost step per sample
+    def __init__(self, kp = 1.0, ki = 0.05, kp_motion = 0.05, max_bias = 0.1):
+        self.kp = kp # accelerometer correction while the total acceleration is close to 1g
+        self.ki = ki
+        self.kp_motion = kp_motion # weaker correction while accelerating, the accelerometer doesn't point down then
+        self.max_bias = max_bias # rad/s, bounds the bias estimate so a long manoeuvre can't wind it up
+        self.q0 = 1.0
+        self.q1 = 0.0
+        self.q2 = 0.0
+        self.q3 = 0.0
+        self.bias_x = 0.0
+        self.bias_y = 0.0
+        self.bias_z = 0.0
+        # estimated up direction in the body frame, unit length
+        self.gravity_x = 0.0
+        self.gravity_y = 0.0
+        self.gravity_z = 1.0
+        self.roll = 0.0 # degrees
+        self.pitch = 0.0
+        self.yaw = 0.0
+
+    def reset(self, ax = 0.0, ay = 0.0, az = 1.0):
+        # starts from the attitude given by the accelerometer, yaw 0; keeps the bias estimate
+        roll = math.atan2(ay, az)
+        pitch = math.atan2(-ax, math.sqrt(ay * ay + az * az))
+        cr = math.cos(roll / 2)
+        sr = math.sin(roll / 2)
+        cp = math.cos(pitch / 2)
+        sp = math.sin(pitch / 2)
+        self.q0 = cr * cp
+        self.q1 = sr * cp
+        self.q2 = cr * sp
+        self.q3 = -sr * sp
+        self.update_angles()
+
+    def update(self, gx, gy, gz, ax, ay, az, dt, accel_trusted = True):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        norm_sq = ax * ax + ay * ay + az * az
+        if norm_sq > 0:
+            recip = 1 / math.sqrt(norm_sq)
+            ax *= recip
+            ay *= recip
+            az *= recip
+            # error between the measured and the estimated up direction
+            ex = ay * self.gravity_z - az * self.gravity_y
+            ey = az * self.gravity_x - ax * self.gravity_z
+            ez = ax * self.gravity_y - ay * self.gravity_x
+            kp = self.kp_motion
+            if accel_trusted:
+                kp = self.kp
+                if self.ki > 0:
+                    self.bias_x = max(-self.max_bias, min(self.max_bias, self.bias_x - self.ki * ex * dt))
+                    self.bias_y = max(-self.max_bias, min(self.max_bias, self.bias_y - self.ki * ey * dt))
+                    self.bias_z = max(-self.max_bias, min(self.max_bias, self.bias_z - self.ki * ez * dt))
+            gx += kp * ex
+            gy += kp * ey
+            gz += kp * ez
+        gx -= self.bias_x
+        gy -= self.bias_y
+        gz -= self.bias_z
+
+        # q' = q + q * (0, g) * dt / 2
+        half_dt = 0.5 * dt
+        self.q0 = q0 + (-q1 * gx - q2 * gy - q3 * gz) * half_dt
+        self.q1 = q1 + (q0 * gx + q2 * gz - q3 * gy) * half_dt
+        self.q2 = q2 + (q0 * gy - q1 * gz + q3 * gx) * half_dt
+        self.q3 = q3 + (q0 * gz + q1 * gy - q2 * gx) * half_dt
+        recip = 1 / math.sqrt(self.q0 * self.q0 + self.q1 * self.q1 + self.q2 * self.q2 + self.q3 * self.q3)
+        self.q0 *= recip
+        self.q1 *= recip
+        self.q2 *= recip
+        self.q3 *= recip
+        self.update_angles()
+
+    def update_angles(self):
+        q0 = self.q0
+        q1 = self.q1
+        q2 = self.q2
+        q3 = self.q3
+        self.gravity_x = 2 * (q1 * q3 - q0 * q2)
+        self.gravity_y = 2 * (q0 * q1 + q2 * q3)
+        self.gravity_z = q0 * q0 - q1 * q1 - q2 * q2 + q3 * q3
+        self.roll = math.atan2(self.gravity_y, self.gravity_z) * RAD_TO_DEG
+        self.pitch = math.asin(max(-1.0, min(1.0, -self.gravity_x))) * RAD_TO_DEG
+        self.yaw = math.atan2(2 * (q0 * q3 + q1 * q2), 1 - 2 * (q2 * q2 + q3 * q3)) * RAD_TO_DEG
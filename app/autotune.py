@@ -0,0 +1,159 @@
+import math
+import time
+
+
+class RelayExperiment:
+    # relay feedback (Astrom-Hagglund): the output switches between bias +/- amplitude around the set point,
+    # the speed settles into a limit cycle whose amplitude and period give the ultimate gain and period
+    def __init__(self, setpoint_rps, bias_pwm, amplitude_pwm, hysteresis_rps = 1.0, skip_cycles = 2, cycles = 4):
+        self.setpoint_rps = setpoint_rps
+        self.bias_pwm = bias_pwm
+        self.amplitude_pwm = amplitude_pwm
+        self.hysteresis_rps = hysteresis_rps
+        self.skip_cycles = skip_cycles # first cycles are the transient from the start
+        self.cycles = cycles # cycles averaged for the result
+        self.output = 1
+        self.cycle = 0
+        self.cycle_start_ms = -1
+        self.cycle_max = -1e9
+        self.cycle_min = 1e9
+        self.amplitude_sum = 0
+        self.period_sum = 0
+        self.done = False
+        self.ultimate_gain = 0
+        self.ultimate_period = 0
+
+    def step(self, rps, now_ms):
+        # returns the pwm to apply for the measured speed
+        if self.done:
+            return self.bias_pwm
+        err = self.setpoint_rps - rps
+        output = self.output
+        if err > self.hysteresis_rps:
+            output = 1
+        elif err < -self.hysteresis_rps:
+            output = -1
+        self.cycle_max = max(self.cycle_max, rps)
+        self.cycle_min = min(self.cycle_min, rps)
+        # a cycle is counted between two switches to the high output
+        if output == 1 and self.output == -1:
+            if self.cycle_start_ms >= 0:
+                self.cycle += 1
+                if self.cycle > self.skip_cycles:
+                    self.amplitude_sum += (self.cycle_max - self.cycle_min) / 2
+                    self.period_sum += time.ticks_diff(now_ms, self.cycle_start_ms)
+                    if self.cycle - self.skip_cycles >= self.cycles:
+                        self._finish()
+            self.cycle_start_ms = now_ms
+            self.cycle_max = rps
+            self.cycle_min = rps
+        self.output = output
+        return self.bias_pwm + self.output * self.amplitude_pwm
+
+    def _finish(self):
+        amplitude = self.amplitude_sum / self.cycles
+        # the hysteresis delays every switch, the describing function corrects the amplitude for it
+        if amplitude > self.hysteresis_rps:
+            amplitude = math.sqrt(amplitude ** 2 - self.hysteresis_rps ** 2)
+        self.ultimate_gain = 4 * self.amplitude_pwm / (math.pi * amplitude) if amplitude > 0 else 0
+        self.ultimate_period = self.period_sum / self.cycles / 1000
+        self.done = True
+
+    def pi_gains(self):
+        # Tyreus-Luyben rules, less aggressive than Ziegler-Nichols and more tolerant to the gearbox backlash
+        if not self.done or self.ultimate_gain == 0 or self.ultimate_period == 0:
+            return None
+        kp = self.ultimate_gain / 3.2
+        ki = kp / (2.2 * self.ultimate_period)
+        return kp, ki
+
+
+class AutoTune:
+    def __init__(self, motor, gearbox = None, setpoint_rps = 60, amplitude_pwm = 4000, settle_ms = 1500, timeout_ms = 15000):
+        self.motor = motor
+        self.gearbox = gearbox
+        self.setpoint_rps = setpoint_rps
+        self.amplitude_pwm = amplitude_pwm
+        self.settle_ms = settle_ms # time for the gearbox to shift and the motor to reach the set point
+        self.timeout_ms = timeout_ms # the experiment is dropped if no limit cycle shows up
+        self.gears = [0, 1] if gearbox else [0]
+        self.gear_idx = 0
+        self.experiment = None
+        self.state = 'idle' # idle, shifting, relay, done
+        self.state_time = 0
+        self.saved_mode = 0
+
+    def is_running(self):
+        return self.state not in ('idle', 'done')
+
+    def start(self):
+        # the wheels must be off the ground
+        if self.motor.pid.fixed_point:
+            print("[AutoTune] Auto-tune needs the float control loop")
+            return
+        print("[AutoTune] Starting relay auto-tune")
+        self.saved_mode = self.motor.pid.mode
+        self.motor.pid.set_mode(2)
+        self.gear_idx = 0
+        self._start_gear()
+
+    def abort(self):
+        if self.is_running():
+            print("[AutoTune] Auto-tune aborted")
+            self._finish(save = False)
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_time = time.ticks_ms()
+
+    def _start_gear(self):
+        gear = self.gears[self.gear_idx]
+        if self.gearbox:
+            self.gearbox.set_gear(gear)
+        self.motor.pid.set_gear(gear)
+        # bring the motor near the set point with the normal controller first
+        self.motor.set_speed_rps(self.setpoint_rps)
+        self._set_state('shifting')
+
+    def _end_gear(self):
+        self.motor.pid.relay = None
+        gains = self.experiment.pi_gains() if self.experiment else None
+        gear = self.gears[self.gear_idx]
+        if gains:
+            self.motor.pid.set_gear_gains(gear, gains[0], gains[1])
+            print(f"[AutoTune] Gear {gear}: Ku={self.experiment.ultimate_gain:.1f}, Tu={self.experiment.ultimate_period:.3f}s, kp={gains[0]:.1f}, ki={gains[1]:.1f}")
+        else:
+            print(f"[AutoTune] Gear {gear}: no limit cycle, keeping the old gains")
+        self.experiment = None
+        self.gear_idx += 1
+        if self.gear_idx < len(self.gears):
+            self._start_gear()
+        else:
+            self._finish(save = True)
+
+    def _finish(self, save):
+        self.motor.pid.relay = None
+        self.motor.set_speed_rps(0)
+        if self.gearbox:
+            self.gearbox.set_gear(0)
+        self.motor.pid.set_gear(0)
+        if save:
+            self.motor.pid.save_gains()
+        self.motor.pid.set_mode(self.saved_mode)
+        self._set_state('done')
+
+    def update(self):
+        # non-blocking, called periodically from the main loop; the relay itself runs in the control loop
+        if not self.is_running():
+            return
+        elapsed = time.ticks_diff(time.ticks_ms(), self.state_time)
+        if self.state == 'shifting':
+            if elapsed > self.settle_ms:
+                pid = self.motor.pid
+                bias = pid.pwm_feed_forward_lookup(int(self.setpoint_rps * 100))
+                self.experiment = RelayExperiment(self.setpoint_rps, bias, self.amplitude_pwm)
+                pid.relay = self.experiment
+                self._set_state('relay')
+        elif self.state == 'relay':
+            if self.experiment.done or elapsed > self.timeout_ms:
+                self._end_gear()
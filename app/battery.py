@@ -0,0 +1,127 @@
+import time
+
+# open-circuit voltage of a LiPo cell at 0, 10, ... 100% state of charge, mV
+LIPO_CELL_MV = (3300, 3680, 3740, 3770, 3790, 3820, 3870, 3920, 3980, 4060, 4200)
+
+
+def soc_from_cell_mv(cell_mv, table = LIPO_CELL_MV):
+    # state of charge in percent, linear between the table points
+    if cell_mv <= table[0]:
+        return 0
+    last = len(table) - 1
+    if cell_mv >= table[last]:
+        return 100
+    i = 1
+    while table[i] < cell_mv:
+        i += 1
+    step = 100 // last
+    return (i - 1) * step + (cell_mv - table[i - 1]) * step // (table[i] - table[i - 1])
+
+
+class BatteryMonitor:
+    # the pack is an open-circuit voltage behind an internal resistance: v = ocv - r * i, with i the motor's
+    # battery current; r is the slope of the voltage over the current, from running covariances that forget with
+    # a weight of 2^-avg_shift per sample, and only moves while the current varies enough to tell
+    # the open-circuit voltage is then the reading with the sag added back, it gives the state of charge and
+    # keeps the low-voltage protection working while the car drives
+    # everything is in mV, mA and mOhm ints
+    def __init__(self, voltage_reader, cells = 2, capacity_mah = 3000, stall_current_ma = 8000, idle_current_ma = 250,
+                 resistance_mohm = 100, max_resistance_mohm = 1000, min_current_std_ma = 300, avg_shift = 6,
+                 resistance_shift = 4, ocv_shift = 3, current_shift = 8, low_cell_mv = 3300, recover_cell_mv = 3400,
+                 low_delay_ms = 2000):
+        self.voltage_reader = voltage_reader
+        self.cells = cells
+        self.capacity_mah = capacity_mah # the 2S 3000 mAh pack of the parts list
+        self.stall_current_ma = stall_current_ma # motor current at full duty and standstill
+        self.idle_current_ma = idle_current_ma # Pico, servos and sensors, for the run time
+        self.max_resistance_mohm = max_resistance_mohm
+        self.min_current_var = min_current_std_ma * min_current_std_ma
+        self.avg_shift = avg_shift # 64 samples, 1.6 s at 25 ms
+        self.resistance_shift = resistance_shift
+        self.ocv_shift = ocv_shift
+        self.current_shift = current_shift # 256 samples, 6.4 s, for the run time
+        self.low_cell_mv = low_cell_mv
+        self.recover_cell_mv = recover_cell_mv
+        self.low_delay_ms = low_delay_ms
+        self.voltage_mv = 0 # last reading, under load
+        self.current_ma = 0
+        self.resistance_mohm = resistance_mohm
+        self.ocv_mv = 0
+        # the filters are kept scaled by 2^shift so they settle on the value, not a rounding below it;
+        # the covariances are the plain weighted means of the products
+        self.resistance_q = resistance_mohm << resistance_shift
+        self.ocv_q = 0
+        self.mean_mv_q = 0
+        self.mean_ma_q = 0
+        self.cov_mv_ma = 0
+        self.var_ma = 0
+        self.avg_current_ma = idle_current_ma
+        self.avg_current_q = idle_current_ma << current_shift
+        self.soc = 0 # percent
+        self.runtime_min = 0
+        self.low = False
+        self.low_since = 0
+        self.samples = 0
+
+    def update(self, current_pm):
+        # current_pm: the motor's battery current in per-mille of its stall current
+        voltage_mv = self.voltage_reader.read_mv()
+        if voltage_mv <= 0:
+            return
+        current_ma = current_pm * self.stall_current_ma // 1000
+        self.voltage_mv = voltage_mv
+        self.current_ma = current_ma
+        shift = self.avg_shift
+        if self.samples == 0:
+            self.mean_mv_q = voltage_mv << shift
+            self.mean_ma_q = current_ma << shift
+            self.ocv_q = (voltage_mv + self.resistance_mohm * current_ma // 1000) << self.ocv_shift
+        self.samples += 1
+
+        # internal resistance
+        self.mean_mv_q += voltage_mv - (self.mean_mv_q >> shift)
+        self.mean_ma_q += current_ma - (self.mean_ma_q >> shift)
+        dv = voltage_mv - (self.mean_mv_q >> shift)
+        di = current_ma - (self.mean_ma_q >> shift)
+        self.cov_mv_ma += (dv * di - self.cov_mv_ma) >> shift
+        self.var_ma += (di * di - self.var_ma) >> shift
+        if self.var_ma > self.min_current_var:
+            resistance = -self.cov_mv_ma * 1000 // self.var_ma
+            resistance = max(0, min(resistance, self.max_resistance_mohm))
+            self.resistance_q += resistance - (self.resistance_q >> self.resistance_shift)
+            self.resistance_mohm = self.resistance_q >> self.resistance_shift
+
+        # open-circuit voltage and state of charge
+        ocv_mv = voltage_mv + self.resistance_mohm * current_ma // 1000
+        self.ocv_q += ocv_mv - (self.ocv_q >> self.ocv_shift)
+        self.ocv_mv = self.ocv_q >> self.ocv_shift
+        cell_mv = self.ocv_mv // self.cells
+        self.soc = soc_from_cell_mv(cell_mv)
+
+        # run time left at the average current
+        current_ma += self.idle_current_ma
+        self.avg_current_q += current_ma - (self.avg_current_q >> self.current_shift)
+        self.avg_current_ma = max(self.idle_current_ma, self.avg_current_q >> self.current_shift)
+        self.runtime_min = self.capacity_mah * self.soc * 60 // (100 * self.avg_current_ma)
+
+        # low-voltage protection, on the open-circuit voltage so the sag of a hard launch doesn't trip it
+        if self.low:
+            if cell_mv > self.recover_cell_mv:
+                self.low = False
+                self.low_since = 0
+        elif cell_mv < self.low_cell_mv:
+            now = time.ticks_ms()
+            if self.low_since == 0:
+                self.low_since = now
+            elif time.ticks_diff(now, self.low_since) > self.low_delay_ms:
+                self.low = True
+                print(f"[BatteryMonitor] Battery low: {self.ocv_mv} mV open-circuit")
+        else:
+            self.low_since = 0
+
+    def is_low(self):
+        return self.low
+
+    def get_state(self):
+        # (mV under load, open-circuit mV, internal resistance mOhm, state of charge %, run time left in minutes)
+        return (self.voltage_mv, self.ocv_mv, self.resistance_mohm, self.soc, self.runtime_min)
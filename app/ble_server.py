@@ -51,11 +51,13 @@ class BLE_Server:
         CONST_CONTROLS_CHARACTERISTIC_UUID = "12345678-1234-5678-1234-56789abcdef1"
         CONST_PARAMTERES_CHARACTERISTIC_UUID = "72de3993-9b26-4ec8-89ac-fb17424769f3"
         CONST_VERSION_CHARACTERISTIC_UUID = "ae9328d3-fbad-48a5-9c34-eba3d6b19b76"
+        CONST_LOOP_STATS_CHARACTERISTIC_UUID = "5b0e7c42-3d6a-4f1e-9a87-2c4d6e8f0a13"
 
         self.CONTROLS_SERVICE_UUID = bluetooth.UUID(CONST_CONTROLS_SERVICE_UUID)
         self.CONTROLS_CHARACTERISTIC_UUID = bluetooth.UUID(CONST_CONTROLS_CHARACTERISTIC_UUID)
         self.PARAMETERS_CHARACTERISTIC_UUID = bluetooth.UUID(CONST_PARAMTERES_CHARACTERISTIC_UUID)
         self.VERSION_CHARACTERISTIC_UUID = bluetooth.UUID(CONST_VERSION_CHARACTERISTIC_UUID)
+        self.LOOP_STATS_CHARACTERISTIC_UUID = bluetooth.UUID(CONST_LOOP_STATS_CHARACTERISTIC_UUID)
 
         self._ble = bluetooth.BLE()
         self._ble.active(True)
@@ -69,13 +71,18 @@ class BLE_Server:
                 (self.PARAMETERS_CHARACTERISTIC_UUID,
                  bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY),
                 (self.VERSION_CHARACTERISTIC_UUID,
+                 bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY),
+                (self.LOOP_STATS_CHARACTERISTIC_UUID,
                  bluetooth.FLAG_READ | bluetooth.FLAG_NOTIFY)
             ),
         )
 
         ((self._controls_handle,
           self._parameters_handle,
-          self._version_handle),) = self._ble.gatts_register_services((controls_service,))
+          self._version_handle,
+          self._loop_stats_handle),) = self._ble.gatts_register_services((controls_service,))
+        # loop stats records are larger than the default 20 bytes attribute buffer
+        self._ble.gatts_set_buffer(self._loop_stats_handle, 100)
         
         version = "N/A"
         try:
@@ -136,6 +143,15 @@ class BLE_Server:
                     # Notify central
                     self._ble.gatts_notify(conn_handle, self._parameters_handle, data_encoded)
 
+    def send_loop_stats(self, get_encoded_data_handler):
+        # the value is kept readable even without a connection, notifications only go to connected centrals
+        data_encoded = get_encoded_data_handler()
+        if data_encoded:
+            self._ble.gatts_write(self._loop_stats_handle, data_encoded)
+            if self.connected:
+                for conn_handle in self._connections:
+                    self._ble.gatts_notify(conn_handle, self._loop_stats_handle, data_encoded)
+
     def blink_task(self):
         if self.connected:
             self.led.on()
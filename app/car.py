@@ -4,8 +4,18 @@ from steering import Steering
 from mpu6050 import MPU6050
 from horn import Horn
 from voltagereader import VoltageReader
+from battery import BatteryMonitor
 from distance_sensor import DistanceSensor
 from suspension import Suspension
+from ff_calibration import FFCalibration
+from autotune import AutoTune
+from suspension_calibration import SuspensionCalibration
+from stability import StabilityAssist
+from transmission import AutoTransmission
+from flight_recorder import FREEZE_DISCONNECT, FREEZE_LOW_VOLTAGE
+import loop_stats
+import i2c_bus
+import servo_scheduler
 import machine
 import struct
 import time
@@ -17,6 +27,7 @@ class Car:
         self.steering = None
         self.horn = None
         self.voltage_reader = None
+        self.battery = None
         self.imu = None
         self.distance_sensor = None
         self.suspension = None
@@ -39,6 +50,7 @@ class Car:
         self.roll = 0
         self.pitch = 0
         self.distance_mm = 0
+        self.distance_age_ms = -1 # age of the sample behind distance_mm, -1 before the first one
 
         self.aeb = False
         self.aeb_safety_distance_mm = 500
@@ -52,36 +64,53 @@ class Car:
 
         self.horn_state = 0
 
-    def config_motor(self, motor_in1, motor_in2, enc_a, enc_b):
+        self.ff_calibration = None
+        self.autotune = None
+        self.suspension_calibration = None
+        self.stability = None
+        self.transmission = None
+
+    def config_motor(self, motor_in1, motor_in2, enc_a, enc_b, fixed_point = False):
         self.motor = Motor(motor_in1, motor_in2, enc_a, enc_b)
         self.speed_target = 0
-        self.motor.start_control_loop()
+        self.motor.start_control_loop(fixed_point=fixed_point)
 
     def config_steering(self, steering_pin, center, max_left, max_right):
         self.steering = Steering(steering_pin, center=center, left=max_left, right=max_right)
     
     def config_gearbox(self, gearbox_shift_pin):
         self.gearbox = Gearbox(gearbox_shift_pin)
+        if self.motor:
+            # automatic gear selection, off until AUTO_GEAR_ON
+            self.transmission = AutoTransmission(self.motor, self.gearbox)
 
     def config_horn(self, horn_pin):
         self.horn = Horn(horn_pin)
 
     def config_voltage_reader(self, voltage_pin):
         self.voltage_reader = VoltageReader(pin=voltage_pin)
+        self.battery = BatteryMonitor(self.voltage_reader)
 
-    def config_mpu6050(self, bus_id, scl_pin, sda_pin):
+    def config_mpu6050(self, bus_id, scl_pin, sda_pin, fifo_rate = 0):
+        # fifo_rate > 0 samples through the sensor FIFO at that rate instead of polling at 100Hz
         try:
-            time.sleep(0.5)
+            time.sleep(0.1)
             self.imu = MPU6050(bus_id, scl_pin, sda_pin)
-            self.imu.calibrate()
-            self.imu.start_reading()
+            # the stored calibration is refined in the background, a full one only runs on the first boot
+            if not self.imu.load_calibration():
+                self.imu.calibrate()
+                self.imu.save_calibration()
+            if fifo_rate > 0:
+                self.imu.start_fifo(fifo_rate)
+            else:
+                self.imu.start_reading()
         except Exception as e:
             print(f"Error initializing MPU6050: {e}")
             self.imu = None
 
-    def config_distance_sensor(self, bus_id, scl_pin, sda_pin):
+    def config_distance_sensor(self, bus_id, scl_pin, sda_pin, ready_pin = None):
         try:
-            self.distance_sensor = DistanceSensor(bus_id, scl_pin, sda_pin)
+            self.distance_sensor = DistanceSensor(bus_id, scl_pin, sda_pin, ready_pin)
         except Exception as e:
             print(f"Error initializing distance sensor: {e}")
             self.distance_sensor = None
@@ -92,11 +121,26 @@ class Car:
             for entry in config:
                 self.suspension.config_servo(*entry)
             self.suspension.set_imu(self.imu)
+            self.suspension.set_motor(self.motor)
+            self.suspension.load_calibration()
             self.suspension.start_control_loop()
         except Exception as e:
             print(f"Error configuring suspension: {e}")
             self.suspension = None
 
+    def config_stability(self):
+        # yaw-rate stability assist, needs the imu, the steering and the motor; off until STABILITY_ON
+        if not self.imu or not self.steering or not self.motor:
+            print("Stability assist needs the IMU, the steering and the motor")
+            return
+        try:
+            self.stability = StabilityAssist(self.imu, self.steering, self.motor, self.wheel_diameter_mm)
+            self.stability.set_gearing_ratio(self.gearing_ratio)
+            self.stability.start_control_loop()
+        except Exception as e:
+            print(f"Error configuring stability assist: {e}")
+            self.stability = None
+
     def process_data(self, data):
         try:
             # restart the Pico if needed
@@ -104,21 +148,68 @@ class Car:
                 print("Resetting the machine...")
                 self.stop_car_activity()
                 machine.reset()
+
+            if data == b'SAVE_LOG':
+                if self.motor:
+                    self.motor.pid.save_log()
+                return
+
+            if data == b'RESET_STATS':
+                loop_stats.reset_all()
+                i2c_bus.reset_all()
+                servo_scheduler.reset_all()
+                return
+
+            if data == b'CALIBRATE_FF':
+                self.start_ff_calibration()
+                return
+
+            if data == b'AUTOTUNE':
+                self.start_autotune()
+                return
+
+            if data == b'CALIBRATE_SUSPENSION':
+                self.start_suspension_calibration()
+                return
+
+            if data == b'STABILITY_ON' or data == b'STABILITY_OFF':
+                if self.stability:
+                    self.stability.set_enabled(data == b'STABILITY_ON')
+                return
+
+            if data == b'AUTO_GEAR_ON' or data == b'AUTO_GEAR_OFF':
+                if self.transmission:
+                    self.transmission.set_enabled(data == b'AUTO_GEAR_ON')
+                return
             
             if data == b'DISCONNECTED':
                 print("Client disconnected - stopping the car.")
+                if self.ff_calibration:
+                    self.ff_calibration.abort()
+                if self.autotune:
+                    self.autotune.abort()
+                if self.suspension_calibration:
+                    self.suspension_calibration.abort()
                 if self.motor:
+                    self.motor.pid.recorder.trigger(FREEZE_DISCONNECT)
                     self.speed_target = 0
                 if self.steering:
                     self.steering_target = 0
                     self.steering.set_steering_position(0)
                 return
 
+            # the calibrations drive the motor and the gearbox by themselves
+            if self.calibration_running():
+                return
+
             # speed
             spd = data[0] - data[1] #RT - LT
             if self.motor:
                 self.speed_target = spd/255 * 100
-                self.motor.set_speed_percent(self.speed_target)
+                if self.auto_gear():
+                    self.transmission.set_speed_percent(self.speed_target)
+                else:
+                    self.motor.set_speed_percent(self.speed_target)
                 
             # steering
             if self.steering:
@@ -127,14 +218,17 @@ class Car:
                 self.steering.set_steering_position(steering_target)
 
             #gearbox
-            if self.gearbox:
+            # the buttons are ignored while the transmission picks the gear
+            if self.gearbox and not self.auto_gear():
                 left_button = data[3]
                 right_button = data[4]
                 if left_button and not right_button:
                     self.gearbox.set_gear(0)
                 elif right_button and not left_button:
                     self.gearbox.set_gear(1)
-                self.gearing_ratio = self.gearbox.get_gearing_ratio()
+                self.update_gearing_ratio()
+                if self.motor:
+                    self.motor.pid.set_gear(self.gearbox.gear)
 
             # horn
             if self.horn:
@@ -170,31 +264,94 @@ class Car:
         except Exception as e:
             print(f"Error processing data: {e}")
 
+    def auto_gear(self):
+        return self.transmission is not None and self.transmission.enabled
+
+    def update_gearing_ratio(self):
+        self.gearing_ratio = self.gearbox.get_gearing_ratio()
+        if self.stability:
+            self.stability.set_gearing_ratio(self.gearing_ratio)
+
+    def start_ff_calibration(self):
+        if not self.motor:
+            return
+        self.ff_calibration = FFCalibration(self.motor, self.gearbox)
+        self.ff_calibration.start()
+
+    def start_autotune(self):
+        if not self.motor:
+            return
+        self.autotune = AutoTune(self.motor, self.gearbox)
+        self.autotune.start()
+
+    def start_suspension_calibration(self):
+        if not self.suspension or not self.imu:
+            return
+        self.suspension_calibration = SuspensionCalibration(self.suspension, self.imu)
+        self.suspension_calibration.start()
+
+    def calibration_running(self):
+        return ((self.ff_calibration and self.ff_calibration.is_running()) or (self.autotune and self.autotune.is_running())
+                or (self.suspension_calibration and self.suspension_calibration.is_running()))
+
+    def update(self):
+        # periodic tasks that run from the main loop
+        try:
+            if self.ff_calibration:
+                self.ff_calibration.update()
+            if self.autotune:
+                self.autotune.update()
+            if self.suspension_calibration:
+                self.suspension_calibration.update()
+            if self.auto_gear() and not self.calibration_running():
+                self.transmission.update()
+                self.update_gearing_ratio()
+            if self.imu:
+                self.imu.update_calibration()
+        except Exception as e:
+            print(f'Error updating car: {e}')
+
     def acquire_sensors_data(self):
         try:
-            if self.voltage_reader:
-                # read voltage in decavolts to avoid using float
-                self.voltage = int(self.voltage_reader.read() * 10)
-                # battery safety, put pico to sleep if voltage is too low
-                # if battery level under 6.5V
-                # take account for situations when motor draws battery tension down
-
-                if self.voltage < 65 and self.motor and self.motor.get_speed_rps() == 0 and self.motor.pid.target_rps == 0: 
+            if self.motor:
+                self.motor.check_thermal_cut()
+
+            if self.battery:
+                self.battery.update(self.motor.get_supply_current_pm() if self.motor else 0)
+                # voltage in decivolts, the reading under load
+                self.voltage = self.battery.voltage_mv // 100
+                if self.motor:
+                    self.motor.pid.set_supply_voltage(self.battery.voltage_mv)
+                # battery safety: the check is on the open-circuit voltage, with the motor's sag added back,
+                # so it works while driving
+                if self.battery.is_low():
                     self.horn_state = 1
+                    if self.motor:
+                        self.motor.pid.recorder.trigger(FREEZE_LOW_VOLTAGE)
+
+            if self.steering and self.motor:
+                # the steering lock gets smaller with speed
+                self.speed_mmps = int(self.motor.get_speed_rps() * self.gearing_ratio * 3.1415 * self.wheel_diameter_mm)
+                self.steering.set_speed_mmps(self.speed_mmps)
 
             if self.imu:
+                self.imu.set_vehicle_stationary(self.motor is not None and self.motor.get_speed_rps() == 0)
                 self.roll, self.pitch = self.imu.read_position()
 
             if self.distance_sensor:
                     self.distance_mm = int(self.distance_sensor.read())
+                    self.distance_age_ms = self.distance_sensor.get_age_ms()
         except Exception as e:
                     print(f'Error while reading distance sensor data: {e}')
 
     def get_parameters_encoded(self):
-        steering_angle = int(self.steering.servo.angle) if self.steering else 0
+        steering_angle = int(self.steering.get_angle()) if self.steering else 0
         roll = int(self.roll) if self.imu else 0
         pitch = int(self.pitch) if self.imu else 0
-        voltage = self.voltage if self.voltage_reader else 0
+        voltage = self.voltage if self.battery else 0
+        ocv = self.battery.ocv_mv // 100 if self.battery else 0
+        soc = self.battery.soc if self.battery else 0
+        runtime_min = min(self.battery.runtime_min, 65535) if self.battery else 0
         motor_pwm = int(self.motor.pwm) if self.motor else 0
         self.motor_rps = int(self.motor.get_speed_rps()) if self.motor else 0
         self.speed_mmps = int(self.motor_rps * self.gearing_ratio * 3.1415 * self.wheel_diameter_mm) if self.motor else 0
@@ -202,6 +359,7 @@ class Car:
         fr_gain = int(self.suspension.fr_gain * 100) if self.suspension else 0
         rl_gain = int(self.suspension.rl_gain * 100) if self.suspension else 0
         rr_gain = int(self.suspension.rr_gain * 100) if self.suspension else 0
+        motor_headroom = self.motor.get_thermal_headroom() if self.motor else 0
         data = [voltage,
                 roll,
                 pitch,
@@ -212,12 +370,18 @@ class Car:
                 fl_gain,
                 fr_gain,
                 rl_gain,
-                rr_gain
+                rr_gain,
+                motor_headroom,
+                ocv,
+                soc,
+                runtime_min
                 ]
-        encoded_data = struct.pack('>Bhhhhbhhhhh', *data)
+        encoded_data = struct.pack('>BhhhhbhhhhhBBBH', *data)
         return encoded_data
     
     def stop_car_activity(self):
+        if self.stability:
+            self.stability.force_stop()
         if self.motor:
             self.motor.force_stop()
         if self.steering:
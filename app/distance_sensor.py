@@ -1,22 +1,41 @@
-from machine import I2C
 from vl53l0x import VL53L0X
+from i2c_bus import get_bus, PRIORITY_LOW
 import time
 
 class DistanceSensor:
-    def __init__(self, bus_id, scl_pin, sda_pin):
-        i2c = I2C(id=bus_id, scl=scl_pin, sda=sda_pin)
-        self.vl53l0x = VL53L0X(i2c)
+    def __init__(self, bus_id, scl_pin, sda_pin, ready_pin = None):
+        # shared with the IMU, readings are skipped when they would delay its next read
+        self.bus = get_bus(bus_id, scl_pin, sda_pin)
+        self.vl53l0x = VL53L0X(self.bus)
+        self.bus.register(self.vl53l0x.address, 'tof', PRIORITY_LOW)
         self.vl53l0x.set_measurement_timing_budget(25000)
         self.vl53l0x.set_Vcsel_pulse_period(self.vl53l0x.vcsel_period_type[0], 18)
         self.vl53l0x.set_Vcsel_pulse_period(self.vl53l0x.vcsel_period_type[1], 14)
+        # GPIO1 wired to a pin tells when a sample is ready, without it the status is polled
+        if ready_pin is not None:
+            self.vl53l0x.set_ready_pin(ready_pin)
+        # back-to-back continuous ranging, read() only takes the samples that are new
         self.vl53l0x.start()
         self.distance_offset = -50
         self.old_distance = 0
-    
+        self.sample_us = 0 # ticks_us of the sample behind old_distance, 0 before the first one
+
     # Returns the distance in milimeters
     def read(self, low_pass_filter = True):
-        distance = self.vl53l0x.read() + self.distance_offset #type: ignore
-        if low_pass_filter is True:
+        # never waits for the sensor: without a new valid sample the last distance is returned, get_age_ms() tells how old it is
+        if not self.bus.slot_free(self.vl53l0x.address):
+            return self.old_distance
+        if not self.vl53l0x.read_if_ready() or not self.vl53l0x.range_valid():
+            return self.old_distance
+        distance = self.vl53l0x.range_mm + self.distance_offset
+        if low_pass_filter is True and self.sample_us != 0:
             distance = distance * 0.4 + self.old_distance * 0.6
         self.old_distance = distance
+        self.sample_us = self.vl53l0x.sample_us
         return distance
+
+    def get_age_ms(self):
+        # age of the last valid sample, -1 before the first one
+        if self.sample_us == 0:
+            return -1
+        return time.ticks_diff(time.ticks_us(), self.sample_us) // 1000
@@ -0,0 +1,64 @@
+from micropython import const
+from array import array
+import time
+
+_EDGE_SEQ_MASK = const(0x3FFFFFF) # the edge sequence wraps here so it always stays a small int
+
+
+class EdgeSpeedEstimator:
+    def __init__(self, ppr, buffer_size = 16, period_edges = 4, timeout_us = 250_000):
+        # buffer_size must be a power of two, the write index is masked instead of compared
+        self.ppr = ppr
+        self.buffer_size = buffer_size
+        self.mask = buffer_size - 1
+        self.edge_times = array('i', [0] * buffer_size)
+        self.edge_seq = 0 # total edges recorded, wraps at _EDGE_SEQ_MASK
+        self.edge_dir = 0 # +1 or -1, direction of the last edge
+        self.edges_available = 0 # how many timestamps in the buffer are valid, up to buffer_size
+        # a full quadrature cycle (4 edges) is used for the period, so uneven A/B phase and duty cycle cancel out
+        self.period_edges = period_edges
+        self.timeout_us = timeout_us # no edge for this long means the motor is stopped
+        # values kept between calls, to avoid memory allocation
+        self.period_us = 0
+        self.since_last_us = 0
+        self.speed_crps = 0
+
+    def record_edge(self, t_us, step):
+        # called from the encoder pin interrupts, only stores ints
+        self.edge_times[self.edge_seq & self.mask] = t_us
+        self.edge_seq = (self.edge_seq + 1) & _EDGE_SEQ_MASK
+        self.edge_dir = step
+        if self.edges_available < self.buffer_size:
+            self.edges_available += 1
+
+    def reset(self):
+        self.edges_available = 0
+        self.speed_crps = 0
+
+    def get_speed_crps(self, now_us):
+        # speed in centi-rps from the time between the last edges, 0 if there are not enough recent edges
+        seq = self.edge_seq
+        edges = self.period_edges
+        if edges > self.edges_available - 1:
+            edges = self.edges_available - 1
+        if edges < 1:
+            self.speed_crps = 0
+            return 0
+        last = self.edge_times[(seq - 1) & self.mask]
+        self.since_last_us = time.ticks_diff(now_us, last)
+        if self.since_last_us > self.timeout_us:
+            self.edges_available = 0
+            self.speed_crps = 0
+            return 0
+        self.period_us = time.ticks_diff(last, self.edge_times[(seq - 1 - edges) & self.mask])
+        # if no edge came for longer than the last edge period, the motor is slowing down
+        # and the time since the last edge is a better bound for the period
+        if self.since_last_us * edges > self.period_us:
+            self.period_us = self.since_last_us * edges
+        if self.period_us <= 0:
+            self.speed_crps = 0
+            return 0
+        self.speed_crps = edges * 100_000_000 // (self.ppr * self.period_us)
+        if self.edge_dir < 0:
+            self.speed_crps = -self.speed_crps
+        return self.speed_crps
@@ -0,0 +1,142 @@
+import time
+
+
+def interpolate_points(points, x):
+    # linear interpolation over (x, y) points sorted by x, extrapolating with the first/last segment
+    if len(points) == 1:
+        return points[0][1]
+    i = 1
+    while i < len(points) - 1 and points[i][0] < x:
+        i += 1
+    x0, y0 = points[i - 1]
+    x1, y1 = points[i]
+    if x1 == x0:
+        return y1
+    return y0 + (y1 - y0) * (x - x0) / (x1 - x0)
+
+
+def fit_ff_table(samples, step_rps, size, max_pwm = 65535):
+    # samples are (rps, pwm) pairs measured at steady state; returns the pwm for 0, step_rps, 2 * step_rps, ...
+    # the table is kept monotonic, since more speed can never need less voltage
+    points = sorted(samples)
+    if not points:
+        return None
+    table = []
+    last = 0
+    for i in range(size):
+        pwm = int(interpolate_points(points, i * step_rps))
+        pwm = max(min(pwm, max_pwm), last)
+        table.append(pwm)
+        last = pwm
+    return table
+
+
+class FFCalibration:
+    def __init__(self, motor, gearbox = None, rps_step = 20, settle_ms = 1500, measure_ms = 500, timeout_ms = 4000, tolerance = 0.05):
+        self.motor = motor
+        self.gearbox = gearbox
+        self.rps_step = rps_step
+        self.settle_ms = settle_ms # time to wait at a set point before measuring
+        self.measure_ms = measure_ms # time the pwm is averaged
+        self.timeout_ms = timeout_ms # set points not reached in this time are out of the motor's range
+        self.tolerance = tolerance # relative speed error accepted as reached
+        self.gears = [0, 1] if gearbox else [0]
+        self.gear_idx = 0
+        self.target_rps = 0
+        self.samples = []
+        self.tables = {}
+        self.state = 'idle' # idle, shifting, settling, measuring, done
+        self.state_time = 0
+        self.pwm_sum = 0
+        self.pwm_cnt = 0
+        self.saved_mode = 0
+
+    def is_running(self):
+        return self.state not in ('idle', 'done')
+
+    def start(self):
+        # the wheels must be off the ground, the motor is swept forward through its whole range
+        print("[FFCalibration] Starting feed-forward calibration")
+        self.saved_mode = self.motor.pid.mode
+        self.motor.pid.set_mode(3) # PI only, so the steady pwm is the feed-forward the motor needs
+        self.gear_idx = 0
+        self.tables = {}
+        self._start_gear()
+
+    def abort(self):
+        if self.is_running():
+            print("[FFCalibration] Calibration aborted")
+            self._finish(save = False)
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_time = time.ticks_ms()
+
+    def _start_gear(self):
+        self.samples = []
+        self.target_rps = 0
+        self.motor.set_speed_rps(0)
+        if self.gearbox:
+            self.gearbox.set_gear(self.gears[self.gear_idx])
+        self.motor.pid.set_gear(self.gears[self.gear_idx])
+        self._set_state('shifting')
+
+    def _next_set_point(self):
+        self.target_rps += self.rps_step
+        if self.target_rps > self.motor.max_rps:
+            self._end_gear()
+            return
+        self.motor.set_speed_rps(self.target_rps)
+        self._set_state('settling')
+
+    def _end_gear(self):
+        pid = self.motor.pid
+        table = fit_ff_table(self.samples, pid.ff_table_step_rps, pid.ff_table_size)
+        if table:
+            self.tables[self.gears[self.gear_idx]] = table
+        self.gear_idx += 1
+        if self.gear_idx < len(self.gears):
+            self._start_gear()
+        else:
+            self._finish(save = True)
+
+    def _finish(self, save):
+        self.motor.set_speed_rps(0)
+        if self.gearbox:
+            self.gearbox.set_gear(0)
+        self.motor.pid.set_gear(0)
+        if save:
+            for gear in self.tables:
+                self.motor.pid.set_ff_table(gear, self.tables[gear])
+            if self.motor.pid.supply_mv > 0:
+                # the tables hold the pwm needed at the battery voltage during the sweep
+                self.motor.pid.ff_nominal_mv = self.motor.pid.supply_mv
+            self.motor.pid.save_ff_tables()
+            print(f"[FFCalibration] Calibration done for gears {list(self.tables)}")
+        self.motor.pid.set_mode(self.saved_mode)
+        self._set_state('done')
+
+    def update(self):
+        # non-blocking, called periodically from the main loop
+        if not self.is_running():
+            return
+        elapsed = time.ticks_diff(time.ticks_ms(), self.state_time)
+        if self.state == 'shifting':
+            # give the gearbox servo and the motor time to stop
+            if elapsed > self.settle_ms:
+                self._next_set_point()
+        elif self.state == 'settling':
+            speed = self.motor.get_speed_rps()
+            if elapsed > self.timeout_ms:
+                # the motor can't reach this speed in this gear
+                self._end_gear()
+            elif elapsed > self.settle_ms and abs(speed - self.target_rps) <= self.tolerance * self.target_rps:
+                self.pwm_sum = 0
+                self.pwm_cnt = 0
+                self._set_state('measuring')
+        elif self.state == 'measuring':
+            self.pwm_sum += self.motor.pwm
+            self.pwm_cnt += 1
+            if elapsed > self.measure_ms:
+                self.samples.append((self.target_rps, self.pwm_sum / self.pwm_cnt))
+                self._next_set_point()
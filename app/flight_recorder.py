@@ -0,0 +1,84 @@
+from micropython import const
+from array import array
+import struct
+
+# why the recorder was frozen
+FREEZE_NONE = const(0)
+FREEZE_THERMAL = const(1)
+FREEZE_DISCONNECT = const(2)
+FREEZE_LOW_VOLTAGE = const(3)
+FREEZE_MANUAL = const(4)
+
+# motor control loop record; speeds are in centi-rps, the rest in duty_u16 units
+MOTOR_FIELDS = ('time_ms', 'target', 'filtered_target', 'rps', 'p', 'i', 'ff', 'boost', 'pwm')
+
+_MAGIC = b'FRC1'
+_HEADER_FMT = '<4sBBH' # magic, fields per record, freeze reason, record count
+
+
+class FlightRecorder:
+    def __init__(self, n_fields, size = 400, post_trigger = 50):
+        # records are n_fields int32 values stored back to back in one preallocated array
+        self.n_fields = n_fields
+        self.size = size
+        self.buf = array('i', [0] * (n_fields * size))
+        self.index = 0 # next record to write
+        self.count = 0 # valid records, up to size
+        self.post_trigger = post_trigger # records still written after a trigger, so the aftermath is kept
+        self.post_trigger_left = -1
+        self.frozen = False
+        self.reason = FREEZE_NONE
+
+    def next_offset(self):
+        # returns where the next record starts in buf, or -1 if frozen; the caller fills the n_fields values
+        if self.frozen:
+            return -1
+        if self.post_trigger_left >= 0:
+            if self.post_trigger_left == 0:
+                self.frozen = True
+                return -1
+            self.post_trigger_left -= 1
+        offset = self.index * self.n_fields
+        self.index += 1
+        if self.index >= self.size:
+            self.index = 0
+        if self.count < self.size:
+            self.count += 1
+        return offset
+
+    def trigger(self, reason):
+        # keeps only the first event, the recorder has to be re-armed to catch another one
+        if self.frozen or self.post_trigger_left >= 0:
+            return
+        self.reason = reason
+        self.post_trigger_left = self.post_trigger
+
+    def rearm(self):
+        self.index = 0
+        self.count = 0
+        self.post_trigger_left = -1
+        self.frozen = False
+        self.reason = FREEZE_NONE
+
+    def save(self, file_path):
+        # header followed by the records from oldest to newest, as little-endian int32
+        mv = memoryview(self.buf)
+        with open(file_path, 'wb') as f:
+            f.write(struct.pack(_HEADER_FMT, _MAGIC, self.n_fields, self.reason, self.count))
+            if self.count < self.size:
+                f.write(mv[:self.count * self.n_fields])
+            else:
+                f.write(mv[self.index * self.n_fields:])
+                f.write(mv[:self.index * self.n_fields])
+
+
+def decode_log(data, fields = MOTOR_FIELDS):
+    # turns a saved log back into one array per field; returns (freeze reason, {field: array})
+    magic, n_fields, reason, count = struct.unpack_from(_HEADER_FMT, data, 0)
+    if magic != _MAGIC or n_fields != len(fields):
+        raise ValueError("Not a flight recorder log for these fields")
+    values = array('i', bytes(data[struct.calcsize(_HEADER_FMT):struct.calcsize(_HEADER_FMT) + 4 * n_fields * count]))
+    columns = {}
+    for k in range(n_fields):
+        columns[fields[k]] = array('i', [values[r * n_fields + k] for r in range(count)])
+    return reason, columns
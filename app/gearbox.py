@@ -29,6 +29,11 @@ class Gearbox:
 
     def get_gearing_ratio(self):
         return self.gearing_ratio
+
+
+    def get_gear_ratio(self, gear):
+        # gearing ratio of a gear, without shifting to it
+        return (self.low_gear_ratio if gear == 0 else self.high_gear_ratio) * self.axle_ratio
     
 
     def force_stop(self):
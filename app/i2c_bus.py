@@ -0,0 +1,168 @@
+from machine import I2C, Pin
+from micropython import const
+from array import array
+import time
+
+_MAX_DEVICES = const(8)
+PRIORITY_HIGH = const(0)
+PRIORITY_LOW = const(1)
+
+# one I2CBus per peripheral, shared by every driver on it
+_buses = {}
+
+
+def get_bus(bus_id, scl_pin, sda_pin, freq = 400_000):
+    bus = _buses.get(bus_id)
+    if bus is None:
+        bus = I2CBus(bus_id, scl_pin, sda_pin, freq)
+        _buses[bus_id] = bus
+    return bus
+
+
+def reset_all():
+    for bus in _buses.values():
+        bus.reset_stats()
+
+
+class I2CBus:
+    # owns the I2C peripheral and offers the machine.I2C calls the drivers use, so it can be passed in its place
+    # every transaction is timed and counted per device; each one is a single C call, so the soft timer callbacks
+    # can't interleave inside it, busy only catches drivers called from a hard interrupt or the other core
+    # the device and start time of a transaction stay in the caller's locals: a soft timer callback (the IMU read)
+    # may run a whole transaction of its own between _begin() and _end(), it must not take over the outer one
+    # low priority devices ask slot_free() before a read sequence, so they don't delay a fixed-rate device
+    def __init__(self, bus_id, scl_pin, sda_pin, freq = 400_000):
+        self.i2c = I2C(bus_id, scl = Pin(scl_pin), sda = Pin(sda_pin), freq = freq)
+        self.busy = False
+        self.collisions = 0
+        self.deferrals = 0
+        self.guard_us = 1000 # extra margin kept free before a high priority device is due
+        self.names = []
+        self.addrs = array('B', [0] * _MAX_DEVICES)
+        self.priorities = array('B', [0] * _MAX_DEVICES)
+        self.period_us = array('i', [0] * _MAX_DEVICES) # 0 for devices not read at a fixed rate
+        self.last_start_us = array('i', [0] * _MAX_DEVICES)
+        self.count = array('i', [0] * _MAX_DEVICES)
+        self.errors = array('i', [0] * _MAX_DEVICES)
+        self.total_us = array('i', [0] * _MAX_DEVICES)
+        self.max_us = array('i', [0] * _MAX_DEVICES)
+        self.n_devices = 0
+
+    def register(self, addr, name, priority = PRIORITY_LOW):
+        idx = self._index(addr)
+        if idx >= 0:
+            return idx
+        if self.n_devices >= _MAX_DEVICES:
+            raise ValueError("Too many I2C devices")
+        idx = self.n_devices
+        self.names.append(name)
+        self.addrs[idx] = addr
+        self.priorities[idx] = priority
+        self.n_devices += 1
+        return idx
+
+    def set_period(self, addr, period_us):
+        idx = self._index(addr)
+        if idx >= 0:
+            self.period_us[idx] = period_us
+
+    def _index(self, addr):
+        for i in range(self.n_devices):
+            if self.addrs[i] == addr:
+                return i
+        return -1
+
+    def slot_free(self, addr):
+        # False if a higher priority fixed-rate device is due before a transaction of addr would be done
+        idx = self._index(addr)
+        if idx < 0:
+            return True
+        now = time.ticks_us()
+        needed = self.guard_us
+        if self.count[idx] > 0:
+            needed += self.total_us[idx] // self.count[idx]
+        for i in range(self.n_devices):
+            if self.priorities[i] >= self.priorities[idx] or self.period_us[i] == 0 or self.count[i] == 0:
+                continue
+            due_in = self.period_us[i] - time.ticks_diff(now, self.last_start_us[i])
+            if -self.guard_us < due_in < needed:
+                self.deferrals += 1
+                return False
+        return True
+
+    def _begin(self, addr):
+        # returns the device index; the caller takes the start time right after and keeps both for _end()
+        # a soft timer callback that lands in the few bytecodes before the C call counts as a collision, it's rare
+        idx = self._index(addr)
+        if self.busy:
+            self.collisions += 1
+        self.busy = True
+        return idx
+
+    def _end(self, idx, start_us, error):
+        self.busy = False
+        if idx < 0:
+            return
+        elapsed = time.ticks_diff(time.ticks_us(), start_us)
+        self.last_start_us[idx] = start_us
+        self.count[idx] += 1
+        self.total_us[idx] += elapsed
+        if elapsed > self.max_us[idx]:
+            self.max_us[idx] = elapsed
+        if error:
+            self.errors[idx] += 1
+        if self.total_us[idx] > 0x3FFFFFFF - 100_000:
+            # keep the sums small ints, the average stays the same
+            self.total_us[idx] //= 2
+            self.count[idx] //= 2
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        idx = self._begin(addr)
+        start_us = time.ticks_us()
+        try:
+            data = self.i2c.readfrom_mem(addr, memaddr, nbytes)
+        except Exception:
+            self._end(idx, start_us, True)
+            raise
+        self._end(idx, start_us, False)
+        return data
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        idx = self._begin(addr)
+        start_us = time.ticks_us()
+        try:
+            self.i2c.readfrom_mem_into(addr, memaddr, buf)
+        except Exception:
+            self._end(idx, start_us, True)
+            raise
+        self._end(idx, start_us, False)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        idx = self._begin(addr)
+        start_us = time.ticks_us()
+        try:
+            self.i2c.writeto_mem(addr, memaddr, buf)
+        except Exception:
+            self._end(idx, start_us, True)
+            raise
+        self._end(idx, start_us, False)
+
+    def scan(self):
+        return self.i2c.scan()
+
+    def get_stats(self):
+        # (name, transactions, errors, average us, max us) per device
+        stats = []
+        for i in range(self.n_devices):
+            avg = self.total_us[i] // self.count[i] if self.count[i] else 0
+            stats.append((self.names[i], self.count[i], self.errors[i], avg, self.max_us[i]))
+        return stats
+
+    def reset_stats(self):
+        for i in range(self.n_devices):
+            self.count[i] = 0
+            self.errors[i] = 0
+            self.total_us[i] = 0
+            self.max_us[i] = 0
+        self.collisions = 0
+        self.deferrals = 0
@@ -0,0 +1,26 @@
+from micropython import const
+
+# MPU6050 FIFO with only the accelerometer and gyroscope enabled: every sample is one frame of
+# ax, ay, az, gx, gy, gz as big-endian int16, in register order
+FIFO_FRAME_LEN = const(12)
+FIFO_FRAME_VALUES = const(6)
+FIFO_SIZE = const(1024)
+FIFO_MAX_FRAMES = const(85) # whole frames that fit in the hardware FIFO
+
+
+def decode_be16(buf, n_values, out, out_start = 0):
+    # big-endian int16 from buf into out (array('h')), without slices or struct tuples
+    for i in range(n_values):
+        value = (buf[2 * i] << 8) | buf[2 * i + 1]
+        out[out_start + i] = value - ((value & 0x8000) << 1)
+
+
+def parse_fifo(buf, n_bytes, out):
+    # decodes the whole frames in the first n_bytes of buf into out, FIFO_FRAME_VALUES per frame;
+    # returns the number of frames, a trailing partial frame is ignored
+    frames = n_bytes // FIFO_FRAME_LEN
+    max_frames = len(out) // FIFO_FRAME_VALUES
+    if frames > max_frames:
+        frames = max_frames
+    decode_be16(buf, frames * FIFO_FRAME_VALUES, out)
+    return frames
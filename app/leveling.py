@@ -0,0 +1,48 @@
+class LevelingController:
+    # PI on roll and pitch for the self-leveling suspension mode; the outputs are the roll and pitch inputs of the
+    # suspension mixing matrix, in normalized corner travel (a corner moves by its weight times the output)
+    # anti-windup by back-calculation: after the suspension clamped and slew limited the corners, it reports the
+    # roll and pitch it really applied and the integrators are pulled towards them
+    def __init__(self, dt, kp_roll = 0.01, ki_roll = 0.4, kp_pitch = 0.025, ki_pitch = 1.0, deadband = 0.25, tracking_gain = 0.5):
+        self.dt = dt
+        self.kp_roll = kp_roll # travel per degree
+        self.ki_roll = ki_roll # travel per degree and second
+        self.kp_pitch = kp_pitch
+        self.ki_pitch = ki_pitch
+        self.deadband = deadband # degrees of acceptable incline
+        self.tracking_gain = tracking_gain # fraction of the not applied output removed from the integrators per tick
+        self.max_output = 0.5 # roll plus pitch above this would need more than the full travel on some corner
+        self.roll_integral = 0.0
+        self.pitch_integral = 0.0
+        self.roll_output = 0.0
+        self.pitch_output = 0.0
+
+    def reset(self):
+        self.roll_integral = 0.0
+        self.pitch_integral = 0.0
+        self.roll_output = 0.0
+        self.pitch_output = 0.0
+
+    def _deadband(self, angle):
+        if angle > self.deadband:
+            return angle - self.deadband
+        if angle < -self.deadband:
+            return angle + self.deadband
+        return 0.0
+
+    def update(self, roll, pitch):
+        # the error is the angle itself, the target is level
+        roll = self._deadband(roll)
+        pitch = self._deadband(pitch)
+        self.roll_integral += self.ki_roll * roll * self.dt
+        self.pitch_integral += self.ki_pitch * pitch * self.dt
+        self.roll_integral = max(min(self.roll_integral, self.max_output), -self.max_output)
+        self.pitch_integral = max(min(self.pitch_integral, self.max_output), -self.max_output)
+        # roll has priority for the travel, it is the one that can roll the car over; pitch gets what is left
+        self.roll_output = max(min(self.kp_roll * roll + self.roll_integral, self.max_output), -self.max_output)
+        pitch_limit = self.max_output - abs(self.roll_output)
+        self.pitch_output = max(min(self.kp_pitch * pitch + self.pitch_integral, pitch_limit), -pitch_limit)
+
+    def track(self, roll_applied, pitch_applied):
+        self.roll_integral += self.tracking_gain * (roll_applied - self.roll_output)
+        self.pitch_integral += self.tracking_gain * (pitch_applied - self.pitch_output)
@@ -0,0 +1,96 @@
+from micropython import const
+from array import array
+import struct
+import time
+
+_BUCKETS = const(12) # bucket 0 is < 64us, each next one doubles, the last one holds everything above 65ms
+_BUCKET_SHIFT = const(6)
+_HIST_MAX = const(65535)
+_COUNT_MAX = const(0x3FFFFFFF)
+_ENCODE_FMT = '<BB8sIIIII'
+
+# every LoopStats registers here, the BLE characteristic cycles through them
+registered = []
+_next_index = 0
+
+
+class LoopStats:
+    # timing of a periodic callback: period jitter and execution time histograms plus worst cases
+    # start() and stop() only touch ints and preallocated arrays, so they can run in hard interrupts
+    def __init__(self, name, nominal_us):
+        self.name = name
+        self.nominal_us = nominal_us
+        self.period_hist = array('H', [0] * _BUCKETS) # |period - nominal|
+        self.exec_hist = array('H', [0] * _BUCKETS)
+        self.count = 0
+        self.max_period_us = 0
+        self.max_exec_us = 0
+        self.overruns = 0 # periods more than 1.5x the nominal one
+        self.last_start_us = 0
+        self.start_us = 0
+        self.period_us = 0
+        self.exec_us = 0
+        registered.append(self)
+
+    def _bucket(self, us):
+        us >>= _BUCKET_SHIFT
+        b = 0
+        while us and b < _BUCKETS - 1:
+            us >>= 1
+            b += 1
+        return b
+
+    def start(self):
+        self.start_us = time.ticks_us()
+        if self.last_start_us != 0:
+            self.period_us = time.ticks_diff(self.start_us, self.last_start_us)
+            if self.period_us > self.max_period_us:
+                self.max_period_us = self.period_us
+            if self.period_us * 2 > self.nominal_us * 3:
+                self.overruns += 1
+            b = self._bucket(abs(self.period_us - self.nominal_us))
+            if self.period_hist[b] < _HIST_MAX:
+                self.period_hist[b] += 1
+        self.last_start_us = self.start_us
+
+    def stop(self):
+        self.exec_us = time.ticks_diff(time.ticks_us(), self.start_us)
+        if self.exec_us > self.max_exec_us:
+            self.max_exec_us = self.exec_us
+        b = self._bucket(self.exec_us)
+        if self.exec_hist[b] < _HIST_MAX:
+            self.exec_hist[b] += 1
+        if self.count < _COUNT_MAX:
+            self.count += 1
+
+    def reset(self):
+        for i in range(_BUCKETS):
+            self.period_hist[i] = 0
+            self.exec_hist[i] = 0
+        self.count = 0
+        self.max_period_us = 0
+        self.max_exec_us = 0
+        self.overruns = 0
+        self.last_start_us = 0
+
+    def encode(self, index, total):
+        header = struct.pack(_ENCODE_FMT, index, total, self.name.encode()[:8], self.nominal_us, self.count,
+                             self.max_period_us, self.max_exec_us, self.overruns)
+        return header + bytes(self.period_hist) + bytes(self.exec_hist)
+
+
+def encode_next():
+    # one callback per call, the stats of all of them don't fit in a single BLE attribute
+    global _next_index
+    if not registered:
+        return None
+    if _next_index >= len(registered):
+        _next_index = 0
+    data = registered[_next_index].encode(_next_index, len(registered))
+    _next_index += 1
+    return data
+
+
+def reset_all():
+    for stats in registered:
+        stats.reset()
@@ -2,9 +2,25 @@ import machine
 from machine import Pin, PWM, Timer
 import time
 import micropython
+from micropython import const
+from array import array
+from encoder import EdgeSpeedEstimator
+from flight_recorder import FlightRecorder, MOTOR_FIELDS, FREEZE_THERMAL
+from motor_thermal import MotorThermalModel
+from loop_stats import LoopStats
+import utils
+import ujson
 
 micropython.alloc_emergency_exception_buf(100)
 
+# fixed-point scales used by the integer controller
+# speeds are kept in centi-rps (rps * 100), times in microseconds, pwm in duty_u16 units
+_RPS_SCALE = const(100)
+_Q8 = const(256)
+_I_SCALE = const(10000) # integral accumulator is kept in pwm * _I_SCALE
+_FF_TABLE_STEP_RPS = const(5) # step between feed-forward table entries
+_FF_TABLE_MAX_RPS = const(450)
+
 class MotorPID():
     def __init__(self, enc_a_pin, enc_b_pin):
         # output
@@ -31,9 +47,9 @@ class MotorPID():
         self.filtered_target_rps = 0
         # stall paramters
         self.stall_count = 0
-        self.stall_pause_iterations = 0
-        self.stall_pause_time = 2 # how much time the motor is paused if stalled, in seconds
-        self.stall_max_time = 2 # how much time the motor is allowed to be stalled before pausing, in seconds
+        # thermal protection, derates and then pauses the motor based on the estimated winding heat
+        self.thermal = MotorThermalModel()
+        self.thermal_protection = True
         # boost parameters
         self.pwm_boost = 0
         self.new_boost = 0
@@ -49,14 +65,22 @@ class MotorPID():
         # so, 3 updates for 1 pulse, that aproximates 30 iterations needed for 10 pulses
         # so, for 10 pulses needed we can have a delay of even 34 iterations, which is good for low speed, but can be a jittered movement
         self.pulse_count_list_size = 17
-        self.pulse_count_list = [0] * self.pulse_count_list_size
         self.min_pulse_count = 5
+        self.ppr = 12
+        # edge timestamps, at low speed the speed is measured from the time between edges instead of the count per update
+        self.edges = EdgeSpeedEstimator(self.ppr)
+        self.period_measurement = True
+        # the edge period is used up to twice the speed that gives min_pulse_count pulses per update, the counts
+        # above it; the path follows the last measured speed: picked by this update's count, the counts would be
+        # used exactly on the updates that caught one pulse more, and the speed would read high on average
+        # with the period path on, the counts are never too few to need the averaging window
+        self.period_path = True
+        self.period_max_crps = 0 # set in update_fixed_params()
         # encoder
         self.pulse_pin_a = Pin(enc_a_pin, Pin.IN)
         self.pulse_pin_b = Pin(enc_b_pin, Pin.IN)
         self.pulse_pin_a.irq(trigger=(Pin.IRQ_FALLING | Pin.IRQ_RISING), handler=self.pin_a_irq, hard = True)
         self.pulse_pin_b.irq(trigger=(Pin.IRQ_FALLING | Pin.IRQ_RISING), handler=self.pin_b_irq, hard = True)
-        self.ppr = 12
         # minimum values
         self.min_countable_speed = (0 / self.ppr) # rps, below this speed the speed reading is not reliable
         self.deadband = 1 / (self.ppr * self.dt) # how much counts per dt is considered noise
@@ -69,31 +93,92 @@ class MotorPID():
         self.err = 0
         self.err_i = 0
         self.P = 0
+
+        # fixed-point controller, every value below is a small int so update_fixed() does not allocate
+        # and can be called from a hard interrupt
+        self.fixed_point = False
+        self.dt_us = int(self.dt * 1_000_000)
+        self.target_crps = 0
+        self.filtered_target_crps = 0
+        self.old_filtered_target_crps = 0
+        self.current_crps = 0
+        self.last_time_us = 0
+        self.real_dt_us = 0
+        self.ramp_accel_q = 0 # crps per second, multiplied by dt_us // 1_000_000 each tick
+        self.ramp_decel_q = 0
+        self.I_acc = 0
+        self.I_acc_limit = 65535 * _I_SCALE
+        self.boost_fall_q8 = int(self.boost_fall_alpha * _Q8)
+        self.pwm_filter_alpha_q8 = int(self.pwm_filter_alpha * _Q8)
+        self.stall_boost_min_iterations = 0
+        self.min_pulse_count_fixed = 5
+        # encoder window: the ring holds the running pulse count at each tick, so the sum over the last n ticks
+        # is a single subtraction; one extra slot is needed to get the sum over the whole window
+        self.pulse_ring = array('i', [0] * (self.pulse_count_list_size + 1))
+        self.pulse_ring_index = 0
+        self.pulse_window = self.pulse_count_list_size # ticks needed to collect min_pulse_count pulses
+        self.pulse_sign = 0 # sign of the last non-zero count
+        self.pulse_sign_age = self.pulse_count_list_size # ticks since the count last changed sign
+        self.thermal_cut_flag = False
+        # set by the transmission while a gear shift is in progress: the driver shorts the motor at 0 duty, which
+        # brakes through the gears, so the cut drives the feed-forward of shift_crps alone: no torque on the dogs,
+        # and the motor held at the speed of the gear it goes into
+        self.shift_cut = False
+        self.shift_crps = 0
+        # feed-forward pwm for each gear, sampled every _FF_TABLE_STEP_RPS and linearly interpolated
+        # the tables start from the fitted cubic and are replaced by the ones measured with FFCalibration
+        self.ff_table_step_rps = _FF_TABLE_STEP_RPS
+        self.ff_table_size = _FF_TABLE_MAX_RPS // _FF_TABLE_STEP_RPS + 2
+        self.ff_tables = [array('i', [0] * self.ff_table_size), array('i', [0] * self.ff_table_size)]
+        self.ff_table_file = "ff_table.bin"
+        self.build_ff_table()
+        self.load_ff_tables()
+        self.gear = 0
+        self.ff_table = self.ff_tables[self.gear]
+        # PI gains for each gear: kp, ki used together with FF, ki used without FF; AutoTune replaces them
+        self.gear_gains = [[250, 1250, 1400], [250, 1250, 1400]]
+        self.gains_file = "pid_gains.json"
+        self.load_gains()
+        # relay experiment, when set it drives the motor instead of the controller (see autotune.py)
+        self.relay = None
+        # supply voltage compensation: FF and the PI output are scaled by nominal / measured voltage
+        # the sensor task filters the voltage and hands over a single int, so the control loop needs no lock
+        self.voltage_compensation = True
+        self.ff_nominal_mv = 8000 # voltage the FF tables were measured at
+        self.supply_mv = 0
+        self.voltage_scale_q8 = _Q8
+        self.min_voltage_scale_q8 = int(0.8 * _Q8)
+        self.max_voltage_scale_q8 = int(1.5 * _Q8)
         
-        # logging, may be useful for later
-        self.total_time = 0
-        self.log_data = []
-        self.logfile_name = "motor_pid_datalog.csv"
+        # flight recorder, keeps the last seconds of the control loop and freezes on events (thermal cut, disconnect, low voltage)
+        self.recorder = FlightRecorder(len(MOTOR_FIELDS))
+        self.logfile_name = "motor_pid_log.bin"
 
         #opperating mode
         self.mode = 0
-        self.set_mode(self.mode)
+        self._apply_mode(self.mode)
+        self.update_fixed_params()
 
         # flags
         self.stall_boost_enabled = True
         self.start_boost_enabled = True
-        self.logging = False
+        self.logging = True
 
     def pin_a_irq(self, pin):
-        self.total_pulse_count += 1 - 2 * (self.pulse_pin_a.value() ^ self.pulse_pin_b.value())   # +1 if equal, -1 if not
+        step = 1 - 2 * (self.pulse_pin_a.value() ^ self.pulse_pin_b.value())   # +1 if equal, -1 if not
+        self.total_pulse_count += step
+        self.edges.record_edge(time.ticks_us(), step)
 
     def pin_b_irq(self, pin):
-        self.total_pulse_count += 1 - 2 * (self.pulse_pin_a.value() ^ self.pulse_pin_b.value() ^ 1)   # reversed sense for B
+        step = 1 - 2 * (self.pulse_pin_a.value() ^ self.pulse_pin_b.value() ^ 1)   # reversed sense for B
+        self.total_pulse_count += step
+        self.edges.record_edge(time.ticks_us(), step)
 
     def set_target_rps(self, rps):
         if abs(rps) < self.min_countable_speed:
             rps = 0
         self.target_rps = rps
+        self.target_crps = int(rps * _RPS_SCALE)
 
     def pwm_feed_forward(self, rps):
         a = -0.00000314968
@@ -103,9 +188,9 @@ class MotorPID():
         return (a * rps**3 + b * rps**2 + c * rps + d) / 100 * 65535
 
     def update(self):
-        # if motor is stalled, pause the control for a few iterations
-        if self.stall_pause_iterations > 0:
-            self.stall_pause_iterations -= 1
+        # if the motor overheated, keep it off until the thermal model says it cooled down
+        if self.thermal.cut:
+            self.thermal.update(0, 0, self.supply_mv)
             return 0
         
         # 1. calculate actual elapsed time since last update
@@ -132,21 +217,37 @@ class MotorPID():
         self.current_count = self.total_pulse_count
         self.elapsed_counts = self.current_count - self.last_count
         self.last_count = self.current_count
-        self.pulse_count_list.append(self.elapsed_counts)
-        if len(self.pulse_count_list) > self.pulse_count_list_size:
-            self.pulse_count_list.pop(0)
-
-        # average the counts if low count rate and speed is not 0
-        if self.filtered_target_rps != 0 and self.elapsed_counts < self.min_pulse_count:
-            self.pulse_sum = 0
-            self.pulse_iterator = 0
-            while abs(self.pulse_sum) < self.min_pulse_count and self.pulse_iterator < self.pulse_count_list_size:
-                self.pulse_sum += self.pulse_count_list[-1 - self.pulse_iterator]
-                self.pulse_iterator += 1
-            self.elapsed_counts = self.pulse_sum / self.pulse_iterator
+        self.update_pulse_window()
 
         # 4. calculate current speed in rps
-        self.current_rps = self.elapsed_counts / self.ppr * (1 / self.real_dt)
+        if self.period_measurement:
+            self.select_speed_path(int(self.current_rps * _RPS_SCALE))
+        if self.period_measurement and self.period_path:
+            # too few pulses per update for counting, time the encoder edges instead
+            self.current_rps = self.edges.get_speed_crps(time.ticks_us()) / _RPS_SCALE
+        else:
+            # average the counts if low count rate and speed is not 0
+            if not self.period_measurement and self.filtered_target_rps != 0 and self.elapsed_counts < self.min_pulse_count:
+                self.pulse_iterator = self.pulse_window
+                self.pulse_sum = self.pulse_window_sum(self.pulse_iterator)
+                self.elapsed_counts = self.pulse_sum / self.pulse_iterator
+            self.current_rps = self.elapsed_counts / self.ppr * (1 / self.real_dt)
+
+        if self.relay:
+            # auto-tune experiment, the relay output replaces the controller
+            self.pwm = int(self.relay.step(self.current_rps, self.time_now))
+            self.last_pwm = self.pwm
+            return self.pwm
+
+        if self.shift_cut:
+            # the gears are moving, nothing for the integral to wind up on
+            self.I = 0
+            self.stall_count = 0
+            self.pwm = self.pwm_feed_forward_lookup(abs(self.shift_crps)) * self.voltage_scale_q8 // _Q8
+            if self.shift_crps < 0:
+                self.pwm = -self.pwm
+            self.last_pwm = self.pwm
+            return self.pwm
 
         # 5. calculate parameters of PI control
         self.err = self.filtered_target_rps - self.current_rps
@@ -156,22 +257,28 @@ class MotorPID():
         self.I = int(max(-65535, min(self.I, 65535))) # anti windup
 
         # 6. calculate feed-forward
-        self.pwm_ff = self.pwm_feed_forward(abs(self.filtered_target_rps)) * (self.kff/100)
+        self.pwm_ff = self.pwm_feed_forward_lookup(int(abs(self.filtered_target_rps) * _RPS_SCALE)) * (self.kff/100) * self.voltage_scale_q8 / _Q8
         if self.filtered_target_rps < 0:
             self.pwm_ff = -self.pwm_ff
         self.pwm_ff = max(-65535, min(self.pwm_ff, 65535))
 
-        # # 7. check for stall
+        # # 7. check for stall and motor heat
         if self.current_rps == 0 and self.filtered_target_rps != 0:
             self.stall_count += 1
         else:
             self.stall_count = 0
-        if self.stall_count * self.dt > self.stall_max_time: # if stalled for more than 1s, pause control
-            print("[MotorPID] Motor stalled, pausing control.")
-            self.stall_pause_iterations = int(self.stall_pause_time / self.dt)
-            self.stall_count = 0
-            self.I = 0
-            return 0
+        if self.thermal_protection:
+            self.thermal.update(self.last_pwm, int(self.current_rps * _RPS_SCALE), self.supply_mv)
+            if self.thermal.cut:
+                print("[MotorPID] Motor overheated, pausing control.")
+                self.stall_count = 0
+                self.I = 0
+                self.pwm = 0
+                self.last_pwm = 0
+                if self.logging:
+                    self.recorder.trigger(FREEZE_THERMAL)
+                    self.log_record()
+                return 0
 
         # # 8. calculate boosts for start or stall
         # stall boost
@@ -198,26 +305,366 @@ class MotorPID():
 
         # 9. calculate pwm based on feed-forward and PI control
         if abs(self.filtered_target_rps) != 0:
-            self.pwm = self.pwm_ff + self.P + self.I + self.pwm_boost
+            self.pwm = self.pwm_ff + (self.P + self.I) * self.voltage_scale_q8 / _Q8 + self.pwm_boost
             self.pwm = self.pwm * self.pwm_filter_alpha + self.last_pwm * (1 - self.pwm_filter_alpha)
             if self.filtered_target_rps > 0:
                 self.pwm = int(max(self.pwm_ff, min(self.pwm, 65535)))
             else:
                 self.pwm = int(max(-65535, min(self.pwm, -self.pwm_ff)))
+            # derate when the motor is getting hot
+            if self.thermal_protection:
+                self.pwm = max(-self.thermal.pwm_limit, min(self.pwm, self.thermal.pwm_limit))
         else:
             self.pwm = 0
         self.last_pwm = self.pwm
 
-        # logging, may be useful for later
+        if self.logging:
+            self.log_record()
+
+        return self.pwm
+
+    def pulse_window_sum(self, ticks):
+        # pulses counted over the last `ticks` updates
+        idx = self.pulse_ring_index - ticks
+        if idx < 0:
+            idx += self.pulse_count_list_size + 1
+        return self.current_count - self.pulse_ring[idx]
+
+    def select_speed_path(self, speed_crps):
+        # hysteresis between the edge period and the counts, on the last measured speed
+        if self.period_path:
+            if speed_crps > 2 * self.period_max_crps or speed_crps < -2 * self.period_max_crps:
+                self.period_path = False
+        elif -self.period_max_crps < speed_crps < self.period_max_crps:
+            self.period_path = True
+
+    def update_pulse_window(self):
+        # finds the shortest window (newest ticks first) that holds at least min_pulse_count pulses,
+        # so the window is short at high speed and grows up to pulse_count_list_size at crawl speed
+        self.pulse_ring_index += 1
+        if self.pulse_ring_index > self.pulse_count_list_size:
+            self.pulse_ring_index = 0
+        self.pulse_ring[self.pulse_ring_index] = self.current_count
+
+        if self.elapsed_counts != 0:
+            if (self.elapsed_counts > 0 and self.pulse_sign < 0) or (self.elapsed_counts < 0 and self.pulse_sign > 0):
+                self.pulse_sign_age = 0
+            self.pulse_sign = 1 if self.elapsed_counts > 0 else -1
+        if self.pulse_sign_age < self.pulse_count_list_size:
+            self.pulse_sign_age += 1
+
+        if self.period_measurement:
+            # the edge period replaces the window, only the ring is kept up so the counts can take over at any time;
+            # from the full window the search below finds the right one on its first run
+            self.pulse_window = self.pulse_count_list_size
+            return
+
+        if self.pulse_sign_age < self.pulse_count_list_size:
+            # the direction changed inside the window, the sum is not monotonic so scan it from the newest tick
+            self.pulse_window = 1
+            while abs(self.pulse_window_sum(self.pulse_window)) < self.min_pulse_count_fixed and self.pulse_window < self.pulse_count_list_size:
+                self.pulse_window += 1
+        else:
+            # all counts have the same sign, so the sum only grows with the window: the new window is at most
+            # one tick longer than the last one and is shrunk from the oldest tick while it still has enough pulses
+            if self.pulse_window < self.pulse_count_list_size:
+                self.pulse_window += 1
+            while self.pulse_window > 1 and abs(self.pulse_window_sum(self.pulse_window - 1)) >= self.min_pulse_count_fixed:
+                self.pulse_window -= 1
+
+    def build_ff_table(self):
+        for table in self.ff_tables:
+            for i in range(self.ff_table_size):
+                table[i] = int(self.pwm_feed_forward(i * _FF_TABLE_STEP_RPS))
+
+    def set_ff_table(self, gear, values):
+        if gear < 0 or gear >= len(self.ff_tables) or len(values) != self.ff_table_size:
+            print(f"[MotorPID] Invalid feed-forward table for gear {gear}")
+            return
+        table = self.ff_tables[gear]
+        for i in range(self.ff_table_size):
+            table[i] = int(values[i])
+
+    def load_ff_tables(self):
+        # the file holds the raw int32 tables of all gears, one after another, then the voltage they were measured at
+        if not utils.path_exists(self.ff_table_file):
+            return
+        data = utils.load_bytes_from_file(self.ff_table_file)
+        if not data or len(data) != 4 * (self.ff_table_size * len(self.ff_tables) + 1):
+            print("[MotorPID] Feed-forward table file has a wrong size, using the default curve")
+            return
+        values = array('i', data)
+        for gear in range(len(self.ff_tables)):
+            self.set_ff_table(gear, values[gear * self.ff_table_size:(gear + 1) * self.ff_table_size])
+        if values[-1] > 0:
+            self.ff_nominal_mv = values[-1]
+
+    def save_ff_tables(self):
+        data = bytearray()
+        for table in self.ff_tables:
+            data += bytes(table)
+        data += bytes(array('i', [self.ff_nominal_mv]))
+        utils.write_bytes_to_file(self.ff_table_file, data)
+
+    def set_gear(self, gear):
+        if 0 <= gear < len(self.ff_tables):
+            if gear != self.gear:
+                self.gear = gear
+                self.ff_table = self.ff_tables[gear]
+                self._apply_mode(self.mode)
+
+    def rescale_speed(self, factor):
+        # after a gear shift the same wheel speed is another motor speed, the ramp goes on from there
+        self.filtered_target_rps *= factor
+        self.filtered_target_crps = int(self.filtered_target_crps * factor)
+
+    def set_supply_voltage(self, voltage_mv):
+        # called from the sensor task; readings of 0 mean the voltage reader failed
+        if voltage_mv <= 0:
+            return
+        if self.supply_mv == 0:
+            self.supply_mv = voltage_mv
+        else:
+            self.supply_mv += (voltage_mv - self.supply_mv) // 4
+        scale = _Q8
+        if self.voltage_compensation:
+            scale = self.ff_nominal_mv * _Q8 // self.supply_mv
+            scale = max(self.min_voltage_scale_q8, min(scale, self.max_voltage_scale_q8))
+        # a single int store, the control loop reads either the old or the new value
+        self.voltage_scale_q8 = scale
+
+    def set_gear_gains(self, gear, kp, ki):
+        if 0 <= gear < len(self.gear_gains):
+            self.gear_gains[gear] = [kp, ki, ki]
+            if gear == self.gear:
+                self._apply_mode(self.mode)
+
+    def load_gains(self):
+        if not utils.path_exists(self.gains_file):
+            return
+        gains = utils.load_json_from_file(self.gains_file)
+        for gear in range(len(self.gear_gains)):
+            entry = gains.get(str(gear))
+            if entry and len(entry) == 3:
+                self.gear_gains[gear] = entry
+
+    def save_gains(self):
+        gains = {}
+        for gear in range(len(self.gear_gains)):
+            gains[str(gear)] = self.gear_gains[gear]
+        utils.write_content_to_file(self.gains_file, ujson.dumps(gains))
+
+    def update_fixed_params(self):
+        # recompute the integer constants used by update_fixed(), called whenever dt or gains change
+        self.dt_us = int(self.dt * 1_000_000)
+        self.ramp_accel_q = int(self.max_accel * _RPS_SCALE)
+        self.ramp_decel_q = int(self.max_decel * _RPS_SCALE)
+        self.boost_fall_q8 = int(self.boost_fall_alpha * _Q8)
+        self.pwm_filter_alpha_q8 = int(self.pwm_filter_alpha * _Q8)
+        self.stall_boost_min_iterations = int(0.30 / self.dt)
+        self.min_pulse_count_fixed = int(self.min_pulse_count)
+        self.period_max_crps = self.min_pulse_count_fixed * _RPS_SCALE * 1_000_000 // (self.ppr * self.dt_us)
+
+    def pwm_feed_forward_lookup(self, crps):
+        # linear interpolation between table entries, crps is expected to be positive
+        idx = crps // (_FF_TABLE_STEP_RPS * _RPS_SCALE)
+        if idx >= self.ff_table_size - 1:
+            return self.ff_table[self.ff_table_size - 1]
+        frac = crps - idx * (_FF_TABLE_STEP_RPS * _RPS_SCALE)
+        low = self.ff_table[idx]
+        return low + (self.ff_table[idx + 1] - low) * frac // (_FF_TABLE_STEP_RPS * _RPS_SCALE)
+
+    def update_fixed(self):
+        # same steps as update(), but only with integers so no heap allocation happens
+        if self.thermal.cut:
+            self.thermal.update(0, 0, self.supply_mv)
+            return 0
 
-        self.total_time += self.dt
+        # 1. elapsed time in us
+        self.time_now = time.ticks_us()
+        self.real_dt_us = time.ticks_diff(self.time_now, self.last_time_us)
+        if self.last_time_us == 0 or self.real_dt_us >= 2 * self.dt_us or self.real_dt_us <= 0:
+            self.real_dt_us = self.dt_us
+        self.last_time_us = self.time_now
+
+        # 2. ramp limited target
+        self.old_filtered_target_crps = self.filtered_target_crps
+        if self.filtered_target_crps * self.target_crps < 0:
+            target_ramp = self.ramp_decel_q
+        elif abs(self.target_crps) > abs(self.filtered_target_crps):
+            target_ramp = self.ramp_accel_q
+        else:
+            target_ramp = self.ramp_decel_q
+        target_ramp = target_ramp * (self.real_dt_us // 100) // 10000
+        delta = self.target_crps - self.filtered_target_crps
+        if delta > target_ramp:
+            delta = target_ramp
+        elif delta < -target_ramp:
+            delta = -target_ramp
+        self.filtered_target_crps += delta
+
+        # 3. encoder counts, kept in a preallocated ring
+        self.current_count = self.total_pulse_count
+        self.elapsed_counts = self.current_count - self.last_count
+        self.last_count = self.current_count
+        self.update_pulse_window()
+        self.pulse_sum = self.elapsed_counts
+        self.pulse_iterator = 1
+        if not self.period_measurement and self.filtered_target_crps != 0 and self.elapsed_counts < self.min_pulse_count_fixed:
+            self.pulse_iterator = self.pulse_window
+            self.pulse_sum = self.pulse_window_sum(self.pulse_iterator)
+
+        # 4. speed in crps: edge period at low speed, otherwise counts / (iterations * ppr * dt)
+        # computed on the magnitude so rounding is symmetric
+        if self.period_measurement:
+            self.select_speed_path(self.current_crps)
+        if self.period_measurement and self.period_path:
+            self.current_crps = self.edges.get_speed_crps(self.time_now)
+        elif self.pulse_sum < 0:
+            self.current_crps = -(-self.pulse_sum * 1_000_000 // (self.pulse_iterator * self.ppr * self.real_dt_us // _RPS_SCALE))
+        else:
+            self.current_crps = self.pulse_sum * 1_000_000 // (self.pulse_iterator * self.ppr * self.real_dt_us // _RPS_SCALE)
 
-        # if self.logging:
-        #     self.log_data.append((self.total_time, self.filtered_target_rps, self.current_rps, self.pwm))
+        if self.shift_cut:
+            self.I_acc = 0
+            self.I = 0
+            self.stall_count = 0
+            if self.shift_crps < 0:
+                self.pwm = -(self.pwm_feed_forward_lookup(-self.shift_crps) * self.voltage_scale_q8 // _Q8)
+            else:
+                self.pwm = self.pwm_feed_forward_lookup(self.shift_crps) * self.voltage_scale_q8 // _Q8
+            self.last_pwm = self.pwm
+            return self.pwm
+
+        # 5. PI, P is in pwm units, I is accumulated in pwm * _I_SCALE
+        self.err = self.filtered_target_crps - self.current_crps
+        self.P = self.err * self.kp // _RPS_SCALE
+        self.I_acc += self.err * self.ki // _RPS_SCALE * (self.real_dt_us // 100)
+        if self.I_acc > self.I_acc_limit:
+            self.I_acc = self.I_acc_limit
+        elif self.I_acc < -self.I_acc_limit:
+            self.I_acc = -self.I_acc_limit
+        self.I = self.I_acc // _I_SCALE
+
+        # 6. feed-forward
+        if self.filtered_target_crps < 0:
+            self.pwm_ff = -(self.pwm_feed_forward_lookup(-self.filtered_target_crps) * self.kff // 100 * self.voltage_scale_q8 // _Q8)
+        else:
+            self.pwm_ff = self.pwm_feed_forward_lookup(self.filtered_target_crps) * self.kff // 100 * self.voltage_scale_q8 // _Q8
+        if self.pwm_ff > 65535:
+            self.pwm_ff = 65535
+        elif self.pwm_ff < -65535:
+            self.pwm_ff = -65535
+
+        # 7. stall and heat check, the message is left for the main loop since printing allocates
+        if self.current_crps == 0 and self.filtered_target_crps != 0:
+            self.stall_count += 1
+        else:
+            self.stall_count = 0
+        if self.thermal_protection:
+            self.thermal.update(self.last_pwm, self.current_crps, self.supply_mv)
+            if self.thermal.cut:
+                self.thermal_cut_flag = True
+                self.stall_count = 0
+                self.I_acc = 0
+                self.I = 0
+                self.pwm = 0
+                self.last_pwm = 0
+                if self.logging:
+                    self.recorder.trigger(FREEZE_THERMAL)
+                    self.log_record()
+                return 0
+
+        # 8. boosts
+        if self.stall_boost_enabled:
+            if self.stall_count > self.stall_boost_min_iterations:
+                self.pwm_stall_boost = self.stall_count * self.dt_us // 1_000_000
+            else:
+                self.pwm_stall_boost = 0
+        if self.start_boost_enabled:
+            if self.filtered_target_crps != 0 and self.old_filtered_target_crps == 0:
+                self.pwm_start_boost = self.start_boost
+            else:
+                self.pwm_start_boost = 0
+        self.pwm_boost = self.pwm_boost * self.boost_fall_q8 // _Q8
+        self.new_boost = self.pwm_stall_boost + self.pwm_start_boost
+        if self.filtered_target_crps < 0:
+            self.new_boost = -self.new_boost
+        self.pwm_boost += self.new_boost
+        if -10 < self.pwm_boost < 10:
+            self.pwm_boost = 0
 
+        # 9. output
+        if self.filtered_target_crps != 0:
+            # PI output is limited before the voltage scaling so the product stays a small int
+            self.pwm = self.P + self.I
+            if self.pwm > 131070:
+                self.pwm = 131070
+            elif self.pwm < -131070:
+                self.pwm = -131070
+            self.pwm = self.pwm_ff + self.pwm * self.voltage_scale_q8 // _Q8 + self.pwm_boost
+            self.pwm = (self.pwm * self.pwm_filter_alpha_q8 + self.last_pwm * (_Q8 - self.pwm_filter_alpha_q8)) // _Q8
+            if self.filtered_target_crps > 0:
+                if self.pwm > 65535:
+                    self.pwm = 65535
+                if self.pwm < self.pwm_ff:
+                    self.pwm = self.pwm_ff
+            else:
+                if self.pwm < -65535:
+                    self.pwm = -65535
+                if self.pwm > -self.pwm_ff:
+                    self.pwm = -self.pwm_ff
+            if self.thermal_protection:
+                if self.pwm > self.thermal.pwm_limit:
+                    self.pwm = self.thermal.pwm_limit
+                elif self.pwm < -self.thermal.pwm_limit:
+                    self.pwm = -self.thermal.pwm_limit
+        else:
+            self.pwm = 0
+        self.last_pwm = self.pwm
+        if self.logging:
+            self.log_record()
         return self.pwm
 
+    def log_record(self):
+        # writes one record straight into the recorder's array, fields in MOTOR_FIELDS order
+        offset = self.recorder.next_offset()
+        if offset < 0:
+            return
+        buf = self.recorder.buf
+        buf[offset] = time.ticks_ms()
+        if self.fixed_point:
+            buf[offset + 1] = self.target_crps
+            buf[offset + 2] = self.filtered_target_crps
+            buf[offset + 3] = self.current_crps
+        else:
+            buf[offset + 1] = int(self.target_rps * _RPS_SCALE)
+            buf[offset + 2] = int(self.filtered_target_rps * _RPS_SCALE)
+            buf[offset + 3] = int(self.current_rps * _RPS_SCALE)
+        buf[offset + 4] = int(self.P)
+        buf[offset + 5] = int(self.I)
+        buf[offset + 6] = int(self.pwm_ff)
+        buf[offset + 7] = int(self.pwm_boost)
+        buf[offset + 8] = int(self.pwm)
+
+    def get_speed_rps(self):
+        if self.fixed_point:
+            return self.current_crps / _RPS_SCALE
+        return self.current_rps
+
+    def get_filtered_target_rps(self):
+        if self.fixed_point:
+            return self.filtered_target_crps / _RPS_SCALE
+        return self.filtered_target_rps
+
     def set_mode(self, mode):
+        # the control packet carries the mode every time, only a change reloads the gains and resets the integral
+        if mode != self.mode:
+            self._apply_mode(mode)
+
+    def _apply_mode(self, mode):
+        # gains depend on the selected gear, kept as ints for the fixed-point controller
+        kp, ki_ff, ki = self.gear_gains[self.gear]
         # mode 0: using Feed Forward
         if mode == 0:
             self.kff = 100
@@ -227,31 +674,35 @@ class MotorPID():
         # mode 1: using Feed Forward + P
         elif mode == 1:
             self.kff = 95
-            self.kp = 250
+            self.kp = int(kp)
             self.ki = 0
             self.I = 0
         # mode 2: using Feed Forward + P + I
         elif mode == 2:
             self.kff = 95
-            self.kp = 250
-            self.ki = 1250
+            self.kp = int(kp)
+            self.ki = int(ki_ff)
             self.I = 0
         # mode 3: using P + I:
         elif mode == 3:
             self.kff = 0
-            self.kp = 250
-            self.ki = 1400
+            self.kp = int(kp)
+            self.ki = int(ki)
             self.I = 0
         else:
             print(f"[MotorPID] Invalid mode: {mode}")
             return
+        self.I_acc = 0
         self.mode = mode
 
     def save_log(self):
-        with open(self.logfile_name, "w") as f:
-            f.write("time, target_rps, rps, pwm\n")
-            for entry in self.log_data:
-                f.write(f"{entry[0]}, {entry[1]}, {entry[2]}, {entry[3]}\n")
+        # decode it on the host with flight_recorder.decode_log()
+        try:
+            self.recorder.save(self.logfile_name)
+            print(f"[MotorPID] Log saved to {self.logfile_name}")
+        except Exception as e:
+            print(f"[MotorPID] Error saving log: {e}")
+        self.recorder.rearm()
 
 
 class Motor:
@@ -263,11 +714,14 @@ class Motor:
         self.max_pwm = int(65535 * 0.98) # limiting according to IBT-4 datasheet
         self.max_rps = 280 # max rps of the motor, rpm / 60
         self.speed_limit_factor = 1
+        self.requested_rps = 0 # set point before the stability assist's throttle cut
+        self.assist_factor = 1.0
         self.debug_pin = None
         if DEBUG_PIN:
             self.debug_pin = Pin(DEBUG_PIN, Pin.OUT)
         self.irq_timer = Timer()
         self.pwm = 0
+        self.loop_stats = LoopStats('motor', 10000)
 
     def set_speed_limit_factor(self, speed_limit_factor):
         if 0 < speed_limit_factor <= 1:
@@ -289,15 +743,43 @@ class Motor:
     # Positive speed goes forward, negative speed goes backwards
     def set_speed_rps(self, target_speed_rps):
         set_point_rps = (max(-self.max_rps, min(target_speed_rps, self.max_rps)))
-        self.pid.set_target_rps(set_point_rps)
+        self.requested_rps = set_point_rps
+        self.pid.set_target_rps(set_point_rps * self.assist_factor)
+
+    def set_assist_factor(self, factor):
+        # throttle cut from the stability assist, 0..1 of the requested speed; applied at once, not at the next packet
+        factor = max(0.0, min(factor, 1.0))
+        if factor != self.assist_factor:
+            self.assist_factor = factor
+            self.pid.set_target_rps(self.requested_rps * factor)
+
+    def set_shift_cut(self, cut, sync_rps = 0):
+        # no drive torque while the gearbox shifts, the motor turns at sync_rps; the speed is still measured
+        self.pid.shift_crps = int(sync_rps * 100)
+        self.pid.shift_cut = cut
 
     def get_speed_rps(self):
-        return self.pid.current_rps
+        return self.pid.get_speed_rps()
+
+    def get_supply_current_pm(self):
+        # battery current in per-mille of the stall current: the winding current the thermal model estimates
+        # is only drawn from the battery for the duty cycle
+        return self.pid.thermal.current_pm * self.pwm // 65535
+
+    def get_traction_loss(self):
+        # 0..1 from the motor running faster than its filtered target: with open differentials an unloaded wheel
+        # spins up before the PI catches it; 30% overspeed counts as full loss
+        target = self.pid.get_filtered_target_rps()
+        if abs(target) < 5:
+            return 0.0
+        loss = (abs(self.pid.get_speed_rps()) - abs(target)) / abs(target) / 0.3
+        return max(0.0, min(loss, 1.0))
 
     def get_max_speed_rps(self):
         return self.max_rps * self.speed_limit_factor
 
     def control_irq(self, tmr):
+        self.loop_stats.start()
         if self.debug_pin:
             self.debug_pin.on()
 
@@ -318,11 +800,54 @@ class Motor:
 
         if self.debug_pin:
             self.debug_pin.off()
-        
+        self.loop_stats.stop()
+
+    def control_irq_fixed(self, tmr):
+        # integer only version of control_irq, safe to run as a hard interrupt
+        self.loop_stats.start()
+        if self.debug_pin:
+            self.debug_pin.on()
+
+        self.pwm = self.pid.update_fixed()
+        if self.pwm > self.max_pwm:
+            self.pwm = self.max_pwm
+        elif self.pwm < -self.max_pwm:
+            self.pwm = -self.max_pwm
 
-    def start_control_loop(self, interval_ms=10):
+        if self.pwm >= 0:
+            self.in1.duty_u16(self.pwm)
+            self.in2.duty_u16(0)
+            self.dir_is_front = 1
+        else:
+            self.in1.duty_u16(0)
+            self.in2.duty_u16(-self.pwm)
+            self.dir_is_front = 0
+            self.pwm = -self.pwm
+
+        if self.debug_pin:
+            self.debug_pin.off()
+        self.loop_stats.stop()
+
+    def start_control_loop(self, interval_ms=10, fixed_point=False):
         self.pid.dt = interval_ms / 1000
-        self.irq_timer.init(mode=Timer.PERIODIC, period=interval_ms, callback=self.control_irq)
+        self.pid.update_fixed_params()
+        self.pid.fixed_point = fixed_point
+        self.loop_stats.nominal_us = interval_ms * 1000
+        if fixed_point:
+            self.irq_timer.init(mode=Timer.PERIODIC, period=interval_ms, callback=self.control_irq_fixed, hard=True)
+        else:
+            self.irq_timer.init(mode=Timer.PERIODIC, period=interval_ms, callback=self.control_irq)
+
+    def check_thermal_cut(self):
+        # the fixed-point controller can't print from the interrupt, so the cut is reported here
+        if self.pid.thermal_cut_flag:
+            self.pid.thermal_cut_flag = False
+            print("[MotorPID] Motor overheated, pausing control.")
+            return True
+        return False
+
+    def get_thermal_headroom(self):
+        return self.pid.thermal.get_headroom_percent()
 
 
     def stop_control_loop(self):
@@ -0,0 +1,56 @@
+from micropython import const
+
+_PM = const(1000) # per-mille
+_HEAT_SHIFT = const(10) # heat is kept as power << _HEAT_SHIFT
+
+
+class MotorThermalModel:
+    # I^2*t estimate of the winding temperature, integer only so it can run in the hard interrupt control loop
+    # the winding current is estimated from the voltage left after the back-EMF, as a fraction of the stall current
+    # at ref_mv; its square is low-pass filtered with a time constant of dt * 2^tau_shift
+    def __init__(self, ref_mv = 8400, bemf_mv_per_rps = 20, tau_shift = 9, derate_pm = 150, cut_pm = 250, resume_pm = 120, min_limit = 20000):
+        self.ref_mv = ref_mv
+        self.bemf_mv_per_rps = bemf_mv_per_rps # no load: 25000 rpm at 8.4V, ~20 mV per rps
+        self.tau_shift = tau_shift # 9 at 100Hz is ~5s
+        # thresholds for the filtered power, in per-mille of the stall power at ref_mv
+        self.derate_pm = derate_pm # above this the pwm limit goes down linearly...
+        self.cut_pm = cut_pm # ...until here, where the motor is cut
+        self.resume_pm = resume_pm # the motor is released again once it cooled below this
+        self.min_limit = min_limit # pwm limit right before the cut
+        self.heat = 0
+        self.current_pm = 0
+        self.power_pm = 0
+        self.pwm_limit = 65535
+        self.cut = False
+
+    def update(self, pwm, crps, supply_mv):
+        # pwm is the last applied duty (signed), crps the measured speed in centi-rps
+        if supply_mv <= 0:
+            supply_mv = self.ref_mv
+        winding_mv = pwm * supply_mv // 65535 - crps * self.bemf_mv_per_rps // 100
+        if winding_mv < 0:
+            winding_mv = -winding_mv
+        self.current_pm = winding_mv * _PM // self.ref_mv
+        if self.current_pm > 4 * _PM:
+            self.current_pm = 4 * _PM
+        self.power_pm = self.current_pm * self.current_pm // _PM
+        self.heat += ((self.power_pm << _HEAT_SHIFT) - self.heat) >> self.tau_shift
+
+        heat_pm = self.heat >> _HEAT_SHIFT
+        if self.cut:
+            if heat_pm < self.resume_pm:
+                self.cut = False
+        elif heat_pm >= self.cut_pm:
+            self.cut = True
+
+        if self.cut:
+            self.pwm_limit = 0
+        elif heat_pm <= self.derate_pm:
+            self.pwm_limit = 65535
+        else:
+            self.pwm_limit = 65535 - (65535 - self.min_limit) * (heat_pm - self.derate_pm) // (self.cut_pm - self.derate_pm)
+        return self.pwm_limit
+
+    def get_headroom_percent(self):
+        headroom = 100 - (self.heat >> _HEAT_SHIFT) * 100 // self.cut_pm
+        return max(0, min(headroom, 100))
@@ -1,16 +1,30 @@
-from machine import I2C, Pin, Timer
-import ustruct
+from machine import Timer
 import math
 import time
+from array import array
+from loop_stats import LoopStats
+from attitude import MahonyFilter
+from i2c_bus import get_bus, PRIORITY_HIGH
+import utils
+import ujson
+from imu_fifo import FIFO_FRAME_LEN, FIFO_FRAME_VALUES, FIFO_SIZE, FIFO_MAX_FRAMES, decode_be16, parse_fifo
 
 MPU6050_ADDR = const(0x68)
 MPU6050_REG_CONFIG = const(0x1A)
 MPU6050_REG_ACCEL_CONFIG = const(0x1C)
 MPU6050_REG_GYRO_CONFIG = const(0x1B)
 MPU6050_REG_ACCEL_XOUT_H = const(0x3B)
+MPU6050_REG_TEMP_OUT_H = const(0x41)
 MPU6050_REG_GYRO_XOUT_H = const(0x43)
 MPU6050_REG_PWR_MGMT_1 = const(0x6B)
 MPU6050_REG_SMPRT_DIV = const(0x19)
+MPU6050_REG_FIFO_EN = const(0x23)
+MPU6050_REG_USER_CTRL = const(0x6A)
+MPU6050_REG_FIFO_COUNT_H = const(0x72)
+MPU6050_REG_FIFO_R_W = const(0x74)
+FIFO_EN_ACCEL_GYRO = const(0x78) # XG_FIFO_EN | YG_FIFO_EN | ZG_FIFO_EN | ACCEL_FIFO_EN
+USER_CTRL_FIFO_EN = const(0x40)
+USER_CTRL_FIFO_RESET = const(0x04)
 DLPF_CFG_MASK_INVERSE = const(0xF8)
 DLPF_CFG_MASK = const(0x07)
 DLPF_CFG_0 = const(0x00) # Accelerometer: bandwidth=260Hz, delay=0.98ms | Gyroscope: bandwidth=256Hz, delay=0.98ms, Fs=8kHz
@@ -35,11 +49,16 @@ FS_SEL_1 = const(0x01) # Scale range: ±500°/s
 FS_SEL_2 = const(0x02) # Scale range: ±1000°/s
 FS_SEL_3 = const(0x03) # Scale range: ±2000°/s
 G_CONSTANT = const(9.81)
+RAD_TO_DEG = 180.0 / math.pi
+DEG_TO_RAD = math.pi / 180.0
+BURST_LEN = const(14) # accel xyz, temperature, gyro xyz, 0x3B..0x48
 
 class MPU6050:
     def __init__(self, bus_id, scl_pin, sda_pin, addr = MPU6050_ADDR):
-        self.i2c = I2C(bus_id, scl = Pin(scl_pin), sda = Pin(sda_pin))
+        # the bus is shared with the distance sensor, the fixed-rate IMU reads go first
+        self.i2c = get_bus(bus_id, scl_pin, sda_pin)
         self.addr = addr
+        self.i2c.register(addr, 'imu', PRIORITY_HIGH)
         self.accel_x_raw = 0
         self.accel_y_raw = 0
         self.accel_z_raw = 0
@@ -58,17 +77,63 @@ class MPU6050:
         self.gyro_offsets = [0.0, 0.0, 0.0]
         self.accel_sensitivity = 0
         self.gyro_sensitivity = 0
+        # burst read buffers, decoded in place so reading the sensor doesn't allocate
+        self.burst_buf = bytearray(BURST_LEN)
+        self.burst_raw = array('h', [0] * (BURST_LEN // 2)) # ax, ay, az, temp, gx, gy, gz in LSB
+        self.accel_lsb = 0.0 # m/s^2 per LSB
+        self.gyro_lsb = 0.0 # deg/s per LSB
+        self.accel_scales = [0.0, 0.0, 0.0] # LSB to calibrated units, sensitivity and factors combined
+        self.gyro_scales = [0.0, 0.0, 0.0]
+        self.temp_raw = 0
+        self.accel_roll = 0
+        self.accel_pitch = 0
+        # squared limits of the total acceleration within which the accelerometer is trusted as gravity, to skip the sqrt
+        self.stationary_g_sq_min = (0.95 * G_CONSTANT) ** 2
+        self.stationary_g_sq_max = (1.05 * G_CONSTANT) ** 2
         self.read_timer = Timer()
         self.pitch = 0
         self.roll = 0
         self.yaw = 0
         self.last_update_time = 0
-        self.complementary_filter_alpha_stationary = 0.9800
-        self.complementary_filter_alpha_motion= 0.9998
+        # the sensor is mounted with x up, y forward and z to the left
+        self.attitude = MahonyFilter()
+        self.loop_stats = LoopStats('imu', 10000)
+        # calibration stored on flash with the die temperature it was measured at, so boot doesn't recalibrate;
+        # the gyro offsets are refined in the background whenever the car stands still
+        self.calibration_file = "imu_calibration.json"
+        self.calibration_temp_c = 0
+        self.max_calibration_temp_diff = 15 # offsets stored further away from the current temperature are replaced on the first refinement
+        self.temp_buf = bytearray(2)
+        self.vehicle_stationary = False # set by the car from the encoder speed
+        self.refine_samples = 200 # samples per stationary window
+        self.refine_max_variance = 0.02 # (deg/s)^2, above this something is moving the car
+        self.refine_max_rate = 3.0 # deg/s, a larger mean is a slow turn rather than bias
+        self.refine_gain = 0.5 # fraction of the residual bias removed per window
+        self.refine_stale = False
+        self.refine_count = 0
+        self.refine_sum = array('f', [0.0, 0.0, 0.0])
+        self.refine_sum_sq = array('f', [0.0, 0.0, 0.0])
+        self.refinements = 0
+        self.calibration_dirty = False
+        self.calibration_save_interval_ms = 60000 # limits the flash writes
+        self.saved_gyro_offsets = array('f', [0.0, 0.0, 0.0]) # as on flash, refinements are only saved once they moved away
+        self.calibration_save_threshold = 0.05 # deg/s
+        self.last_calibration_save = 0
+        # fifo mode, samples are drained in batches and filtered with the exact sample period
+        self.fifo_mode = False
+        self.fifo_sample_dt = 0.0 # seconds
+        self.fifo_count_buf = bytearray(2)
+        self.fifo_buf = bytearray(FIFO_MAX_FRAMES * FIFO_FRAME_LEN)
+        self.fifo_mv = memoryview(self.fifo_buf)
+        # a view for every whole number of frames, slicing fifo_mv in the drain would allocate a new one each time
+        self.fifo_views = [self.fifo_mv[:n * FIFO_FRAME_LEN] for n in range(FIFO_MAX_FRAMES + 1)]
+        self.fifo_raw = array('h', [0] * (FIFO_MAX_FRAMES * FIFO_FRAME_VALUES))
+        self.fifo_samples = 0
+        self.fifo_overflows = 0
         
         # wake up
         self.i2c.writeto_mem(self.addr, MPU6050_REG_PWR_MGMT_1, bytes([0]))
-        time.sleep(0.5)
+        time.sleep(0.1) # gyro start-up takes 30ms
 
         # adjust sample rate; sample rate = gyro output rate (Fs) / (1 + sample_rate_div)
         sample_rate_div = 9 # divide Fs by 10 (1 + 9), with dlpf_cfg_6, Fs = 1kHz, so sample rate = 100Hz
@@ -98,25 +163,47 @@ class MPU6050:
         self.accel_sensitivity = ACC_SEN_TABLE[(accel_cfg[0] & AFS_SEL_MASK) >> 3]
         gyro_cfg = self.i2c.readfrom_mem(self.addr, MPU6050_REG_GYRO_CONFIG, 1)
         self.gyro_sensitivity = GYRO_SEN_TABLE[(gyro_cfg[0] & FS_SEL_MASK) >> 3]
-        
-        
-    def read_accelerometer_raw(self):
-        data = self.i2c.readfrom_mem(self.addr, MPU6050_REG_ACCEL_XOUT_H, 6)
+        self.update_scale_factors()
+
+    def update_scale_factors(self):
+        # call again if accel_factors or gyro_factors change
+        self.accel_lsb = G_CONSTANT / self.accel_sensitivity
+        self.gyro_lsb = 1 / self.gyro_sensitivity
+        for i in range(3):
+            self.accel_scales[i] = self.accel_lsb * self.accel_factors[i]
+            self.gyro_scales[i] = self.gyro_lsb * self.gyro_factors[i]
+
+    def read_burst(self):
+        # accel, temperature and gyro in one I2C transaction, big-endian int16 decoded without slices or tuples
+        self.i2c.readfrom_mem_into(self.addr, MPU6050_REG_ACCEL_XOUT_H, self.burst_buf)
         if self.accel_sensitivity == 0:
             self.read_sensitivity_factors()
-        self.accel_x_raw = ustruct.unpack('>h', data[0:2])[0] / self.accel_sensitivity * G_CONSTANT
-        self.accel_y_raw = ustruct.unpack('>h', data[2:4])[0] / self.accel_sensitivity * G_CONSTANT
-        self.accel_z_raw = ustruct.unpack('>h', data[4:6])[0] / self.accel_sensitivity * G_CONSTANT
+        decode_be16(self.burst_buf, BURST_LEN // 2, self.burst_raw)
+        self.temp_raw = self.burst_raw[3]
+        self.scale_sample(self.burst_raw, 0, 4)
+
+    def scale_sample(self, raw, accel_idx, gyro_idx):
+        # calibrated accel and gyro from raw LSB values starting at the given indexes
+        self.accel_x = raw[accel_idx] * self.accel_scales[0] + self.accel_offsets[0]
+        self.accel_y = raw[accel_idx + 1] * self.accel_scales[1] + self.accel_offsets[1]
+        self.accel_z = raw[accel_idx + 2] * self.accel_scales[2] + self.accel_offsets[2]
+        self.gyro_x = raw[gyro_idx] * self.gyro_scales[0] + self.gyro_offsets[0]
+        self.gyro_y = raw[gyro_idx + 1] * self.gyro_scales[1] + self.gyro_offsets[1]
+        self.gyro_z = raw[gyro_idx + 2] * self.gyro_scales[2] + self.gyro_offsets[2]
+
+    def read_accelerometer_raw(self):
+        self.read_burst()
+        self.accel_x_raw = self.burst_raw[0] * self.accel_lsb
+        self.accel_y_raw = self.burst_raw[1] * self.accel_lsb
+        self.accel_z_raw = self.burst_raw[2] * self.accel_lsb
         return self.accel_x_raw, self.accel_y_raw, self.accel_z_raw
 
 
     def read_gyroscope_raw(self):
-        data = self.i2c.readfrom_mem(self.addr, MPU6050_REG_GYRO_XOUT_H, 6)
-        if self.gyro_sensitivity == 0:
-            self.read_sensitivity_factors()
-        self.gyro_x_raw = ustruct.unpack('>h', data[0:2])[0] / self.gyro_sensitivity
-        self.gyro_y_raw = ustruct.unpack('>h', data[2:4])[0] / self.gyro_sensitivity
-        self.gyro_z_raw = ustruct.unpack('>h', data[4:6])[0] / self.gyro_sensitivity
+        self.read_burst()
+        self.gyro_x_raw = self.burst_raw[4] * self.gyro_lsb
+        self.gyro_y_raw = self.burst_raw[5] * self.gyro_lsb
+        self.gyro_z_raw = self.burst_raw[6] * self.gyro_lsb
         return self.gyro_x_raw, self.gyro_y_raw, self.gyro_z_raw
     
     def calibrate(self, samples = 1000):
@@ -130,14 +217,13 @@ class MPU6050:
             sample_rate_duration = 1 / (1000 / (1 + sample_rate_div)) # duration between samples in seconds
 
             for _ in range(samples):
-                self.read_accelerometer_raw()
-                self.read_gyroscope_raw()
-                acc_sum_x += self.accel_x_raw * self.accel_factors[0]
-                acc_sum_y += self.accel_y_raw * self.accel_factors[1]
-                acc_sum_z += self.accel_z_raw * self.accel_factors[2]
-                gyro_sum_x += self.gyro_x_raw * self.gyro_factors[0]
-                gyro_sum_y += self.gyro_y_raw * self.gyro_factors[1]
-                gyro_sum_z += self.gyro_z_raw * self.gyro_factors[2]
+                self.read_burst()
+                acc_sum_x += self.burst_raw[0] * self.accel_scales[0]
+                acc_sum_y += self.burst_raw[1] * self.accel_scales[1]
+                acc_sum_z += self.burst_raw[2] * self.accel_scales[2]
+                gyro_sum_x += self.burst_raw[4] * self.gyro_scales[0]
+                gyro_sum_y += self.burst_raw[5] * self.gyro_scales[1]
+                gyro_sum_z += self.burst_raw[6] * self.gyro_scales[2]
                 time.sleep(sample_rate_duration)
 
             self.accel_offsets = [9.81 - acc_sum_x / samples,
@@ -149,6 +235,96 @@ class MPU6050:
         except Exception as e:
             print(f"Error calibrating IMU: {e}")
 
+    def read_temperature(self):
+        # die temperature in degrees C
+        self.i2c.readfrom_mem_into(self.addr, MPU6050_REG_TEMP_OUT_H, self.temp_buf)
+        value = (self.temp_buf[0] << 8) | self.temp_buf[1]
+        self.temp_raw = value - ((value & 0x8000) << 1)
+        return self.temp_raw / 340 + 36.53
+
+    def load_calibration(self):
+        # returns False if there is no usable calibration stored
+        try:
+            if not utils.path_exists(self.calibration_file):
+                return False
+            calibration = utils.load_json_from_file(self.calibration_file)
+            accel_offsets = calibration.get("accel_offsets")
+            gyro_offsets = calibration.get("gyro_offsets")
+            if not accel_offsets or not gyro_offsets or len(accel_offsets) != 3 or len(gyro_offsets) != 3:
+                return False
+            self.accel_offsets = accel_offsets
+            self.gyro_offsets = gyro_offsets
+            for i in range(3):
+                self.saved_gyro_offsets[i] = gyro_offsets[i]
+            self.calibration_temp_c = calibration.get("temp_c", 0)
+            temp_c = self.read_temperature()
+            self.refine_stale = abs(temp_c - self.calibration_temp_c) > self.max_calibration_temp_diff
+            if self.refine_stale:
+                print(f"[MPU6050] Calibration done at {self.calibration_temp_c:.0f}C, now {temp_c:.0f}C; gyro offsets will be refined")
+            return True
+        except Exception as e:
+            print(f"[MPU6050] Error loading calibration: {e}")
+            return False
+
+    def save_calibration(self):
+        try:
+            self.calibration_temp_c = self.read_temperature()
+            calibration = {"accel_offsets": list(self.accel_offsets), "gyro_offsets": list(self.gyro_offsets),
+                           "temp_c": self.calibration_temp_c}
+            utils.write_content_to_file(self.calibration_file, ujson.dumps(calibration))
+            for i in range(3):
+                self.saved_gyro_offsets[i] = self.gyro_offsets[i]
+            self.calibration_dirty = False
+            self.last_calibration_save = time.ticks_ms()
+        except Exception as e:
+            print(f"[MPU6050] Error saving calibration: {e}")
+
+    def set_vehicle_stationary(self, stationary):
+        self.vehicle_stationary = stationary
+
+    def refine_gyro_bias(self):
+        # accumulates the gyro while the wheels don't move; a quiet window's mean is residual bias
+        if not self.vehicle_stationary:
+            self.refine_count = 0
+            return
+        if self.refine_count == 0:
+            for i in range(3):
+                self.refine_sum[i] = 0.0
+                self.refine_sum_sq[i] = 0.0
+        self.refine_sum[0] += self.gyro_x
+        self.refine_sum[1] += self.gyro_y
+        self.refine_sum[2] += self.gyro_z
+        self.refine_sum_sq[0] += self.gyro_x * self.gyro_x
+        self.refine_sum_sq[1] += self.gyro_y * self.gyro_y
+        self.refine_sum_sq[2] += self.gyro_z * self.gyro_z
+        self.refine_count += 1
+        if self.refine_count < self.refine_samples:
+            return
+        n = self.refine_count
+        self.refine_count = 0
+        for i in range(3):
+            mean = self.refine_sum[i] / n
+            if self.refine_sum_sq[i] / n - mean * mean > self.refine_max_variance or abs(mean) > self.refine_max_rate:
+                return
+        gain = 1.0 if self.refine_stale else self.refine_gain
+        for i in range(3):
+            self.gyro_offsets[i] -= gain * self.refine_sum[i] / n
+        # the filter's own bias estimate tracks the same residual, which just shrank by the same fraction
+        self.attitude.bias_x *= 1 - gain
+        self.attitude.bias_y *= 1 - gain
+        self.attitude.bias_z *= 1 - gain
+        self.refine_stale = False
+        self.refinements += 1
+        # a car parked for minutes keeps refining by tiny amounts, those aren't worth a flash write
+        for i in range(3):
+            if abs(self.gyro_offsets[i] - self.saved_gyro_offsets[i]) > self.calibration_save_threshold:
+                self.calibration_dirty = True
+
+    def update_calibration(self):
+        # called from the main loop, the refined offsets are written to flash at most once per interval
+        if self.calibration_dirty and time.ticks_diff(time.ticks_ms(), self.last_calibration_save) > self.calibration_save_interval_ms:
+            self.save_calibration()
+
     def reset(self):
         self.gyro_x = 0
         self.gyro_y = 0
@@ -156,66 +332,130 @@ class MPU6050:
         self.pitch = 0
         self.roll = 0
         self.yaw = 0
-        
+        self.attitude.reset()
+
+    def reset_attitude(self):
+        # attitude from the accelerometer alone, the gyro bias estimate is kept
+        self.read_burst()
+        self.attitude.reset(self.accel_y, self.accel_z, self.accel_x)
+        self.roll = self.attitude.roll
+        self.pitch = self.attitude.pitch
+        self.yaw = self.attitude.yaw
 
     def read_accelerometer(self):
-        self.read_accelerometer_raw()
-        self.accel_x = self.accel_x_raw * self.accel_factors[0] + self.accel_offsets[0]
-        self.accel_y = self.accel_y_raw * self.accel_factors[1] + self.accel_offsets[1]
-        self.accel_z = self.accel_z_raw * self.accel_factors[2] + self.accel_offsets[2]
+        self.read_burst()
         return self.accel_x, self.accel_y, self.accel_z
 
 
     def read_gyroscope(self):
-        self.read_gyroscope_raw()
-        self.gyro_x = self.gyro_x_raw * self.gyro_factors[0] + self.gyro_offsets[0]
-        self.gyro_y = self.gyro_y_raw * self.gyro_factors[1] + self.gyro_offsets[1]
-        self.gyro_z = self.gyro_z_raw * self.gyro_factors[2] + self.gyro_offsets[2]
+        self.read_burst()
         return self.gyro_x, self.gyro_y, self.gyro_z
-    
+
+    def update_accel_angles(self):
+        # roll and pitch from the last accelerometer sample, stored instead of returned to avoid a tuple
+        self.accel_roll = math.atan2(self.accel_z, self.accel_x) * RAD_TO_DEG
+        self.accel_pitch = math.atan2(-self.accel_y, math.sqrt(self.accel_x * self.accel_x + self.accel_z * self.accel_z)) * RAD_TO_DEG
 
     def read_accelerometer_position(self):
         try:
-            self.read_accelerometer()
-            roll = math.atan2(self.accel_z, self.accel_x) * (180.0 / math.pi)
-            pitch = math.atan2(-self.accel_y, math.sqrt(self.accel_x**2 + self.accel_z**2)) * (180.0 / math.pi)
-            return roll, pitch
+            self.read_burst()
+            self.update_accel_angles()
+            return self.accel_roll, self.accel_pitch
         except Exception as e:
             print(f"Error reading position: {e}")
             return 0, 0
 
 
+    def filter_step(self, dt):
+        # attitude filter over the current sample, sensor axes mapped to the car's (forward, left, up)
+        total_g_sq = self.accel_x * self.accel_x + self.accel_y * self.accel_y + self.accel_z * self.accel_z
+        accel_trusted = self.stationary_g_sq_min <= total_g_sq <= self.stationary_g_sq_max
+        self.attitude.update(self.gyro_y * DEG_TO_RAD, self.gyro_z * DEG_TO_RAD, self.gyro_x * DEG_TO_RAD,
+                             self.accel_y, self.accel_z, self.accel_x, dt, accel_trusted)
+        self.roll = self.attitude.roll
+        self.pitch = self.attitude.pitch
+        self.yaw = self.attitude.yaw
+        self.refine_gyro_bias()
+
     def update_position(self, timer):
+        self.loop_stats.start()
         try:
             self.time_now = time.ticks_ms()
-            accel_roll, accel_pitch = self.read_accelerometer_position()
-            self.read_gyroscope()
-            dt = (self.time_now - self.last_update_time) / 1000.0
-            total_g = math.sqrt(self.accel_x**2 + self.accel_y**2 + self.accel_z**2)
-            alpha = self.complementary_filter_alpha_stationary
-            if total_g < 0.95 * G_CONSTANT or total_g > 1.05 * G_CONSTANT:
-                alpha = self.complementary_filter_alpha_motion
-            self.roll = alpha * (self.roll + self.gyro_y * dt) + (1 - alpha) * accel_roll
-            self.pitch = alpha * (self.pitch + self.gyro_z * dt) + (1 - alpha) * accel_pitch
-            self.yaw += self.gyro_x * dt
+            self.read_burst()
+            self.filter_step((self.time_now - self.last_update_time) / 1000.0)
             self.last_update_time = self.time_now
         except Exception as e:
             print(f"Error updating position: {e}")
             self.roll, self.pitch, self.yaw = 0, 0, 0
+        self.loop_stats.stop()
 
 
     def start_reading(self, freq = 100):
-        roll0, pitch0 = self.read_accelerometer_position()
-        self.roll = roll0
-        self.pitch = pitch0
+        self.reset_attitude()
         self.last_update_time = time.ticks_ms()
         interval_ms = int(1000 / freq)
+        self.loop_stats.nominal_us = interval_ms * 1000
+        self.i2c.set_period(self.addr, interval_ms * 1000)
         self.read_timer.init(mode=Timer.PERIODIC, period=interval_ms, callback=self.update_position)
     
 
+    def start_fifo(self, sample_rate = 200, drain_freq = 20):
+        # the sensor samples into its FIFO at sample_rate (up to 1kHz) and the timer drains it in batches,
+        # so late callbacks don't lose samples as long as the FIFO doesn't fill up (85 samples)
+        self.read_timer.deinit()
+        sample_rate_div = max(0, min(255, 1000 // sample_rate - 1)) # Fs is 1kHz with the dlpf on
+        self.i2c.writeto_mem(self.addr, MPU6050_REG_SMPRT_DIV, bytes([sample_rate_div]))
+        self.fifo_sample_dt = (1 + sample_rate_div) / 1000
+        self.reset_attitude()
+        self.i2c.writeto_mem(self.addr, MPU6050_REG_FIFO_EN, bytes([FIFO_EN_ACCEL_GYRO]))
+        self.reset_fifo()
+        self.fifo_mode = True
+        self.last_update_time = time.ticks_ms()
+        interval_ms = int(1000 / drain_freq)
+        self.loop_stats.nominal_us = interval_ms * 1000
+        self.i2c.set_period(self.addr, interval_ms * 1000)
+        self.read_timer.init(mode=Timer.PERIODIC, period=interval_ms, callback=self.drain_fifo)
+
+    def reset_fifo(self):
+        self.i2c.writeto_mem(self.addr, MPU6050_REG_USER_CTRL, bytes([USER_CTRL_FIFO_RESET]))
+        self.i2c.writeto_mem(self.addr, MPU6050_REG_USER_CTRL, bytes([USER_CTRL_FIFO_EN]))
+
+    def drain_fifo(self, timer):
+        self.loop_stats.start()
+        try:
+            self.i2c.readfrom_mem_into(self.addr, MPU6050_REG_FIFO_COUNT_H, self.fifo_count_buf)
+            count = (self.fifo_count_buf[0] << 8) | self.fifo_count_buf[1]
+            if count >= FIFO_SIZE:
+                # a full fifo has dropped bytes and lost the frame alignment, start over
+                self.fifo_overflows += 1
+                self.reset_fifo()
+                count = 0
+            frames = count // FIFO_FRAME_LEN
+            if frames > FIFO_MAX_FRAMES:
+                frames = FIFO_MAX_FRAMES
+            if frames > 0:
+                self.i2c.readfrom_mem_into(self.addr, MPU6050_REG_FIFO_R_W, self.fifo_views[frames])
+                frames = parse_fifo(self.fifo_buf, frames * FIFO_FRAME_LEN, self.fifo_raw)
+                for i in range(frames):
+                    self.scale_sample(self.fifo_raw, i * FIFO_FRAME_VALUES, i * FIFO_FRAME_VALUES + 3)
+                    self.filter_step(self.fifo_sample_dt)
+                self.fifo_samples += frames
+            self.last_update_time = time.ticks_ms()
+        except Exception as e:
+            print(f"Error draining IMU FIFO: {e}")
+            self.roll, self.pitch, self.yaw = 0, 0, 0
+        self.loop_stats.stop()
+
     def read_position(self):
         return self.roll, self.pitch
+
+    def read_gravity(self):
+        # unit up vector in the car frame (forward, left, up)
+        return self.attitude.gravity_x, self.attitude.gravity_y, self.attitude.gravity_z
     
 
     def force_stop(self):
-        self.read_timer.deinit()
\ No newline at end of file
+        self.read_timer.deinit()
+        if self.fifo_mode:
+            self.i2c.writeto_mem(self.addr, MPU6050_REG_USER_CTRL, bytes([0]))
+            self.fifo_mode = False
\ No newline at end of file
@@ -1,6 +1,7 @@
 import time
 from app.ble_server import BLE_Server
 from car import Car
+import loop_stats
 
 _MOTOR_IN1 = 12
 _MOTOR_IN2 = 13
@@ -26,6 +27,7 @@ MAIN_PERIOD_MS = 10
 TELEMETRY_INTERVAL_MS = 100
 ACQUIRE_SENSOR_INTERVAL_MS = 25
 CAR_UPDATE_INTERVAL_MS = 10
+LOOP_STATS_INTERVAL_MS = 500
 
 
 def run():
@@ -43,14 +45,18 @@ def run():
                           ('rr', _RR_SERVO_PIN, 132, 57, 660)]
         my_car.config_mpu6050(_MPU_BUS_ID, _MPU_SCL_PIN, _MPU_SDA_PIN)
         my_car.config_suspension(suspension_cfg)
+        my_car.config_stability()
         ble = BLE_Server("PicoW_BLE", controls_callback=my_car.process_data)
         ble.advertise()
 
         last_telemetry_event_time = 0
         last_acquire_sensor_event_time = 0
         last_car_update_event_time = 0
+        last_loop_stats_event_time = 0
         overtime_cnt = 0
+        main_loop_stats = loop_stats.LoopStats('main', MAIN_PERIOD_MS * 1000)
         while True:
+            main_loop_stats.start()
             time_now = time.ticks_ms()
             ble.blink_task()
 
@@ -62,6 +68,15 @@ def run():
                 my_car.acquire_sensors_data()
                 last_acquire_sensor_event_time = time_now
 
+            if time.ticks_diff(time_now, last_car_update_event_time) > CAR_UPDATE_INTERVAL_MS:
+                my_car.update()
+                last_car_update_event_time = time_now
+
+            if time.ticks_diff(time_now, last_loop_stats_event_time) > LOOP_STATS_INTERVAL_MS:
+                ble.send_loop_stats(loop_stats.encode_next)
+                last_loop_stats_event_time = time_now
+
+            main_loop_stats.stop()
             loop_end_time = time.ticks_ms()
             loop_exec_time = time.ticks_diff(loop_end_time, time_now)
             
@@ -1,8 +1,9 @@
-from machine import Pin, PWM, Timer
+from machine import Pin, PWM
+import servo_scheduler
 
 
 class Servo:
-    def __init__(self, pin, min_pulse_us=500, max_pulse_us=2500, frequency=50, deadzone = 0, speed_ms = 0, control_loop_interval_ms = 0):
+    def __init__(self, pin, min_pulse_us=500, max_pulse_us=2500, frequency=50, deadzone = 0, speed_ms = 0, control_loop_interval_ms = 0, accel_ms = 0):
         self.pulse_width_target_us = 0
         self.min_pulse_us = min_pulse_us
         self.max_pulse_us = max_pulse_us
@@ -13,28 +14,16 @@ class Servo:
         self.servo_pwm_pin.freq(frequency)
         self.current_pulse_width_us = 0
         self.servo_pwm_pin.duty_ns(0)
-        self.max_step_us = self.max_pulse_us - self.min_pulse_us
-        self.control_loop_interval_ms = control_loop_interval_ms
-        self.control_loop_timer = Timer()
+        self.scheduler = None
+        self.index = -1
         if speed_ms > 0 and control_loop_interval_ms > 0:
-            # in servos, speed is often defined as the time it takes to move 60 degrees (666us), so we calculate the max step in microseconds based on that
-            # so, the max step is in us per control loop interval is 666 us divided by the speed in ms, multiplied by the control loop interval in ms
-            self.max_step_us = 666 / speed_ms * self.control_loop_interval_ms
-            self.control_loop_timer.init(period=self.control_loop_interval_ms, mode=Timer.PERIODIC, callback=self.control_loop)
+            # speed limited servos are stepped by the shared scheduler, control_loop_interval_ms is the longest
+            # acceptable step interval; accel_ms is the time to get to full speed, 0 starts and stops at once
+            self.scheduler = servo_scheduler.get_scheduler()
+            self.index = self.scheduler.register(self.servo_pwm_pin, min_pulse_us, max_pulse_us, frequency, speed_ms,
+                                                 control_loop_interval_ms, accel_ms)
         self.is_active = True
     
-
-    def control_loop(self, timer):
-        if self.current_pulse_width_us == 0:
-            return
-        delta_us = self.pulse_width_target_us - self.current_pulse_width_us
-        step_us = max(min(delta_us, self.max_step_us), -self.max_step_us)
-        pulse_width_us = self.current_pulse_width_us + step_us
-        pulse_width_us = max(min(pulse_width_us, self.max_pulse_us), self.min_pulse_us)
-        pulse_width_ns = int(pulse_width_us * 1000)
-        self.servo_pwm_pin.duty_ns(pulse_width_ns)
-        self.current_pulse_width_us = pulse_width_us
-    
     
     def set_angle(self, angle):
         if self.is_active == False:
@@ -50,15 +39,50 @@ class Servo:
         self.pulse_width_target_us = pulse_width_us
         self.angle = angle
 
-        # if control loop is not used or is the first time adjusting position from initialization, set the pulse width directly
-        if self.control_loop_interval_ms == 0 or self.current_pulse_width_us == 0:
+        if self.scheduler:
+            self.scheduler.set_target(self.index, int(pulse_width_us * 1000))
+        else:
+            # without a speed limit the pulse width is set directly
             self.servo_pwm_pin.duty_ns(int(self.pulse_width_target_us * 1000))
             self.current_pulse_width_us = self.pulse_width_target_us
+
+
+    def set_pulse_ns(self, pulse_ns):
+        # the pulse width directly, for callers with their own angle mapping; ints only
+        if self.is_active == False:
+            return
+        self.pulse_width_target_us = pulse_ns // 1000
+        if self.scheduler:
+            self.scheduler.set_target(self.index, pulse_ns)
+        else:
+            self.servo_pwm_pin.duty_ns(pulse_ns)
+            self.current_pulse_width_us = self.pulse_width_target_us
+
+
+    def get_eta_ms(self):
+        # time until the servo is at its target
+        if self.scheduler:
+            return self.scheduler.get_eta_ms(self.index)
+        return 0
+
+
+    def set_arrival_ms(self, arrival_ms):
+        # slows the current move down to end in about arrival_ms, to move together with other servos
+        if self.scheduler and self.scheduler.period_ms > 0:
+            self.scheduler.plan(self.index, arrival_ms // self.scheduler.period_ms)
+
+
+    def get_pulse_width_us(self):
+        if self.scheduler:
+            return self.scheduler.current_ns[self.index] / 1000
+        return self.current_pulse_width_us
             
     
     def deactivate(self):
         self.is_active = False
-        self.control_loop_timer.deinit()
-        self.servo_pwm_pin.duty_ns(0)
+        if self.scheduler:
+            self.scheduler.deactivate(self.index)
+        else:
+            self.servo_pwm_pin.duty_ns(0)
         self.pulse_width_target_us = 0
-        self.current_pulse_width_us = 0
\ No newline at end of file
+        self.current_pulse_width_us = 0
@@ -0,0 +1,295 @@
+from machine import Timer
+from micropython import const
+from array import array
+from loop_stats import LoopStats
+import math
+
+_MAX_SERVOS = const(8)
+
+# one scheduler steps every servo with a speed limit, instead of a Timer per servo
+_scheduler = None
+
+
+def get_scheduler():
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = ServoScheduler()
+    return _scheduler
+
+
+class ServoScheduler:
+    # moves all registered servos towards their targets in one periodic tick, from preallocated int arrays;
+    # pulse widths are in ns, a servo's PWM is only written when its pulse width moved by at least one duty step
+    # the tick runs at the shortest interval any servo asked for, the step sizes are scaled to it
+    # every new target plans a trapezoidal move from the current position and velocity: ticks of acceleration,
+    # cruise and deceleration with their steps, so a tick only counts down and adds; the sums are exact in ints,
+    # the move ends on the target. The acceleration ends exactly on its top speed, the first ticks take 1 ns more
+    # for what doesn't divide. What doesn't fit in whole cruise ticks is one extra tick in the deceleration,
+    # where the speed matches it. A move that can't stop in time overshoots and is planned again from there
+    def __init__(self):
+        self.timer = Timer()
+        self.period_ms = 0
+        self.pwms = []
+        self.rate_ns = array('i', [0] * _MAX_SERVOS) # fastest pulse width change, ns per ms
+        self.accel_ms = array('i', [0] * _MAX_SERVOS) # time to get to full speed, 0 for at once
+        self.max_step_ns = array('i', [0] * _MAX_SERVOS) # per tick
+        self.accel_step_ns = array('i', [0] * _MAX_SERVOS) # velocity change per tick
+        self.quantum_ns = array('i', [0] * _MAX_SERVOS) # pulse width of one duty step at the servo's frequency
+        self.min_ns = array('i', [0] * _MAX_SERVOS)
+        self.max_ns = array('i', [0] * _MAX_SERVOS)
+        self.target_ns = array('i', [0] * _MAX_SERVOS)
+        self.current_ns = array('i', [0] * _MAX_SERVOS) # 0 until the first position, the servo doesn't move from nothing
+        self.written_ns = array('i', [0] * _MAX_SERVOS)
+        self.velocity_ns = array('i', [0] * _MAX_SERVOS) # signed, per tick
+        # the planned move, signed in the direction of the move
+        self.direction = array('b', [0] * _MAX_SERVOS)
+        self.accel_ticks = array('i', [0] * _MAX_SERVOS)
+        self.accel_ns = array('i', [0] * _MAX_SERVOS)
+        self.accel_extra = array('i', [0] * _MAX_SERVOS) # first acceleration ticks that add 1 ns more
+        self.cruise_ticks = array('i', [0] * _MAX_SERVOS)
+        self.cruise_ns = array('i', [0] * _MAX_SERVOS)
+        self.hold_ns = array('i', [0] * _MAX_SERVOS) # the extra deceleration tick, 0 once done
+        self.decel_ticks = array('i', [0] * _MAX_SERVOS)
+        self.decel_ns = array('i', [0] * _MAX_SERVOS)
+        self.return_ticks = array('i', [0] * _MAX_SERVOS) # estimate for coming back after an overshoot
+        self.active = array('B', [0] * _MAX_SERVOS)
+        self.n_servos = 0
+        self.n_active = 0
+        self.writes = 0
+        self.skipped_writes = 0
+        self.busy_us = 0 # time spent in the ticks since the last reset_stats()
+        self.ticks = 0
+        self.loop_stats = LoopStats('servos', 0)
+
+    def register(self, pwm, min_pulse_us, max_pulse_us, frequency, speed_ms, interval_ms, accel_ms = 0):
+        # speed_ms: time for 60 degrees (666 us of pulse width), accel_ms: time to get to that speed;
+        # returns the servo's index
+        if self.n_servos >= _MAX_SERVOS:
+            raise ValueError("Too many scheduled servos")
+        idx = self.n_servos
+        self.pwms.append(pwm)
+        self.rate_ns[idx] = int(666_000 / speed_ms)
+        self.accel_ms[idx] = accel_ms
+        self.quantum_ns[idx] = 1_000_000_000 // frequency // 65536 + 1
+        self.min_ns[idx] = int(min_pulse_us * 1000)
+        self.max_ns[idx] = int(max_pulse_us * 1000)
+        self.active[idx] = 1
+        self.n_servos += 1
+        self.n_active += 1
+        restart = self.period_ms == 0 or interval_ms < self.period_ms
+        if restart:
+            self.period_ms = interval_ms
+            self.loop_stats.nominal_us = interval_ms * 1000
+        for i in range(self.n_servos):
+            self.max_step_ns[i] = self.rate_ns[i] * self.period_ms
+            self.accel_step_ns[i] = self.max_step_ns[i]
+            if self.accel_ms[i] > self.period_ms:
+                self.accel_step_ns[i] = max(1, self.max_step_ns[i] * self.period_ms // self.accel_ms[i])
+        if restart:
+            self.timer.init(period = self.period_ms, mode = Timer.PERIODIC, callback = self.tick)
+        return idx
+
+    def set_target(self, idx, pulse_ns, ticks = 0):
+        # ticks > 0 stretches the move to arrive in about that many ticks, never faster than the limits allow
+        pulse_ns = max(min(pulse_ns, self.max_ns[idx]), self.min_ns[idx])
+        if pulse_ns == self.target_ns[idx] and ticks == 0:
+            # the move planned for it goes on
+            return
+        self.target_ns[idx] = pulse_ns
+        if self.current_ns[idx] == 0:
+            # first position since start: go there directly
+            self.write(idx, pulse_ns)
+            return
+        self.plan(idx, ticks)
+
+    def write(self, idx, pulse_ns):
+        self.current_ns[idx] = pulse_ns
+        self.written_ns[idx] = pulse_ns
+        self.velocity_ns[idx] = 0
+        self.accel_ticks[idx] = 0
+        self.accel_extra[idx] = 0
+        self.cruise_ticks[idx] = 0
+        self.hold_ns[idx] = 0
+        self.decel_ticks[idx] = 0
+        self.return_ticks[idx] = 0
+        self.pwms[idx].duty_ns(pulse_ns)
+        self.writes += 1
+
+    def plan(self, idx, ticks = 0):
+        distance = self.target_ns[idx] - self.current_ns[idx]
+        velocity = self.velocity_ns[idx]
+        self.return_ticks[idx] = 0
+        if distance == 0 and velocity == 0:
+            self.accel_ticks[idx] = 0
+            self.accel_extra[idx] = 0
+            self.cruise_ticks[idx] = 0
+            self.hold_ns[idx] = 0
+            self.decel_ticks[idx] = 0
+            return
+        # everything along the move from here
+        direction = 1 if distance > 0 or (distance == 0 and velocity < 0) else -1
+        distance *= direction
+        v0 = velocity * direction
+        accel = self.accel_step_ns[idx]
+        max_v = self.max_step_ns[idx]
+        if ticks > 1:
+            # slowest cruise that still gets there in ticks from standstill: distance = v * ticks - v^2 / accel,
+            # one tick is kept for the remainder; moving away, the ticks and the way back of the stop come first
+            ticks -= 1
+            stretch_distance = distance
+            if v0 < 0:
+                ticks -= (accel - v0 - 1) // accel
+                stretch_distance += v0 * v0 // (2 * accel)
+            disc = accel * accel * ticks * ticks - 4 * accel * stretch_distance
+            if ticks > 0 and disc >= 0:
+                max_v = max(1, min(max_v, int((accel * ticks - math.sqrt(disc)) / 2)))
+
+        accel_ticks = 0
+        step = 0
+        extra = 0
+        peak = v0
+        if v0 > 0 and v0 * (v0 - accel) > 2 * accel * distance:
+            # too fast to stop on the target: stop past it, the next plan comes back
+            cruise = 0
+            overshoot = v0 * (v0 - accel) // (2 * accel) - distance
+            self.return_ticks[idx] = 2 * int(math.sqrt(overshoot / accel)) + 1
+        else:
+            top = v0
+            if v0 < max_v:
+                # triangle peak: accelerate from v0 to it and decelerate to 0 over the distance
+                top = min(max_v, int(math.sqrt(accel * distance + v0 * v0 / 2)))
+            while True:
+                # whole ticks of at most accel that end on top
+                if top > v0:
+                    accel_ticks = (top - v0 + accel - 1) // accel
+                    step = (top - v0) // accel_ticks
+                    extra = top - v0 - step * accel_ticks
+                else:
+                    accel_ticks = 0
+                    step = 0
+                    extra = 0
+                peak = v0 + accel_ticks * step + extra
+                decel_ticks = (peak + accel - 1) // accel if peak > 0 else 0
+                decel = peak // decel_ticks if decel_ticks else 0
+                cruise = distance - accel_ticks * v0 - step * accel_ticks * (accel_ticks + 1) // 2 \
+                    - extra * (extra + 1) // 2 - extra * (accel_ticks - extra) \
+                    - decel_ticks * peak + decel * decel_ticks * (decel_ticks + 1) // 2
+                if cruise >= 0 or top <= v0:
+                    break
+                top -= accel // 2 + 1
+        decel_ticks = (peak + accel - 1) // accel if peak > 0 else 0
+        decel = peak // decel_ticks if decel_ticks else 0
+        cruise_ticks = 0
+        cruise_step = peak
+        hold = 0
+        if cruise > 0:
+            if peak > 0:
+                cruise_ticks = cruise // peak
+                hold = cruise - cruise_ticks * peak
+            else:
+                # shorter than one acceleration step
+                cruise_ticks = 1
+                cruise_step = cruise
+        self.direction[idx] = direction
+        self.accel_ticks[idx] = accel_ticks
+        self.accel_ns[idx] = step * direction
+        self.accel_extra[idx] = extra
+        self.cruise_ticks[idx] = cruise_ticks
+        self.cruise_ns[idx] = cruise_step * direction
+        self.hold_ns[idx] = hold * direction
+        self.decel_ticks[idx] = decel_ticks
+        self.decel_ns[idx] = decel * direction
+
+    def get_eta_ticks(self, idx):
+        eta = self.accel_ticks[idx] + self.cruise_ticks[idx] + self.decel_ticks[idx] + self.return_ticks[idx]
+        if self.hold_ns[idx] != 0:
+            eta += 1
+        return eta
+
+    def get_eta_ms(self, idx):
+        return self.get_eta_ticks(idx) * self.period_ms
+
+    def deactivate(self, idx):
+        if not self.active[idx]:
+            return
+        self.active[idx] = 0
+        self.n_active -= 1
+        self.target_ns[idx] = 0
+        self.write(idx, 0)
+        if self.n_active == 0:
+            self.timer.deinit()
+
+    def tick(self, timer):
+        self.loop_stats.start()
+        for i in range(self.n_servos):
+            current = self.current_ns[i]
+            if not self.active[i] or current == 0:
+                continue
+            if self.accel_ticks[i] > 0:
+                self.accel_ticks[i] -= 1
+                self.velocity_ns[i] += self.accel_ns[i]
+                if self.accel_extra[i] > 0:
+                    self.accel_extra[i] -= 1
+                    self.velocity_ns[i] += self.direction[i]
+                current += self.velocity_ns[i]
+            elif self.cruise_ticks[i] > 0:
+                self.cruise_ticks[i] -= 1
+                current += self.cruise_ns[i]
+            elif self.decel_ticks[i] > 0:
+                hold = self.hold_ns[i]
+                if hold != 0 and hold * self.direction[i] >= (self.velocity_ns[i] - self.decel_ns[i]) * self.direction[i]:
+                    current += hold
+                    self.hold_ns[i] = 0
+                else:
+                    self.decel_ticks[i] -= 1
+                    self.velocity_ns[i] -= self.decel_ns[i]
+                    current += self.velocity_ns[i]
+                    if self.decel_ticks[i] == 0:
+                        self.velocity_ns[i] = 0
+            elif current != self.target_ns[i]:
+                # the last move overshot
+                self.plan(i)
+                continue
+            else:
+                continue
+            if current > self.max_ns[i]:
+                current = self.max_ns[i]
+            elif current < self.min_ns[i]:
+                current = self.min_ns[i]
+            self.current_ns[i] = current
+            # the duty register only holds 16 bits, smaller changes wouldn't move the servo
+            change = current - self.written_ns[i]
+            if change >= self.quantum_ns[i] or change <= -self.quantum_ns[i] or current == self.target_ns[i]:
+                if change != 0:
+                    self.pwms[i].duty_ns(current)
+                    self.written_ns[i] = current
+                    self.writes += 1
+            else:
+                self.skipped_writes += 1
+        self.loop_stats.stop()
+        self.busy_us += self.loop_stats.exec_us
+        self.ticks += 1
+        if self.busy_us > 0x3FFFFFFF - 100_000:
+            # keep the sums small ints, the load stays the same
+            self.busy_us //= 2
+            self.ticks //= 2
+
+    def get_cpu_load(self):
+        # fraction of the time spent stepping the servos
+        elapsed_us = self.ticks * self.period_ms * 1000
+        return self.busy_us / elapsed_us if elapsed_us > 0 else 0.0
+
+    def get_stats(self):
+        # (servos, busy us, cpu load, PWM writes, writes skipped as below one duty step)
+        return (self.n_servos, self.busy_us, self.get_cpu_load(), self.writes, self.skipped_writes)
+
+    def reset_stats(self):
+        self.busy_us = 0
+        self.writes = 0
+        self.skipped_writes = 0
+        self.ticks = 0
+
+
+def reset_all():
+    if _scheduler is not None:
+        _scheduler.reset_stats()
@@ -1,16 +1,47 @@
 from servo import Servo
+from micropython import const
+from array import array
+
+TABLE_POINTS = const(17) # evenly spaced corner drops, from gain 0 to gain 1
 
 class ServoCorner:
-    def __init__(self, servo_pin, top_limit = 80, bottom_limit= 100, speed_ms = 750):
-        self.servo = Servo(servo_pin, frequency=100, speed_ms=speed_ms, control_loop_interval_ms=5)
+    def __init__(self, servo_pin, top_limit = 80, bottom_limit= 100, speed_ms = 750, accel_ms = 100):
+        self.servo = Servo(servo_pin, frequency=100, speed_ms=speed_ms, control_loop_interval_ms=5, accel_ms=accel_ms)
         self.top_limit = top_limit
         self.bottom_limit = bottom_limit
         self.total_travel = abs(bottom_limit - top_limit)
         self.travel_coef = bottom_limit - top_limit
+        # fastest gain change per second, the servo moves 60 degrees in speed_ms
+        self.max_gain_rate = 60 / (speed_ms / 1000) / self.total_travel if speed_ms > 0 else 100.0
+        # the linkage isn't linear: the table holds the pulse width for evenly spaced drops of the corner,
+        # a gain is then a fraction of travel_mm; linear in the angle until a calibration is loaded
+        self.table_ns = array('i', [0] * TABLE_POINTS)
+        self.table_angles = [0.0] * TABLE_POINTS
+        self.travel_mm = 0 # 0 while not calibrated
+        self.set_height_table(None)
         self.base_gain = 0
         self.gain = 0
         self._update()
 
+    def set_height_table(self, angles, travel_mm = 0):
+        # angles for drops of 0, travel_mm / (TABLE_POINTS - 1), ... travel_mm; None for the linear default
+        for i in range(TABLE_POINTS):
+            if angles:
+                angle = angles[i]
+            else:
+                angle = self.top_limit + self.travel_coef * i / (TABLE_POINTS - 1)
+            self.table_angles[i] = angle
+            self.table_ns[i] = self._pulse_ns(angle)
+        self.travel_mm = travel_mm if angles else 0
+
+    def _pulse_ns(self, angle):
+        if self.top_limit < self.bottom_limit:
+            angle = max(min(angle, self.bottom_limit), self.top_limit)
+        else:
+            angle = max(min(angle, self.top_limit), self.bottom_limit)
+        servo = self.servo
+        return int((servo.min_pulse_us + angle / 180 * (servo.max_pulse_us - servo.min_pulse_us)) * 1000)
+
     def _set_angle(self, angle):
         if self.top_limit < self.bottom_limit:
             angle = max(min(angle, self.bottom_limit), self.top_limit)
@@ -19,22 +50,49 @@ class ServoCorner:
         self.servo.set_angle(angle)
 
     def _update(self):
-        set_point = self.top_limit + self.gain + self.base_gain
-        self._set_angle(set_point)
+        # gain and base_gain are fractions of the travel; Q8 position in the table, then integer interpolation
+        total = self.gain + self.base_gain
+        if total <= 0:
+            pos = 0
+        elif total >= 1:
+            pos = (TABLE_POINTS - 1) << 8
+        else:
+            pos = int(total * ((TABLE_POINTS - 1) << 8))
+        i = pos >> 8
+        pulse_ns = self.table_ns[i]
+        if i < TABLE_POINTS - 1:
+            pulse_ns += ((self.table_ns[i + 1] - pulse_ns) * (pos & 0xFF)) >> 8
+        self.servo.set_pulse_ns(pulse_ns)
+
+    def set_angle(self, angle):
+        # the raw servo angle, for the calibration
+        self._set_angle(angle)
 
     def set_gain(self, gain_norm):
-        self.gain = max(min(gain_norm, 1.), -1.) * self.travel_coef
+        self.gain = max(min(gain_norm, 1.), -1.)
         self._update()
 
     def set_base_gain(self, base_gain_norm):
-        self.base_gain = max(min(base_gain_norm, 1.), 0.) * self.travel_coef
+        self.base_gain = max(min(base_gain_norm, 1.), 0.)
+        self._update()
+
+    def set_gains(self, base_gain_norm, gain_norm):
+        # both at once, the servo is only updated once
+        self.base_gain = max(min(base_gain_norm, 1.), 0.)
+        self.gain = max(min(gain_norm, 1.), -1.)
         self._update()
 
     def add_gain(self, gain_norm):
-        self.gain += max(min(gain_norm, 1.), -1.) * self.travel_coef
+        self.gain += max(min(gain_norm, 1.), -1.)
         self._update()
     def get_total_gain(self):
         return self.base_gain + self.gain
-    
+
+    def get_eta_ms(self):
+        return self.servo.get_eta_ms()
+
+    def set_arrival_ms(self, arrival_ms):
+        self.servo.set_arrival_ms(arrival_ms)
+
     def force_stop(self):
-        self.servo.deactivate()
\ No newline at end of file
+        self.servo.deactivate()
@@ -0,0 +1,114 @@
+from machine import Timer
+from loop_stats import LoopStats
+import math
+
+RAD_TO_DEG = 180.0 / math.pi
+
+
+class YawStability:
+    # stability assist: the yaw rate from the gyro is compared with what a bicycle model expects from the driver's
+    # steering and the speed; turning faster than that in the same direction is oversteer, answered with
+    # counter-steer and a throttle cut. Understeer is left alone, the driver's steering is the answer to it
+    # the reference is v * tan(angle) / (wheelbase + understeer * v^2), and never more than the lateral
+    # acceleration the tyres can give allows: |r| <= a_max / v
+    def __init__(self, wheelbase_mm = 197, understeer = 0.0, max_lateral_mmps2 = 6000, threshold_dps = 15,
+                 steer_gain = 0.8, max_counter_steer = 20, cut_gain = 0.01, min_throttle = 0.3, recovery = 1.0,
+                 min_speed_mmps = 300):
+        self.wheelbase_mm = wheelbase_mm
+        self.understeer = understeer # mm of wheelbase added per (mm/s)^2, 0 for a neutral car
+        self.max_lateral_mmps2 = max_lateral_mmps2
+        self.threshold_dps = threshold_dps # yaw rate above the reference accepted before the assist acts
+        self.steer_gain = steer_gain # wheel degrees of counter-steer per deg/s of excess yaw rate
+        self.max_counter_steer = max_counter_steer # wheel degrees
+        self.cut_gain = cut_gain # throttle cut per deg/s of excess yaw rate
+        self.min_throttle = min_throttle
+        self.recovery = recovery # throttle given back per second once the car is stable
+        self.min_speed_mmps = min_speed_mmps # below this the gyro is trusted over any model
+        self.reference_dps = 0.0
+        self.excess_dps = 0.0
+        self.counter_steer = 0.0
+        self.throttle = 1.0
+        self.active = False
+
+    def reset(self):
+        self.reference_dps = 0.0
+        self.excess_dps = 0.0
+        self.counter_steer = 0.0
+        self.throttle = 1.0
+        self.active = False
+
+    def reference_yaw_rate(self, wheel_angle, speed_mmps):
+        # deg/s, + left, for a wheel angle in degrees (+ left) and the forward speed
+        v = abs(speed_mmps)
+        rate = v * math.tan(wheel_angle / RAD_TO_DEG) / (self.wheelbase_mm + self.understeer * v * v)
+        if v > 0:
+            limit = self.max_lateral_mmps2 / v
+            rate = max(-limit, min(rate, limit))
+        if speed_mmps < 0:
+            rate = -rate
+        return rate * RAD_TO_DEG
+
+    def update(self, yaw_rate_dps, wheel_angle, speed_mmps, dt):
+        # returns the counter-steer in wheel degrees; throttle holds the fraction of the driver's throttle to keep
+        self.excess_dps = 0.0
+        if abs(speed_mmps) >= self.min_speed_mmps:
+            self.reference_dps = self.reference_yaw_rate(wheel_angle, speed_mmps)
+            error = yaw_rate_dps - self.reference_dps
+            # oversteer: the car yaws faster than the model, in the direction it already yaws
+            if yaw_rate_dps > 0 and error > self.threshold_dps:
+                self.excess_dps = error - self.threshold_dps
+            elif yaw_rate_dps < 0 and error < -self.threshold_dps:
+                self.excess_dps = error + self.threshold_dps
+        else:
+            self.reference_dps = 0.0
+        self.active = self.excess_dps != 0
+        if self.active:
+            self.counter_steer = max(-self.max_counter_steer, min(-self.steer_gain * self.excess_dps, self.max_counter_steer))
+            self.throttle = min(self.throttle, max(self.min_throttle, 1 - self.cut_gain * abs(self.excess_dps)))
+        else:
+            self.counter_steer = 0.0
+            self.throttle = min(1.0, self.throttle + self.recovery * dt)
+        return self.counter_steer
+
+
+class StabilityAssist:
+    # runs YawStability at the IMU rate on the car's IMU, steering and motor; off until enabled
+    def __init__(self, imu, steering, motor, wheel_diameter_mm = 82, freq = 100):
+        self.imu = imu
+        self.steering = steering
+        self.motor = motor
+        self.wheel_diameter_mm = wheel_diameter_mm
+        self.gearing_ratio = 1
+        self.freq = freq
+        self.dt = 1 / freq
+        self.yaw = YawStability()
+        self.enabled = False
+        self.update_timer = Timer()
+        self.loop_stats = LoopStats('yaw', 1_000_000 // freq)
+
+    def set_gearing_ratio(self, gearing_ratio):
+        self.gearing_ratio = gearing_ratio
+
+    def set_enabled(self, enabled):
+        self.enabled = enabled
+        if not enabled:
+            self.yaw.reset()
+            self.steering.set_correction(0)
+            self.motor.set_assist_factor(1.0)
+
+    def start_control_loop(self):
+        self.update_timer.init(freq = self.freq, mode = Timer.PERIODIC, callback = self.update)
+
+    def update(self, tmr):
+        if not self.enabled:
+            return
+        self.loop_stats.start()
+        speed_mmps = self.motor.get_speed_rps() * self.gearing_ratio * math.pi * self.wheel_diameter_mm
+        # the imu's x axis points up, its rate is the yaw rate, + left
+        counter_steer = self.yaw.update(self.imu.gyro_x, self.steering.get_command_wheel_angle(), speed_mmps, self.dt)
+        self.steering.set_correction(counter_steer)
+        self.motor.set_assist_factor(self.yaw.throttle)
+        self.loop_stats.stop()
+
+    def force_stop(self):
+        self.update_timer.deinit()
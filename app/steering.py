@@ -1,10 +1,32 @@
 from servo import Servo
-from machine import Timer
+from micropython import const
+from array import array
+import math
+
+_TABLE_SIZE = const(256) # one entry per joystick position
+SPEED_BUCKETS = const(8)
+
+
+def expo(x, amount):
+    # RC style expo on -1..1: softer around the center, same full deflection
+    return (1 - amount) * x + amount * x * x * x
+
+
+def lock_factor(speed_mmps, wheelbase_mm, max_lateral_mmps2, max_wheel_angle):
+    # fraction of the full lock that keeps the lateral acceleration v^2 * tan(angle) / wheelbase under the limit,
+    # the high center of gravity rolls the car over long before the tyres slide
+    if speed_mmps <= 0:
+        return 1.0
+    angle = math.atan(max_lateral_mmps2 * wheelbase_mm / (speed_mmps * speed_mmps))
+    return min(1.0, angle / (max_wheel_angle * math.pi / 180))
 
 
 class Steering:
-    def __init__(self, steering_servo_pin, center = 90., left = 135., right = 45., max_left_pos=-128, max_right_pos=127, center_pos=0, pos_deadzone = 5):
-        self.servo = Servo(steering_servo_pin, frequency=100, speed_ms=250, control_loop_interval_ms=10)
+    # the joystick position is looked up in a table of pulse widths, one table per speed bucket;
+    # the tables hold the deadzone, the expo curve and a full lock that gets smaller with speed
+    def __init__(self, steering_servo_pin, center = 90., left = 135., right = 45., max_left_pos=-128, max_right_pos=127, center_pos=0, pos_deadzone = 5,
+                 expo_amount = 0.3, bucket_mmps = 400, wheelbase_mm = 197, max_lateral_mmps2 = 4000, max_wheel_angle = 30):
+        self.servo = Servo(steering_servo_pin, frequency=100, speed_ms=250, control_loop_interval_ms=10, accel_ms=50)
         self.position = 0
         # angles
         self.center = center
@@ -24,25 +46,102 @@ class Steering:
         else:
             self.min_left_pos = self.center_pos + self.pos_deadzone
             self.min_right_pos = self.center_pos - self.pos_deadzone
+        # response curves
+        self.expo_amount = expo_amount
+        self.bucket_mmps = bucket_mmps # speed range of a bucket, the table is made for its top speed
+        self.wheelbase_mm = wheelbase_mm
+        self.max_lateral_mmps2 = max_lateral_mmps2
+        self.max_wheel_angle = max_wheel_angle # degrees at the wheels at full lock
+        self.first_pos = min(self.max_left_pos, self.max_right_pos) # position of table entry 0
+        self.tables = [array('i', [0] * _TABLE_SIZE) for _ in range(SPEED_BUCKETS)]
+        self.locks = [1.0] * SPEED_BUCKETS
+        self.bucket = 0
+        # the stick's pulse width and the stability assist's correction on top of it
+        self.command_ns = 0
+        self.correction_ns = 0
+        self.center_ns = 0
+        self.min_ns = 0
+        self.max_ns = 0
+        self.ns_per_wheel_deg = 0.0 # + towards the left
+        self.build_tables()
         self.set_steering_position(self.center_pos)
 
+    def build_tables(self):
+        self.center_ns = self._pulse_ns(self.center)
+        left_ns = self._pulse_ns(self.left)
+        right_ns = self._pulse_ns(self.right)
+        self.min_ns = min(left_ns, right_ns)
+        self.max_ns = max(left_ns, right_ns)
+        self.ns_per_wheel_deg = (left_ns - self.center_ns) / self.max_wheel_angle
+        for bucket in range(SPEED_BUCKETS):
+            lock = lock_factor((bucket + 1) * self.bucket_mmps, self.wheelbase_mm, self.max_lateral_mmps2, self.max_wheel_angle)
+            self.locks[bucket] = lock
+            table = self.tables[bucket]
+            for i in range(_TABLE_SIZE):
+                table[i] = self._pulse_ns(self.curve_angle(self.first_pos + i, lock))
 
-    def set_steering_position(self, target_position):
-        angle = self.center # just initialize to avoid unbound variable error
-        # if input is in deadzone
+    def curve_angle(self, target_position, lock = 1.0):
+        # fraction of the full lock from the joystick, past the deadzone, then expo and the speed lock
         if abs(target_position - self.center_pos) < self.pos_deadzone:
-            angle = self.center
-        # if steering left
-        elif min(self.min_left_pos, self.max_left_pos) <= target_position < max(self.min_left_pos, self.max_left_pos):
-            angle = self.center + (target_position - self.min_left_pos) * (self.left - self.center) / (self.max_left_pos - self.min_left_pos)
-        # if steering right
-        elif min(self.min_right_pos, self.max_right_pos) < target_position <= max(self.min_right_pos, self.max_right_pos):
-            angle = self.center + (target_position - self.min_right_pos) * (self.right - self.center) / (self.max_right_pos - self.min_right_pos)
-        # validating
-        if self.left <= angle <= self.right or self.right <= angle <= self.left:
-            self.servo.set_angle(angle)
-            self.position = target_position
-
-    
+            return self.center
+        if min(self.min_left_pos, self.max_left_pos) <= target_position <= max(self.min_left_pos, self.max_left_pos):
+            x = (target_position - self.min_left_pos) / (self.max_left_pos - self.min_left_pos)
+            full = self.left
+        elif min(self.min_right_pos, self.max_right_pos) <= target_position <= max(self.min_right_pos, self.max_right_pos):
+            x = (target_position - self.min_right_pos) / (self.max_right_pos - self.min_right_pos)
+            full = self.right
+        else:
+            # past the ends of the input range
+            x = 1.0
+            full = self.left if (target_position < self.center_pos) == (self.max_left_pos < self.center_pos) else self.right
+        return self.center + lock * expo(x, self.expo_amount) * (full - self.center)
+
+    def _pulse_ns(self, angle):
+        servo = self.servo
+        return int((servo.min_pulse_us + angle / 180 * (servo.max_pulse_us - servo.min_pulse_us)) * 1000)
+
+    def set_speed_mmps(self, speed_mmps):
+        bucket = int(abs(speed_mmps)) // self.bucket_mmps
+        if bucket >= SPEED_BUCKETS:
+            bucket = SPEED_BUCKETS - 1
+        if bucket != self.bucket:
+            self.bucket = bucket
+            # the lock changes at once, even with the joystick held still
+            self.set_steering_position(self.position)
+
+    def set_steering_position(self, target_position):
+        i = target_position - self.first_pos
+        if i < 0:
+            i = 0
+        elif i >= _TABLE_SIZE:
+            i = _TABLE_SIZE - 1
+        self.command_ns = self.tables[self.bucket][i]
+        self.position = target_position
+        self._apply()
+
+    def _apply(self):
+        pulse_ns = self.command_ns + self.correction_ns
+        if pulse_ns < self.min_ns:
+            pulse_ns = self.min_ns
+        elif pulse_ns > self.max_ns:
+            pulse_ns = self.max_ns
+        self.servo.set_pulse_ns(pulse_ns)
+
+    def get_command_wheel_angle(self):
+        # wheel angle the driver asks for, degrees, + left
+        return (self.command_ns - self.center_ns) / self.ns_per_wheel_deg
+
+    def set_correction(self, wheel_angle):
+        # counter-steer of the stability assist, degrees at the wheels, + left
+        correction_ns = int(wheel_angle * self.ns_per_wheel_deg)
+        if correction_ns != self.correction_ns:
+            self.correction_ns = correction_ns
+            self._apply()
+
+    def get_angle(self):
+        servo = self.servo
+        return (servo.pulse_width_target_us - servo.min_pulse_us) * 180 / (servo.max_pulse_us - servo.min_pulse_us)
+
+
     def force_stop(self):
-        self.servo.deactivate()
\ No newline at end of file
+        self.servo.deactivate()
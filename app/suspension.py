@@ -1,13 +1,44 @@
-from servocorner import ServoCorner
+from servocorner import ServoCorner, TABLE_POINTS
 from machine import Timer
+from micropython import const
+from array import array
+from loop_stats import LoopStats
+from leveling import LevelingController
+from articulation import ArticulationAssist
+import utils
+import ujson
+
+# corners, rows of the mixing matrix
+FL = const(0)
+FR = const(1)
+RL = const(2)
+RR = const(3)
+CORNERS = const(4)
+CORNER_NAMES = ('fl', 'fr', 'rl', 'rr')
+
+# inputs, columns of the mixing matrix
+COL_ROLL = const(0)
+COL_PITCH = const(1)
+COL_AXIS_X = const(2)
+COL_AXIS_Y = const(3)
+COL_BOUNCE = const(4)
+COL_BASE = const(5)
+COL_WARP = const(6)
+COLUMNS = const(7)
+
+# where a column's contribution goes
+KIND_GAIN = const(0) # to the corner gain
+KIND_BASE = const(1) # to the corner base gain
 
 class Suspension:
     def __init__(self):
         self.imu = None
+        self.motor = None
         self.fl_servo = None
         self.fr_servo = None
         self.rl_servo = None
         self.rr_servo = None
+        self.servos = [None] * CORNERS # same servos, indexed like the matrix rows
         self.control_loop_freq = 50
         self.min_gain = 0.0
         self.max_gain = 1.0
@@ -16,14 +47,6 @@ class Suspension:
         self.fl_gain = 0
         self.rr_gain = 0
         self.rl_gain = 0
-        self.fr_input_gain = 0
-        self.fl_input_gain = 0
-        self.rr_input_gain = 0
-        self.rl_input_gain = 0
-        self.fr_tilt_gain = 0
-        self.fl_tilt_gain = 0
-        self.rr_tilt_gain = 0
-        self.rl_tilt_gain = 0
         self.bounce_gain = 0
         self.bounce_range = 0.3 # up - down bounce range
         self.bounce_freq = 1.5 # how many full bounces (down - up - down) per second
@@ -31,52 +54,155 @@ class Suspension:
         self.bounce_offset = 0
         self.update_timer = Timer()
         self.mode = 0
+        self.active_mode = -1 # mode the state was last reset for, the car sets mode directly
         self.roll = 0
         self.pitch = 0
-        self.incline_epsilon = 0.25 # degrees of acceptable incline, above this suspension tries to compensate
         # suspension can change roll by -13 to +13 deg, pitch by -5 to +5, and gain is from 0.0 to 1.0
-        self.kp_roll = 0.0075
-        self.kp_pitch = 0.003
-        self.diag_weight = 0
-        self.axis_weight = 0
+        self.leveling = LevelingController(1 / self.control_loop_freq)
         self.wheelbase = 197
         self.trackwidth = 125
+        self.articulation = ArticulationAssist(1 / self.control_loop_freq, self.trackwidth, self.wheelbase)
+        self.paused = False # the calibration moves the servos by itself
+        self.calibration_file = "suspension_calibration.json"
+        self.travel_mm = 0 # corner travel a gain of 1 stands for, 0 while not calibrated
+        self.sync_corners = True # the corners' moves are stretched to end together, the chassis doesn't rock on the way
+        self.loop_stats = LoopStats('susp', 1_000_000 // self.control_loop_freq)
+
+        # every corner gain is a row of the mixing matrix times the input vector; a new mode is a new column
+        # and a new mode mask, update() doesn't change
+        self.mix = array('f', [0.0] * (CORNERS * COLUMNS)) # row major, mix[corner * COLUMNS + column]
+        self.inputs = array('f', [0.0] * COLUMNS)
+        self.column_kind = array('B', [0] * COLUMNS)
+        self.gains = array('f', [0.0] * CORNERS)
+        self.base_gains = array('f', [0.0] * CORNERS)
+        # corner allocation: commanded base + gain, kept in the 0..1 travel and moved at most max_step per tick
+        self.totals = array('f', [0.0] * CORNERS)
+        self.max_step = array('f', [1.0] * CORNERS) # per tick, from the servo speed
+        self.saturated = False # the requested corner gains didn't fit in the travel and were scaled down
+        self.slew_limited = False
+        self.roll_applied = 0.0 # roll and pitch inputs left after the allocation
+        self.pitch_applied = 0.0
+        # corner weights in fl, fr, rl, rr order
+        self.set_mix_column(COL_ROLL, (-1, 1, -1, 1))
+        self.set_mix_column(COL_PITCH, (1, 1, -1, -1))
+        self.set_mix_column(COL_AXIS_X, (1, -1, 1, -1))
+        self.set_mix_column(COL_AXIS_Y, (-1, -1, 1, 1))
+        self.set_mix_column(COL_BOUNCE, (1, 1, 1, 1))
+        self.set_mix_column(COL_BASE, (1, 1, 1, 1), KIND_BASE)
+        self.set_mix_column(COL_WARP, (1, -1, -1, 1))
+        # columns used by each mode, split by kind so update() doesn't branch on it; base is always on
+        self.mode_gain_columns = []
+        self.mode_base_columns = []
+        self.mode_allocates = []
+        self.add_mode((COL_AXIS_X, COL_AXIS_Y, COL_BASE)) # 0: manual, tilts towards the input stick
+        self.add_mode((COL_ROLL, COL_PITCH, COL_BASE), allocate = True) # 1: self-leveling
+        self.add_mode((COL_BOUNCE, COL_BASE)) # 2: bounce, to get the car unstuck
+        self.add_mode((COL_WARP, COL_BASE), allocate = True) # 3: articulation assist, keeps all wheels loaded off-road
+
+    def set_mix_column(self, column, corner_weights, kind = KIND_GAIN):
+        # corner_weights in fl, fr, rl, rr order
+        for corner in range(CORNERS):
+            self.mix[corner * COLUMNS + column] = corner_weights[corner]
+        self.column_kind[column] = kind
+
+    def add_mode(self, columns, allocate = False):
+        # allocate: corners are fitted in their travel and slew limited by the suspension instead of the servos
+        self.mode_gain_columns.append(array('B', [c for c in columns if self.column_kind[c] == KIND_GAIN]))
+        self.mode_base_columns.append(array('B', [c for c in columns if self.column_kind[c] == KIND_BASE]))
+        self.mode_allocates.append(allocate)
+        return len(self.mode_gain_columns) - 1
 
     def set_imu(self, imu):
         self.imu = imu
 
+    def set_motor(self, motor):
+        # wheel slip for the articulation assist
+        self.motor = motor
+
     def start_control_loop(self):
         self.update_timer.init(freq=self.control_loop_freq, mode=Timer.PERIODIC, callback=self.update)
 
     def config_servo(self, corner, servo_pin, top_angle = 100, botton_angle = 80, speed_ms = 750):
         if corner == 'fl':
             self.fl_servo = ServoCorner(servo_pin, top_angle, botton_angle, speed_ms=speed_ms)
+            self.set_corner_servo(FL, self.fl_servo)
         elif corner == 'fr':
             self.fr_servo = ServoCorner(servo_pin, top_angle, botton_angle, speed_ms=speed_ms)
+            self.set_corner_servo(FR, self.fr_servo)
         elif corner == 'rl':
             self.rl_servo = ServoCorner(servo_pin, top_angle, botton_angle, speed_ms=speed_ms)
+            self.set_corner_servo(RL, self.rl_servo)
         elif corner == 'rr':
             self.rr_servo = ServoCorner(servo_pin, top_angle, botton_angle, speed_ms=speed_ms)
+            self.set_corner_servo(RR, self.rr_servo)
+
+    def load_calibration(self):
+        # linkage tables measured by SuspensionCalibration; returns False if there is none for these servos
+        try:
+            if not utils.path_exists(self.calibration_file):
+                return False
+            calibration = utils.load_json_from_file(self.calibration_file)
+            travel_mm = calibration.get("travel_mm", 0)
+            loaded = False
+            for corner in range(CORNERS):
+                servo = self.servos[corner]
+                entry = calibration.get(CORNER_NAMES[corner])
+                if not servo or not entry:
+                    continue
+                if entry.get("limits") != [servo.top_limit, servo.bottom_limit] or len(entry.get("angles", ())) != TABLE_POINTS:
+                    print(f"[Suspension] Calibration of {CORNER_NAMES[corner]} doesn't match its servo limits, not used")
+                    continue
+                servo.set_height_table(entry["angles"], travel_mm)
+                loaded = True
+            if loaded:
+                self.travel_mm = travel_mm
+            return loaded
+        except Exception as e:
+            print(f"[Suspension] Error loading calibration: {e}")
+            return False
+
+    def save_calibration(self):
+        try:
+            calibration = {"travel_mm": self.travel_mm}
+            for corner in range(CORNERS):
+                servo = self.servos[corner]
+                if servo and servo.travel_mm > 0:
+                    calibration[CORNER_NAMES[corner]] = {"limits": [servo.top_limit, servo.bottom_limit], "angles": servo.table_angles}
+            utils.write_content_to_file(self.calibration_file, ujson.dumps(calibration))
+        except Exception as e:
+            print(f"[Suspension] Error saving calibration: {e}")
+
+    def set_corner_servo(self, corner, servo):
+        self.servos[corner] = servo
+        self.max_step[corner] = servo.max_gain_rate / self.control_loop_freq
 
     def set_mode(self, mode):
         self.mode = mode
+        self.active_mode = mode
         # reseting the gains
         if mode == 0:
-            self.fl_input_gain = 0
-            self.fr_input_gain = 0
-            self.rl_input_gain = 0
-            self.rr_input_gain = 0
+            self.inputs[COL_AXIS_X] = 0
+            self.inputs[COL_AXIS_Y] = 0
         elif mode == 1:
-            self.fl_tilt_gain = 0
-            self.fr_tilt_gain = 0
-            self.rl_tilt_gain = 0
-            self.rr_tilt_gain = 0
+            self.leveling.reset()
+            self.inputs[COL_ROLL] = 0
+            self.inputs[COL_PITCH] = 0
+            self.roll_applied = 0.0
+            self.pitch_applied = 0.0
         elif mode == 2:
             self.bounce_gain = 0
             self.bounce_step = abs(self.bounce_step)
+        elif mode == 3:
+            self.articulation.reset()
+            self.inputs[COL_WARP] = 0
+        if 0 <= mode < len(self.mode_allocates) and self.mode_allocates[mode]:
+            # the slew limit starts from where the corners are now
+            for corner in range(CORNERS):
+                self.totals[corner] = self.base_gains[corner] + self.gains[corner]
 
     def set_base_gain(self, gain):
         self.base_gain = gain
+        self.inputs[COL_BASE] = gain
 
     def set_gain(self, gain, corner = 'all'):
         if corner == 'fl' or corner == 'all':
@@ -109,57 +235,76 @@ class Suspension:
         scale = 0.5 * l2_norm / l1_norm # scale factor to convert L2 ball to L1 ball
         # why divide by 2? so, each servo gets a gain in range [0, 1]. Since each corner is affected
         # the total range of the diamond shape must be also 1, so the corners needs to be (+/-0.5, +/-0.5) instead of (+/-1, +/-1)
-        
-        self.fl_input_gain = (x_gain + -y_gain) * scale
-        self.fr_input_gain = (-x_gain + -y_gain) * scale
-        self.rl_input_gain = (x_gain + y_gain) * scale
-        self.rr_input_gain = (-x_gain + y_gain) * scale
+        # the axis columns of the mixing matrix turn these into the corner gains
+        self.inputs[COL_AXIS_X] = x_gain * scale
+        self.inputs[COL_AXIS_Y] = y_gain * scale
 
-    def update(self, tmr):
-        # MODE 0: manual mode, suspension tilts towards the input stick
-        if self.mode == 0:
-            self.fl_gain = self.fl_input_gain
-            self.fr_gain = self.fr_input_gain
-            self.rl_gain = self.rl_input_gain
-            self.rr_gain = self.rr_input_gain
-        # MODE 1: active mode, suspension tries to stabilez the car
-        elif self.mode == 1:
+    def allocate_corners(self):
+        # moves all corners together (heave, doesn't change roll or pitch) to fit them in their travel, keeping the
+        # ride height when possible; if the tilt itself needs more than the travel, it is scaled down to fit
+        lowest = 2.0
+        highest = -2.0
+        for corner in range(CORNERS):
+            if self.gains[corner] < lowest:
+                lowest = self.gains[corner]
+            if self.gains[corner] > highest:
+                highest = self.gains[corner]
+        scale = 1.0
+        self.saturated = highest - lowest > 1.0
+        if self.saturated:
+            scale = 1.0 / (highest - lowest)
+        lowest = 2.0
+        highest = -2.0
+        for corner in range(CORNERS):
+            total = self.base_gains[corner] + self.gains[corner] * scale
+            if total < lowest:
+                lowest = total
+            if total > highest:
+                highest = total
+        heave = 0.0
+        if highest > 1.0:
+            heave = 1.0 - highest
+        if lowest + heave < 0.0:
+            heave = -lowest
+        # the servos can't follow faster than max_step, limiting here keeps the controller aware of it
+        self.slew_limited = False
+        roll_applied = 0.0
+        pitch_applied = 0.0
+        for corner in range(CORNERS):
+            target = self.base_gains[corner] + self.gains[corner] * scale + heave
+            total = self.totals[corner]
+            if target > total + self.max_step[corner]:
+                target = total + self.max_step[corner]
+                self.slew_limited = True
+            elif target < total - self.max_step[corner]:
+                target = total - self.max_step[corner]
+                self.slew_limited = True
+            self.totals[corner] = target
+            self.gains[corner] = target - self.base_gains[corner]
+            # roll and pitch columns are orthogonal with squared norm 4, heave and base drop out
+            roll_applied += self.mix[corner * COLUMNS + COL_ROLL] * target
+            pitch_applied += self.mix[corner * COLUMNS + COL_PITCH] * target
+        self.roll_applied = roll_applied / CORNERS
+        self.pitch_applied = pitch_applied / CORNERS
+
+    def update_inputs(self):
+        # per mode inputs that change every tick
+        if self.mode == 1:
             if self.imu:
-                imu_roll, imu_pitch = self.imu.read_position()
-                self.roll = imu_roll if abs(imu_roll) > self.incline_epsilon else 0
-                self.pitch = imu_pitch if abs(imu_pitch) > self.incline_epsilon else 0
-            roll_correction = self.kp_roll * self.roll
-            pitch_correction = self.kp_pitch * self.pitch
-            # add correction to each corner
-            self.fl_tilt_gain = self.fl_tilt_gain + (-roll_correction + pitch_correction)
-            self.fl_tilt_gain = max(min(self.fl_tilt_gain, 1.0), -1.0)
-            self.fr_tilt_gain = self.fr_tilt_gain + (roll_correction + pitch_correction)
-            self.fr_tilt_gain = max(min(self.fr_tilt_gain, 1.0), -1.0)
-            # for the rear, analize if tilt is more alligned with roll/pitch axis or diagonal
-            rl_diag_correction = roll_correction + pitch_correction
-            rl_axis_correction = -roll_correction - pitch_correction
-            rr_diag_correction = -roll_correction + pitch_correction
-            rr_axis_correction = roll_correction - pitch_correction
-            r = abs(self.roll) * self.trackwidth
-            p = abs(self.pitch) * self.wheelbase
-            self.diag_weight = min(r, p) / max(r, p) if max(r, p) > 0 else 0
-            self.diag_weight = 0
-            self.axis_weight = 1.0 - self.diag_weight
-            rl_gain = self.diag_weight * rl_diag_correction + self.axis_weight * rl_axis_correction
-            rr_gain = self.diag_weight * rr_diag_correction + self.axis_weight * rr_axis_correction
-            self.rl_tilt_gain = self.rl_tilt_gain + rl_gain
-            self.rl_tilt_gain = max(min(self.rl_tilt_gain, 1.0), -1.0)
-            self.rr_tilt_gain = self.rr_tilt_gain + rr_gain
-            self.rr_tilt_gain = max(min(self.rr_tilt_gain, 1.0), -1.0)
-            # set the gain to each corner
-            self.fl_gain = self.fl_tilt_gain
-            self.fr_gain = self.fr_tilt_gain
-            self.rl_gain = self.rl_tilt_gain
-            self.rr_gain = self.rr_tilt_gain
-        # MODE 2: bounce mode, suspension bounces to get the car unstuck
+                # attributes instead of read_position(), no tuple is built
+                self.roll = self.imu.roll
+                self.pitch = self.imu.pitch
+            # anti-windup with what the last allocation could apply
+            self.leveling.track(self.roll_applied, self.pitch_applied)
+            self.leveling.update(self.roll, self.pitch)
+            self.inputs[COL_ROLL] = self.leveling.roll_output
+            self.inputs[COL_PITCH] = self.leveling.pitch_output
         elif self.mode == 2:
             self.bounce_gain += self.bounce_step
-            self.bounce_gain = min(max(self.bounce_gain, 0), self.bounce_range)
+            if self.bounce_gain < 0:
+                self.bounce_gain = 0
+            elif self.bounce_gain > self.bounce_range:
+                self.bounce_gain = self.bounce_range
             if self.bounce_gain <= 0 or self.bounce_gain >= self.bounce_range:
                 self.bounce_step = -self.bounce_step
             if self.base_gain + self.bounce_range > self.max_gain:
@@ -168,48 +313,74 @@ class Suspension:
                 self.bounce_offset = abs(self.base_gain - self.bounce_range)
             else:
                 self.bounce_offset = 0
-            self.fl_gain = self.bounce_gain + self.bounce_offset
-            self.fr_gain = self.bounce_gain + self.bounce_offset
-            self.rl_gain = self.bounce_gain + self.bounce_offset
-            self.rr_gain = self.bounce_gain + self.bounce_offset
-
-        # correcting possible overflow or underflow due to having both base gain and another gain
-        correction = 0
-        max_total_gain = max(self.base_gain + self.fl_gain,
-                       self.base_gain + self.fr_gain,
-                       self.base_gain + self.rl_gain,
-                       self.base_gain + self.rr_gain)
-        min_total_gain = min(self.base_gain + self.fl_gain,
-                        self.base_gain + self.fr_gain,
-                        self.base_gain + self.rl_gain,
-                        self.base_gain + self.rr_gain)
-        if max_total_gain > 1 and min_total_gain > 0:
-            # overflow
-            correction = 1 - max_total_gain
-        elif min_total_gain < 0 and max_total_gain < 1:
-            # underflow
-            correction = -min_total_gain
+            self.inputs[COL_BOUNCE] = self.bounce_gain + self.bounce_offset
+        elif self.mode == 3:
+            if self.imu:
+                self.roll = self.imu.roll
+                self.pitch = self.imu.pitch
+            traction_loss = self.motor.get_traction_loss() if self.motor else 0.0
+            self.inputs[COL_WARP] = self.articulation.update(self.roll, self.pitch, traction_loss)
+
+    def update(self, tmr):
+        if self.paused:
+            return
+        self.loop_stats.start()
+        if self.mode != self.active_mode:
+            self.set_mode(self.mode)
+        self.update_inputs()
+        if 0 <= self.mode < len(self.mode_gain_columns):
+            gain_columns = self.mode_gain_columns[self.mode]
+            base_columns = self.mode_base_columns[self.mode]
+            mix = self.mix
+            inputs = self.inputs
+            for corner in range(CORNERS):
+                row = corner * COLUMNS
+                gain = 0.0
+                for column in gain_columns:
+                    gain += mix[row + column] * inputs[column]
+                base = 0.0
+                for column in base_columns:
+                    base += mix[row + column] * inputs[column]
+                self.gains[corner] = gain
+                self.base_gains[corner] = base
+            # base + gain past the travel is fitted by allocate_corners() in the modes that allocate, in the
+            # others each servo clamps its total to its range
+            if self.mode_allocates[self.mode]:
+                self.allocate_corners()
         else:
-            # both overflow and underflow should not happen at the same time, but if they do, ignore correction
-            # each servo will take care of clamping its gain to its range
-            correction = 0
-        # self.fl_input_gain += correction
-        # self.fr_input_gain += correction
-        # self.rl_input_gain += correction
-        # self.rr_input_gain += correction
+            # unknown mode, the gains are held and only the base follows the input
+            for corner in range(CORNERS):
+                self.base_gains[corner] = self.mix[corner * COLUMNS + COL_BASE] * self.inputs[COL_BASE]
 
-        if self.fl_servo:
-            self.fl_servo.set_base_gain(self.base_gain)
-            self.fl_servo.set_gain(self.fl_gain)
-        if self.fr_servo:
-            self.fr_servo.set_base_gain(self.base_gain)
-            self.fr_servo.set_gain(self.fr_gain)
-        if self.rl_servo:
-            self.rl_servo.set_base_gain(self.base_gain)
-            self.rl_servo.set_gain(self.rl_gain)
-        if self.rr_servo:
-            self.rr_servo.set_base_gain(self.base_gain)
-            self.rr_servo.set_gain(self.rr_gain) 
+        self.fl_gain = self.gains[FL]
+        self.fr_gain = self.gains[FR]
+        self.rl_gain = self.gains[RL]
+        self.rr_gain = self.gains[RR]
+        for corner in range(CORNERS):
+            servo = self.servos[corner]
+            if servo:
+                servo.set_gains(self.base_gains[corner], self.gains[corner])
+        if self.sync_corners:
+            self.sync_corner_arrival()
+        self.loop_stats.stop()
+
+    def sync_corner_arrival(self):
+        # every corner is planned as fast as its servo allows, the faster ones are slowed down to the slowest one
+        eta_max = 0
+        for corner in range(CORNERS):
+            servo = self.servos[corner]
+            if servo:
+                eta = servo.get_eta_ms()
+                if eta > eta_max:
+                    eta_max = eta
+        if eta_max == 0:
+            return
+        for corner in range(CORNERS):
+            servo = self.servos[corner]
+            if servo:
+                eta = servo.get_eta_ms()
+                if 0 < eta < eta_max:
+                    servo.set_arrival_ms(eta_max)
 
 
     def force_stop(self):
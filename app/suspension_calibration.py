@@ -0,0 +1,146 @@
+from ff_calibration import interpolate_points
+from servocorner import TABLE_POINTS
+import math
+import time
+
+DEG_TO_RAD = math.pi / 180
+
+# corner weights of roll and pitch in fl, fr, rl, rr order, as in the suspension mixing matrix
+ROLL_WEIGHTS = (-1, 1, -1, 1)
+PITCH_WEIGHTS = (1, 1, -1, -1)
+
+
+def fit_height_table(samples, travel_mm, points = TABLE_POINTS):
+    # samples are (drop_mm, angle) pairs of one corner; returns the angles for evenly spaced drops up to travel_mm
+    # a drop measured smaller than the one before it is noise, the linkage only goes one way
+    ordered = []
+    last = 0.0
+    for drop, angle in samples:
+        last = max(last, drop)
+        ordered.append((last, angle))
+    return [interpolate_points(ordered, travel_mm * i / (points - 1)) for i in range(points)]
+
+
+class SuspensionCalibration:
+    # measures how far each corner drops along its servo travel, from the chassis tilt seen by the IMU:
+    # on four equal springs, a corner moving by h moves the chassis by h / 4 in roll and pitch at that corner
+    # (the rest goes into the twist), so the drop is 2 * (roll_mm * roll weight + pitch_mm * pitch weight), negated
+    # the car must stand still on flat ground; the suspension loop is paused while the corners are swept
+    def __init__(self, suspension, imu, steps = 9, settle_ms = 800, measure_ms = 400):
+        self.suspension = suspension
+        self.imu = imu
+        self.steps = steps # servo angles measured per corner, top to bottom
+        self.settle_ms = settle_ms
+        self.measure_ms = measure_ms
+        self.corner = 0
+        self.step = 0
+        self.samples = [] # (angle, roll, pitch) of the corner being swept
+        self.tables = [None] * 4 # (drop_mm, angle) per corner
+        self.state = 'idle' # idle, settling, measuring, done
+        self.state_time = 0
+        self.roll_sum = 0.0
+        self.pitch_sum = 0.0
+        self.count = 0
+
+    def is_running(self):
+        return self.state not in ('idle', 'done')
+
+    def start(self):
+        print("[SuspensionCalibration] Starting suspension calibration")
+        self.suspension.paused = True
+        self.corner = 0
+        self.tables = [None] * 4
+        self._start_corner()
+
+    def abort(self):
+        if self.is_running():
+            print("[SuspensionCalibration] Calibration aborted")
+            self._finish(save = False)
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_time = time.ticks_ms()
+
+    def _servo(self, corner):
+        return self.suspension.servos[corner]
+
+    def _start_corner(self):
+        while self.corner < 4 and not self._servo(self.corner):
+            self.corner += 1
+        if self.corner >= 4:
+            self._finish(save = True)
+            return
+        # the other corners wait in the middle of their travel
+        for corner in range(4):
+            servo = self._servo(corner)
+            if servo:
+                servo.set_angle((servo.top_limit + servo.bottom_limit) / 2)
+        self.step = 0
+        self.samples = []
+        self._set_step()
+
+    def _step_angle(self):
+        servo = self._servo(self.corner)
+        return servo.top_limit + servo.travel_coef * self.step / (self.steps - 1)
+
+    def _set_step(self):
+        self._servo(self.corner).set_angle(self._step_angle())
+        self._set_state('settling')
+
+    def _end_corner(self):
+        half_track = self.suspension.trackwidth / 2
+        half_wheelbase = self.suspension.wheelbase / 2
+        _, roll0, pitch0 = self.samples[0]
+        table = []
+        for angle, roll, pitch in self.samples:
+            roll_mm = (roll - roll0) * DEG_TO_RAD * half_track
+            pitch_mm = (pitch - pitch0) * DEG_TO_RAD * half_wheelbase
+            drop = -2 * (roll_mm * ROLL_WEIGHTS[self.corner] + pitch_mm * PITCH_WEIGHTS[self.corner])
+            table.append((drop, angle))
+        if table[-1][0] <= 0:
+            print(f"[SuspensionCalibration] Corner {self.corner} didn't drop, check the servo limits and the IMU axes")
+            self._finish(save = False)
+            return
+        self.tables[self.corner] = table
+        self.corner += 1
+        self._start_corner()
+
+    def _finish(self, save):
+        if save and not any(self.tables):
+            print("[SuspensionCalibration] No corner has a servo, nothing to save")
+            save = False
+        if save:
+            # a gain means the same millimetres on every corner, so the common travel is the shortest one
+            travel_mm = min(table[-1][0] for table in self.tables if table)
+            for corner in range(4):
+                table = self.tables[corner]
+                if table:
+                    self._servo(corner).set_height_table(fit_height_table(table, travel_mm), travel_mm)
+            self.suspension.travel_mm = travel_mm
+            self.suspension.save_calibration()
+            print(f"[SuspensionCalibration] Calibration done, {travel_mm:.1f} mm of travel")
+        self.suspension.paused = False
+        self._set_state('done')
+
+    def update(self):
+        # non-blocking, called periodically from the main loop
+        if not self.is_running():
+            return
+        elapsed = time.ticks_diff(time.ticks_ms(), self.state_time)
+        if self.state == 'settling':
+            if elapsed > self.settle_ms:
+                self.roll_sum = 0.0
+                self.pitch_sum = 0.0
+                self.count = 0
+                self._set_state('measuring')
+        elif self.state == 'measuring':
+            self.roll_sum += self.imu.roll
+            self.pitch_sum += self.imu.pitch
+            self.count += 1
+            if elapsed > self.measure_ms:
+                self.samples.append((self._step_angle(), self.roll_sum / self.count, self.pitch_sum / self.count))
+                self.step += 1
+                if self.step < self.steps:
+                    self._set_step()
+                else:
+                    self._end_corner()
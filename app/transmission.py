@@ -0,0 +1,134 @@
+import time
+
+LOW_GEAR = 0
+HIGH_GEAR = 1
+
+
+class AutoTransmission:
+    # picks the gear from the motor speed, the requested speed and the load, and sequences every shift so the
+    # dogs never move under power: cut the drive, move the servo with the motor held at the speed of the new gear,
+    # wait for the motor to turn with the wheels in it, then hand the PI its targets rescaled to the new gearing
+    # the stick asks for a wheel speed, full stick being the top speed in high gear; the motor target is that
+    # speed in the current gear
+    # the thresholds leave a band between the gears: right after a shift the motor speed is well inside the
+    # band of the new gear, and no new shift is picked for dwell_ms
+    # in low gear the target stops a little past the upshift speed, where the motor can still follow it: the
+    # integral then holds the load, not the windup of a target out of reach
+    def __init__(self, motor, gearbox, upshift_rps = 220, max_low_rps = 240, downshift_rps = 60, max_downshift_rps = 200,
+                 max_upshift_load = 0.3, lug_load = 0.5, cut_ms = 40, shift_ms = 200, engage_timeout_ms = 300,
+                 engage_tolerance = 0.2, min_engage_rps = 5, dwell_ms = 800):
+        self.motor = motor
+        self.gearbox = gearbox
+        self.upshift_rps = upshift_rps # motor rps in low gear, both measured and requested
+        self.max_low_rps = max_low_rps
+        self.downshift_rps = downshift_rps # motor rps in high gear
+        self.max_downshift_rps = max_downshift_rps # low gear motor rps a downshift may land on
+        self.max_upshift_load = max_upshift_load # a motor that already works hard would bog down in high gear
+        self.lug_load = lug_load # load that downshifts even above downshift_rps, uphill or on grass
+        self.cut_ms = cut_ms # for the torque on the dogs to go before the servo moves
+        self.shift_ms = shift_ms # servo travel between the gears
+        self.engage_timeout_ms = engage_timeout_ms
+        self.engage_tolerance = engage_tolerance # relative motor speed error accepted as engaged
+        self.min_engage_rps = min_engage_rps
+        self.dwell_ms = dwell_ms
+        self.enabled = False
+        self.requested_wheel_rps = 0
+        self.target_gear = gearbox.gear
+        self.from_ratio = gearbox.get_gearing_ratio()
+        self.wheel_rps = 0 # signed wheel speed when the drive was cut
+        self.shifts = 0
+        self.state = 'idle' # idle, cutting, shifting, engaging
+        self.state_time = 0
+
+    def is_shifting(self):
+        return self.state != 'idle'
+
+    def set_enabled(self, enabled):
+        if enabled == self.enabled:
+            return
+        if not enabled and self.is_shifting():
+            self._end_shift()
+        self.enabled = enabled
+        self._set_state('idle')
+        if enabled:
+            self.motor.pid.set_gear(self.gearbox.gear)
+            self._apply_target()
+
+    def _set_state(self, state):
+        self.state = state
+        self.state_time = time.ticks_ms()
+
+    def set_speed_percent(self, speed_percent):
+        self.requested_wheel_rps = self.motor.convert_speed_percent_to_rps(speed_percent) * self.gearbox.get_gear_ratio(HIGH_GEAR)
+        if not self.is_shifting():
+            self._apply_target()
+
+    def _apply_target(self):
+        rps = self.requested_wheel_rps / self.gearbox.get_gearing_ratio()
+        if self.gearbox.gear == LOW_GEAR:
+            rps = max(-self.max_low_rps, min(rps, self.max_low_rps))
+        self.motor.set_speed_rps(rps)
+
+    def get_load(self):
+        # the integral is the drive the feed-forward misses, as a fraction of full pwm, + when it pushes
+        pid = self.motor.pid
+        if pid.kff == 0:
+            # without feed-forward the integral is the whole drive, the load isn't known
+            return 0.0
+        load = pid.I / 65535
+        return -load if pid.target_rps < 0 else load
+
+    def select_gear(self):
+        gear = self.gearbox.gear
+        rps = abs(self.motor.get_speed_rps())
+        load = self.get_load()
+        if gear == LOW_GEAR:
+            requested_rps = abs(self.requested_wheel_rps) / self.gearbox.get_gearing_ratio()
+            if rps > self.upshift_rps and requested_rps > self.upshift_rps and load < self.max_upshift_load:
+                return HIGH_GEAR
+        else:
+            low_rps = rps * self.gearbox.get_gearing_ratio() / self.gearbox.get_gear_ratio(LOW_GEAR)
+            if low_rps < self.max_downshift_rps and (rps < self.downshift_rps or load > self.lug_load):
+                return LOW_GEAR
+        return gear
+
+    def _start_shift(self, gear):
+        self.target_gear = gear
+        self.from_ratio = self.gearbox.get_gearing_ratio()
+        self.wheel_rps = self.motor.get_speed_rps() * self.from_ratio
+        self.motor.set_shift_cut(True, self.motor.get_speed_rps())
+        self._set_state('cutting')
+
+    def _end_shift(self):
+        # the new gear's feed-forward table and gains, then the targets for the same wheel speed
+        self.motor.pid.set_gear(self.gearbox.gear)
+        self.motor.pid.rescale_speed(self.from_ratio / self.gearbox.get_gearing_ratio())
+        self._apply_target()
+        self.motor.set_shift_cut(False)
+        self.shifts += 1
+        self._set_state('idle')
+
+    def update(self):
+        # non-blocking, called periodically from the main loop
+        if not self.enabled:
+            return
+        elapsed = time.ticks_diff(time.ticks_ms(), self.state_time)
+        if self.state == 'idle':
+            if elapsed > self.dwell_ms:
+                gear = self.select_gear()
+                if gear != self.gearbox.gear:
+                    self._start_shift(gear)
+        elif self.state == 'cutting':
+            if elapsed >= self.cut_ms:
+                self.gearbox.set_gear(self.target_gear)
+                self.motor.set_shift_cut(True, self.wheel_rps / self.gearbox.get_gearing_ratio())
+                self._set_state('shifting')
+        elif self.state == 'shifting':
+            if elapsed >= self.shift_ms:
+                self._set_state('engaging')
+        elif self.state == 'engaging':
+            # the motor is held at the new gear's speed, once engaged it turns with the wheels, slowed a little since
+            expected = abs(self.wheel_rps) / self.gearbox.get_gearing_ratio()
+            error = abs(abs(self.motor.get_speed_rps()) - expected)
+            if error <= max(self.engage_tolerance * expected, self.min_engage_rps) or elapsed > self.engage_timeout_ms:
+                self._end_shift()
@@ -2,6 +2,7 @@
 # Kevin McAleer, March 2021
 
 from micropython import const
+from machine import Pin
 import ustruct
 import utime
 
@@ -20,6 +21,7 @@ _INTERRUPT_CLEAR = const(0x0b)
 _GPIO_MUX_ACTIVE_HIGH = const(0x84)
 _RESULT_INTERRUPT_STATUS = const(0x13)
 _RESULT_RANGE_STATUS = const(0x14)
+_RANGE_VALID = const(11) # device range status of a good measurement
 _OSC_CALIBRATE = const(0xf8)
 _MEASURE_PERIOD = const(0x04)
 
@@ -113,6 +115,20 @@ class VL53L0X():
     def __init__(self, i2c, address=0x29):
         self.i2c = i2c
         self.address = address
+        # continuous ranging without waiting: one status byte per poll, or none with the GPIO1 pin, and the
+        # result block in one burst once a sample is ready, into preallocated buffers
+        self.status_buf = bytearray(1)
+        self.result_buf = bytearray(12)
+        self.clear_buf = bytearray(b'\x01')
+        self.ready_pin = None
+        self.ready = False # set by the GPIO1 interrupt
+        self.ready_us = 0
+        self.stale_us = 100_000 # with the pin, polled anyway after this long without a sample, in case an edge was missed
+        self.range_mm = 0
+        self.range_status = 0
+        self.sample_us = 0 # ticks_us when the sample was ready; polled, the last poll that found none, so never too young
+        self.poll_us = 0
+        self.samples = 0
         utime.sleep_ms(100)
         self.init()
         self._started = False
@@ -421,6 +437,42 @@ class VL53L0X():
         self._register(_INTERRUPT_CLEAR, 0x01)
         return value
 
+    def set_ready_pin(self, pin):
+        # GPIO1 goes low when a new sample is ready (set up in init()), the edge replaces the status polling
+        self.ready_pin = Pin(pin, Pin.IN, Pin.PULL_UP)
+        self.ready_pin.irq(trigger=Pin.IRQ_FALLING, handler=self._ready_irq, hard=True)
+
+    def _ready_irq(self, pin):
+        self.ready_us = utime.ticks_us()
+        self.ready = True
+
+    def read_if_ready(self):
+        # non-blocking, for continuous mode: True if a new sample was read into range_mm, range_status and
+        # sample_us; a sample is only read once, the interrupt clear starts the wait for the next one
+        now = utime.ticks_us()
+        if self.ready:
+            self.ready = False
+            sample_us = self.ready_us
+        else:
+            if self.ready_pin is not None and utime.ticks_diff(now, self.sample_us) < self.stale_us:
+                return False
+            self.i2c.readfrom_mem_into(self.address, _RESULT_INTERRUPT_STATUS, self.status_buf)
+            # the first poll has no earlier one to go by, 0 would read as no sample at all
+            sample_us = self.poll_us if self.poll_us != 0 else now
+            self.poll_us = now
+            if not self.status_buf[0] & 0x07:
+                return False
+        self.i2c.readfrom_mem_into(self.address, _RESULT_RANGE_STATUS, self.result_buf)
+        self.i2c.writeto_mem(self.address, _INTERRUPT_CLEAR, self.clear_buf)
+        self.range_status = (self.result_buf[0] & 0x78) >> 3
+        self.range_mm = (self.result_buf[10] << 8) | self.result_buf[11]
+        self.sample_us = sample_us
+        self.samples += 1
+        return True
+
+    def range_valid(self):
+        return self.range_status == _RANGE_VALID
+
     def set_signal_rate_limit(self, limit_Mcps):
         if limit_Mcps < 0 or limit_Mcps > 511.99:
             return False
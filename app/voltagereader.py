@@ -1,20 +1,29 @@
 from machine import ADC, Pin
 
 class VoltageReader:
-    def __init__(self, pin, R1 = 998_000, R2 = 470_000, correction_factor = 1.075):
+    def __init__(self, pin, R1 = 998_000, R2 = 470_000, correction_factor = 1.075, oversampling = 16, max_mv = 10_000):
         self.adc_pin = ADC(Pin(pin))
         self.R1 = R1
         self.R2 = R2
         self.voltage_divider_ratio = (self.R1 + self.R2) / self.R2
         self.correction_factor = correction_factor
+        # the 12-bit ADC is oversampled, its noise averages out into extra resolution; the sum is scaled to mV
+        # by a Q16 factor; read_u16 only holds 12 bits, so the sum is shifted down by 4 first and the product
+        # stays a small int
+        self.oversampling = oversampling
+        self.mv_q16 = int(3300 * self.voltage_divider_ratio * self.correction_factor * 65536 * 16 / (65535 * oversampling) + 0.5)
+        self.max_mv = max_mv # readings above it are a wiring fault, not a battery
+
+    def read_mv(self):
+        # battery voltage in mV, 0 if the reading isn't plausible
+        raw_sum = 0
+        for _ in range(self.oversampling):
+            raw_sum += self.adc_pin.read_u16()
+        voltage_mv = (raw_sum >> 4) * self.mv_q16 >> 16
+        if voltage_mv > self.max_mv:
+            print(f"[VoltageReader] Voltage too high: {voltage_mv} mV")
+            return 0
+        return voltage_mv
 
     def read(self):
-        try:
-            raw = self.adc_pin.read_u16()
-            voltage = (raw / 65535) * 3.3 * self.voltage_divider_ratio * self.correction_factor
-            if voltage > 10:
-                raise ValueError("Voltage too high")
-            return round(voltage, 1)
-        except Exception as e:
-            print(f"Error reading voltage: {e}")
-            return 0
\ No newline at end of file
+        return round(self.read_mv() / 1000, 1)
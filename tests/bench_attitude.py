@@ -0,0 +1,44 @@
+# compares the Mahony filter with the Euler complementary filter it replaced: the time per sample, and the roll and
+# pitch error on synthetic trajectories; run with python3 tests/bench_attitude.py
+import time
+import hostenv
+from attitude import MahonyFilter
+from imu_trajectory import G, ComplementaryFilter, trajectory, angle_errors
+
+DT = 0.01
+SCENARIOS = (
+    ('clean', {}),
+    ('bias + noise', {'bias': (0.02, -0.015, 0.01), 'gyro_noise': 0.005, 'accel_noise': 0.2}),
+    ('+ 3 m/s^2 surge', {'bias': (0.02, -0.015, 0.01), 'gyro_noise': 0.005, 'accel_noise': 0.2, 'forward_accel': 3.0}),
+)
+
+
+def trusted(ax, ay, az):
+    return (0.95 * G) ** 2 <= ax * ax + ay * ay + az * az <= (1.05 * G) ** 2
+
+
+def cost_us(attitude, samples, with_trust):
+    start = time.perf_counter()
+    for _, _, gx, gy, gz, ax, ay, az in samples:
+        if with_trust:
+            attitude.update(gx, gy, gz, ax, ay, az, DT, True)
+        else:
+            attitude.update(gx, gy, gz, ax, ay, az, DT)
+    return (time.perf_counter() - start) / len(samples) * 1e6
+
+
+def main():
+    samples = list(trajectory(60, DT, 25, 20, 60))
+    print(f"time per sample: mahony {cost_us(MahonyFilter(), samples, True):.2f} us, "
+          f"complementary {cost_us(ComplementaryFilter(), samples, False):.2f} us")
+    print("roll and pitch error over 60 s of combined roll (25 deg), pitch (20 deg) and yaw (60 deg), rms / max deg:")
+    print(f"{'':>18}{'mahony':>16}{'complementary':>18}")
+    for name, kwargs in SCENARIOS:
+        samples = list(trajectory(60, DT, 25, 20, 60, **kwargs))
+        mahony = angle_errors(MahonyFilter(), samples, DT, trusted)
+        old = angle_errors(ComplementaryFilter(), samples, DT)
+        print(f"{name:>18}{mahony[0]:>9.2f} / {mahony[1]:<5.2f}{old[0]:>11.2f} / {old[1]:<5.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+# compares the MPU6050 burst read with the per-register reads it replaced, on a fake I2C device that counts the
+# transactions, the bus time they take at 400 kHz and the read buffers allocated; run with
+# python3 tests/bench_imu_read.py
+# the host time favours the per-register read: CPython unpacks in C, while decode_be16 is a Python loop that on
+# the Pico replaces the slices and tuples struct.unpack would allocate
+import struct
+import time
+import hostenv
+import machine
+import i2c_bus
+import ustruct
+from mpu6050 import MPU6050, MPU6050_ADDR, MPU6050_REG_ACCEL_XOUT_H, MPU6050_REG_GYRO_XOUT_H, G_CONSTANT
+
+SAMPLES = 20000
+BUS_HZ = 400_000
+
+
+class CountingI2C(machine.I2C):
+    # a register read is start, address, register, restart, address, the data and a stop: 9 bits a byte plus
+    # about 2 bits for the start, restart and stop conditions
+    def __init__(self, devices):
+        super().__init__()
+        self.devices = devices
+        self.transactions = 0
+        self.bus_bits = 0
+        self.new_buffers = 0 # readfrom_mem returns a new bytes object, readfrom_mem_into fills the caller's
+
+    def count(self, nbytes):
+        self.transactions += 1
+        self.bus_bits += 9 * (3 + nbytes) + 2
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        self.count(nbytes)
+        self.new_buffers += 1
+        return super().readfrom_mem(addr, memaddr, nbytes)
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        self.count(len(buf))
+        super().readfrom_mem_into(addr, memaddr, buf)
+
+
+def read_per_register(imu):
+    # the read before the burst: accelerometer and gyroscope in two reads, a new bytes object each, and an
+    # unpack over a new slice per value; through the same bus manager as the burst
+    i2c = imu.i2c
+    data = i2c.readfrom_mem(imu.addr, MPU6050_REG_ACCEL_XOUT_H, 6)
+    imu.accel_x = ustruct.unpack('>h', data[0:2])[0] / imu.accel_sensitivity * G_CONSTANT
+    imu.accel_y = ustruct.unpack('>h', data[2:4])[0] / imu.accel_sensitivity * G_CONSTANT
+    imu.accel_z = ustruct.unpack('>h', data[4:6])[0] / imu.accel_sensitivity * G_CONSTANT
+    data = i2c.readfrom_mem(imu.addr, MPU6050_REG_GYRO_XOUT_H, 6)
+    imu.gyro_x = ustruct.unpack('>h', data[0:2])[0] / imu.gyro_sensitivity
+    imu.gyro_y = ustruct.unpack('>h', data[2:4])[0] / imu.gyro_sensitivity
+    imu.gyro_z = ustruct.unpack('>h', data[4:6])[0] / imu.gyro_sensitivity
+
+
+def run(name, read, imu, i2c):
+    i2c.transactions = 0
+    i2c.bus_bits = 0
+    i2c.new_buffers = 0
+    start = time.perf_counter()
+    for _ in range(SAMPLES):
+        read()
+    host_us = (time.perf_counter() - start) / SAMPLES * 1e6
+    bus_us = i2c.bus_bits / SAMPLES / BUS_HZ * 1e6
+    print(f"{name:>14}{host_us:>12.2f}{i2c.transactions / SAMPLES:>16.1f}{bus_us:>12.0f}{i2c.new_buffers / SAMPLES:>14.1f}")
+
+
+def main():
+    i2c_bus._buses.clear()
+    imu = MPU6050(0, 1, 2)
+    i2c = CountingI2C(imu.i2c.i2c.devices)
+    imu.i2c.i2c = i2c
+    imu.i2c.i2c.registers(MPU6050_ADDR)[MPU6050_REG_ACCEL_XOUT_H:MPU6050_REG_ACCEL_XOUT_H + 14] = \
+        struct.pack('>7h', 2048, -1024, 1500, 340, 131, -262, 65)
+    imu.read_sensitivity_factors()
+    print(f"{'':>14}{'us/sample':>12}{'transactions':>16}{'bus us':>12}{'new buffers':>14}")
+    run('per register', lambda: read_per_register(imu), imu, i2c)
+    run('burst', imu.read_burst, imu, i2c)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# compares MotorPID.update() with update_fixed() on the host: the time per update, and how many values per update
+# MicroPython would have to put on the heap (floats and ints past 31 bits, counted when a local or an attribute of
+# the objects taking part gets a new one); run with python3 tests/bench_motor.py
+import os
+import sys
+import time
+import hostenv
+from motor_plant import MotorPlant, make_pid
+
+TICKS = 3000 # timed updates, the traced run only needs a third of them
+PROFILE = (60, 150, 20, -40, 0) # rps, an equal share of the ticks each
+APP_DIR = os.path.join(hostenv.ROOT_DIR, 'app')
+
+
+def heap_value(value):
+    return type(value) is float or (type(value) is int and not hostenv.small_int(value))
+
+
+class HeapValueCounter:
+    # a trace function on the app's code: counts the heap values that show up in the locals and in self
+    def __init__(self):
+        self.count = 0
+        self.seen = {}
+
+    def _scan(self, frame):
+        owner = frame.f_code
+        for name, value in frame.f_locals.items():
+            self._note((owner, name), value)
+        obj = frame.f_locals.get('self')
+        if obj is not None and hasattr(obj, '__dict__'):
+            for name, value in obj.__dict__.items():
+                self._note((id(obj), name), value)
+
+    def _note(self, key, value):
+        if heap_value(value) and self.seen.get(key) is not value:
+            self.count += 1
+        # the reference is kept so the id of a freed value can't come back as a false match
+        self.seen[key] = value
+
+    def _local(self, frame, event, arg):
+        if event == 'line':
+            self._scan(frame)
+        elif event == 'return':
+            self._scan(frame)
+            if heap_value(arg):
+                self.count += 1
+        return self._local
+
+    def __call__(self, frame, event, arg):
+        if event == 'call' and frame.f_code.co_filename.startswith(APP_DIR):
+            return self._local
+        return None
+
+
+def run(fixed_point, count_heap_values, ticks):
+    hostenv.set_time_us(1_000_000)
+    pid = make_pid(fixed_point)
+    plant = MotorPlant(pid)
+    update = pid.update_fixed if fixed_point else pid.update
+    counter = HeapValueCounter()
+    elapsed = 0.0
+    for tick in range(ticks):
+        if tick % (ticks // len(PROFILE)) == 0:
+            pid.set_target_rps(PROFILE[tick * len(PROFILE) // ticks])
+        plant.step(pid.pwm, pid.dt_us)
+        if count_heap_values:
+            sys.settrace(counter)
+            update()
+            sys.settrace(None)
+        else:
+            start = time.perf_counter()
+            update()
+            elapsed += time.perf_counter() - start
+    return elapsed / ticks * 1e6, counter.count / ticks
+
+
+def main():
+    print(f"{'':>14}{'us/update':>12}{'heap values/update':>20}")
+    for name, fixed_point in (('update', False), ('update_fixed', True)):
+        us, _ = run(fixed_point, False, TICKS)
+        _, heap_values = run(fixed_point, True, TICKS // 3)
+        print(f"{name:>14}{us:>12.2f}{heap_values:>20.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+# compares Suspension.update() with the per-corner update the mixing matrix replaced: suspension ticks per second
+# in the manual, self-leveling and bounce modes, the servos and the corner sync left out; on the Pico also the heap
+# bytes per tick. Run with python3 tests/bench_suspension.py
+# on the Pico: copy the app as for a normal install and run mpremote run tests/bench_suspension.py, the script
+# then times with ticks_us and adds app to the path like main.py
+# update() now also keeps its loop stats, and the self-leveling mode isn't the same controller in both, the new one
+# is a PI with corner allocation
+import gc
+import time
+try:
+    import hostenv
+    ON_HOST = True
+except ImportError:
+    import sys
+    sys.path.append("app")
+    ON_HOST = False
+from suspension import Suspension, CORNERS
+
+# on the Pico a collection during the run would hide what was allocated, the ticks there fit in the heap
+TICKS = 5000 if ON_HOST else 500
+
+
+def clock_us():
+    if ON_HOST:
+        return int(time.perf_counter() * 1_000_000)
+    return time.ticks_us()
+
+
+class Corner:
+    # takes the gains and does nothing with them, only the suspension's own work is timed
+    max_gain_rate = 1.2
+
+    def set_gains(self, base, gain):
+        pass
+
+    def set_base_gain(self, gain):
+        pass
+
+    def set_gain(self, gain):
+        pass
+
+    def get_eta_ms(self):
+        return 0
+
+
+class Imu:
+    roll = 4.0
+    pitch = -1.5
+
+    def read_position(self):
+        return self.roll, self.pitch
+
+
+class OldSuspension:
+    # the mode branches of Suspension.update() before the mixing matrix, with the state they use
+    def __init__(self):
+        self.imu = Imu()
+        corner = Corner()
+        self.fl_servo = corner
+        self.fr_servo = corner
+        self.rl_servo = corner
+        self.rr_servo = corner
+        self.mode = 0
+        self.min_gain = 0.0
+        self.max_gain = 1.0
+        self.base_gain = 0.5
+        self.fl_input_gain = 0.2
+        self.fr_input_gain = -0.1
+        self.rl_input_gain = 0.1
+        self.rr_input_gain = -0.2
+        self.fl_gain = 0
+        self.fr_gain = 0
+        self.rl_gain = 0
+        self.rr_gain = 0
+        self.bounce_gain = 0
+        self.bounce_range = 0.3
+        self.bounce_step = 1.5 * 2 * 0.3 / 50
+        self.bounce_offset = 0
+        self.roll = 0
+        self.pitch = 0
+        self.incline_epsilon = 0.5
+        self.kp_roll = 0.0005
+        self.kp_pitch = 0.0005
+        self.fl_tilt_gain = 0
+        self.fr_tilt_gain = 0
+        self.rl_tilt_gain = 0
+        self.rr_tilt_gain = 0
+        self.diag_weight = 0
+        self.axis_weight = 1.0
+        self.wheelbase = 197
+        self.trackwidth = 125
+
+    def update(self, tmr):
+        if self.mode == 0:
+            self.fl_gain = self.fl_input_gain
+            self.fr_gain = self.fr_input_gain
+            self.rl_gain = self.rl_input_gain
+            self.rr_gain = self.rr_input_gain
+        elif self.mode == 1:
+            if self.imu:
+                imu_roll, imu_pitch = self.imu.read_position()
+                self.roll = imu_roll if abs(imu_roll) > self.incline_epsilon else 0
+                self.pitch = imu_pitch if abs(imu_pitch) > self.incline_epsilon else 0
+            roll_correction = self.kp_roll * self.roll
+            pitch_correction = self.kp_pitch * self.pitch
+            self.fl_tilt_gain = self.fl_tilt_gain + (-roll_correction + pitch_correction)
+            self.fl_tilt_gain = max(min(self.fl_tilt_gain, 1.0), -1.0)
+            self.fr_tilt_gain = self.fr_tilt_gain + (roll_correction + pitch_correction)
+            self.fr_tilt_gain = max(min(self.fr_tilt_gain, 1.0), -1.0)
+            rl_diag_correction = roll_correction + pitch_correction
+            rl_axis_correction = -roll_correction - pitch_correction
+            rr_diag_correction = -roll_correction + pitch_correction
+            rr_axis_correction = roll_correction - pitch_correction
+            r = abs(self.roll) * self.trackwidth
+            p = abs(self.pitch) * self.wheelbase
+            self.diag_weight = min(r, p) / max(r, p) if max(r, p) > 0 else 0
+            self.diag_weight = 0
+            self.axis_weight = 1.0 - self.diag_weight
+            rl_gain = self.diag_weight * rl_diag_correction + self.axis_weight * rl_axis_correction
+            rr_gain = self.diag_weight * rr_diag_correction + self.axis_weight * rr_axis_correction
+            self.rl_tilt_gain = self.rl_tilt_gain + rl_gain
+            self.rl_tilt_gain = max(min(self.rl_tilt_gain, 1.0), -1.0)
+            self.rr_tilt_gain = self.rr_tilt_gain + rr_gain
+            self.rr_tilt_gain = max(min(self.rr_tilt_gain, 1.0), -1.0)
+            self.fl_gain = self.fl_tilt_gain
+            self.fr_gain = self.fr_tilt_gain
+            self.rl_gain = self.rl_tilt_gain
+            self.rr_gain = self.rr_tilt_gain
+        elif self.mode == 2:
+            self.bounce_gain += self.bounce_step
+            self.bounce_gain = min(max(self.bounce_gain, 0), self.bounce_range)
+            if self.bounce_gain <= 0 or self.bounce_gain >= self.bounce_range:
+                self.bounce_step = -self.bounce_step
+            if self.base_gain + self.bounce_range > self.max_gain:
+                self.bounce_offset = - abs(self.base_gain - self.bounce_range)
+            elif self.base_gain + self.bounce_range < self.min_gain:
+                self.bounce_offset = abs(self.base_gain - self.bounce_range)
+            else:
+                self.bounce_offset = 0
+            self.fl_gain = self.bounce_gain + self.bounce_offset
+            self.fr_gain = self.bounce_gain + self.bounce_offset
+            self.rl_gain = self.bounce_gain + self.bounce_offset
+            self.rr_gain = self.bounce_gain + self.bounce_offset
+
+        # the overflow correction it computed and never applied
+        correction = 0
+        max_total_gain = max(self.base_gain + self.fl_gain,
+                       self.base_gain + self.fr_gain,
+                       self.base_gain + self.rl_gain,
+                       self.base_gain + self.rr_gain)
+        min_total_gain = min(self.base_gain + self.fl_gain,
+                        self.base_gain + self.fr_gain,
+                        self.base_gain + self.rl_gain,
+                        self.base_gain + self.rr_gain)
+        if max_total_gain > 1 and min_total_gain > 0:
+            correction = 1 - max_total_gain
+        elif min_total_gain < 0 and max_total_gain < 1:
+            correction = -min_total_gain
+        else:
+            correction = 0
+
+        if self.fl_servo:
+            self.fl_servo.set_base_gain(self.base_gain)
+            self.fl_servo.set_gain(self.fl_gain)
+        if self.fr_servo:
+            self.fr_servo.set_base_gain(self.base_gain)
+            self.fr_servo.set_gain(self.fr_gain)
+        if self.rl_servo:
+            self.rl_servo.set_base_gain(self.base_gain)
+            self.rl_servo.set_gain(self.rl_gain)
+        if self.rr_servo:
+            self.rr_servo.set_base_gain(self.base_gain)
+            self.rr_servo.set_gain(self.rr_gain)
+
+
+def new_suspension(mode):
+    suspension = Suspension()
+    corner = Corner()
+    for c in range(CORNERS):
+        suspension.set_corner_servo(c, corner)
+    suspension.set_imu(Imu())
+    suspension.set_base_gain(0.5)
+    suspension.set_mode(mode)
+    suspension.sync_corners = False
+    if mode == 0:
+        suspension.set_axis_gain(0.3, -0.2)
+    return suspension
+
+
+def run(suspension):
+    # ticks per second, and heap bytes per tick where gc can tell (MicroPython only)
+    update = suspension.update
+    gc.collect()
+    allocated = gc.mem_alloc() if not ON_HOST else 0
+    start = clock_us()
+    for _ in range(TICKS):
+        update(None)
+    if ON_HOST:
+        elapsed = clock_us() - start
+        per_tick = '-'
+    else:
+        elapsed = time.ticks_diff(clock_us(), start)
+        per_tick = (gc.mem_alloc() - allocated) // TICKS
+    return TICKS * 1_000_000 // elapsed, per_tick
+
+
+def main():
+    print("suspension ticks per second and heap bytes per tick, the control loop needs 50 ticks per second")
+    print("{:>16}{:>20}{:>20}".format('', 'per corner', 'mixing'))
+    for mode, name in ((0, 'manual'), (1, 'self-leveling'), (2, 'bounce')):
+        old = OldSuspension()
+        old.mode = mode
+        old_rate, old_bytes = run(old)
+        new_rate, new_bytes = run(new_suspension(mode))
+        print("{:>16}{:>12} / {:<5}{:>12} / {:<5}".format(name, old_rate, old_bytes, new_rate, new_bytes))
+
+
+if __name__ == '__main__':
+    main()
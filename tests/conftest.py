@@ -0,0 +1,2 @@
+# pytest loads this before the checks, the host stand-ins have to be in place before the app modules import
+import hostenv
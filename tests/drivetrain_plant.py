@@ -0,0 +1,55 @@
+# the motor plant behind the two-speed gearbox, for the transmission checks: in gear the car's inertia and its road
+# load are reflected to the motor by the gear ratio; while the dogs are apart (for shift_travel_ms after the gearbox
+# is sent to another gear) the motor spins on its own and the car coasts, and the dogs engage with an inelastic
+# impact. Torques are in motor rps/s, for the motor's own inertia
+from motor_plant import MotorPlant
+from transmission import HIGH_GEAR
+
+
+class DrivetrainPlant(MotorPlant):
+    def __init__(self, pid, gearbox, vehicle_inertia = 2.0, road_load_rps2 = 0.0, shift_travel_ms = 150, **kwargs):
+        super().__init__(pid, **kwargs)
+        self.gearbox = gearbox
+        self.vehicle_inertia = vehicle_inertia # the car's, at the motor in high gear
+        self.road_load_rps2 = road_load_rps2 # rolling and grade, the torque it takes at the motor in high gear
+        self.shift_travel_us = shift_travel_ms * 1000
+        self.high_ratio = gearbox.get_gear_ratio(HIGH_GEAR)
+        self.gear = gearbox.gear
+        self.neutral_us = 0 # until the dogs engage
+        self.wheel_rps = 0.0
+        self.engagements = 0
+        self.worst_jolt_rps = 0.0 # largest motor speed change at an engagement
+
+    def _move(self, torque, dt):
+        if self.gearbox.gear != self.gear:
+            self.gear = self.gearbox.gear
+            self.neutral_us = self.shift_travel_us
+        ratio = self.gearbox.get_gear_ratio(self.gear)
+        k = ratio / self.high_ratio
+        if self.neutral_us > 0:
+            self.speed_rps += torque * dt
+            coast = self.road_load_rps2 * self.high_ratio / self.vehicle_inertia * dt
+            self.wheel_rps = max(self.wheel_rps - coast, 0.0) if self.wheel_rps > 0 else min(self.wheel_rps + coast, 0.0)
+            self.neutral_us -= dt * 1_000_000
+            if self.neutral_us <= 0:
+                inertia = self.vehicle_inertia * k * k
+                speed = (self.speed_rps + inertia * self.wheel_rps / ratio) / (1 + inertia)
+                self.worst_jolt_rps = max(self.worst_jolt_rps, abs(speed - self.speed_rps))
+                self.speed_rps = speed
+                self.wheel_rps = speed * ratio
+                self.engagements += 1
+            self.load_rps = self.speed_rps
+            return
+        load = self.road_load_rps2 * k
+        if self.speed_rps > 0:
+            push = torque - load
+        elif self.speed_rps < 0:
+            push = torque + load
+        else:
+            push = max(torque - load, 0.0) if torque > 0 else min(torque + load, 0.0)
+        speed = self.speed_rps + push / (1 + self.vehicle_inertia * k * k) * dt
+        if self.speed_rps * speed < 0:
+            speed = 0.0 # the load stops the car, it doesn't turn it around
+        self.speed_rps = speed
+        self.load_rps = speed
+        self.wheel_rps = speed * ratio
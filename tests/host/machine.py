@@ -0,0 +1,107 @@
+# host stand-in for the parts of MicroPython's machine module the app uses; nothing here touches hardware,
+# the peripherals only keep what was written to them so the checks can look at it
+
+class Pin:
+    IN = 0
+    OUT = 1
+    PULL_UP = 1
+    PULL_DOWN = 2
+    IRQ_FALLING = 4
+    IRQ_RISING = 8
+
+    def __init__(self, pin, mode = -1, pull = -1, value = 0):
+        self.pin = pin
+        self._value = value
+        self.handler = None
+
+    def irq(self, handler = None, trigger = 0, hard = False):
+        self.handler = handler
+
+    def value(self, value = None):
+        if value is None:
+            return self._value
+        self._value = value
+
+    def on(self):
+        self._value = 1
+
+    def off(self):
+        self._value = 0
+
+
+class PWM:
+    def __init__(self, pin, freq = 0, duty_u16 = 0, duty_ns = 0):
+        self.pin = pin
+        self._freq = freq
+        self._duty_u16 = duty_u16
+        self._duty_ns = duty_ns
+
+    def freq(self, value = None):
+        if value is None:
+            return self._freq
+        self._freq = value
+
+    def duty_u16(self, value = None):
+        if value is None:
+            return self._duty_u16
+        self._duty_u16 = value
+
+    def duty_ns(self, value = None):
+        if value is None:
+            return self._duty_ns
+        self._duty_ns = value
+
+    def deinit(self):
+        pass
+
+
+class Timer:
+    # never fires by itself, a check calls the callback when it wants a tick
+    ONE_SHOT = 0
+    PERIODIC = 1
+
+    def __init__(self, id = -1, **kwargs):
+        self.callback = None
+        if kwargs:
+            self.init(**kwargs)
+
+    def init(self, mode = PERIODIC, freq = -1, period = -1, callback = None, hard = False):
+        self.callback = callback
+
+    def deinit(self):
+        self.callback = None
+
+
+class I2C:
+    # a 256 byte register file per device address, a check writes the registers a driver reads
+    def __init__(self, id = 0, scl = None, sda = None, freq = 400_000):
+        self.devices = {}
+
+    def registers(self, addr):
+        regs = self.devices.get(addr)
+        if regs is None:
+            regs = bytearray(256)
+            self.devices[addr] = regs
+        return regs
+
+    def readfrom_mem(self, addr, memaddr, nbytes):
+        return bytes(self.registers(addr)[memaddr:memaddr + nbytes])
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        buf[:] = self.registers(addr)[memaddr:memaddr + len(buf)]
+
+    def writeto_mem(self, addr, memaddr, buf):
+        self.registers(addr)[memaddr:memaddr + len(buf)] = buf
+
+
+class ADC:
+    def __init__(self, pin):
+        self.pin = pin
+        self.value = 0
+
+    def read_u16(self):
+        return self.value
+
+
+def reset():
+    raise SystemExit("machine.reset()")
@@ -0,0 +1,3 @@
+# MicroPython's time functions on the host clock of hostenv
+from time import *
+from time import ticks_us, ticks_ms, ticks_diff, ticks_add, sleep_ms, sleep_us
@@ -0,0 +1,71 @@
+# runs the hardware-free parts of the app under CPython: the host stand-ins for machine, micropython and the
+# u-modules come first on the path, and the time module gets MicroPython's ticks functions on a clock the
+# checks move by hand, so every run sees the same timing
+import builtins
+import os
+import sys
+import time
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(TESTS_DIR)
+for path in (ROOT_DIR, os.path.join(ROOT_DIR, 'app'), os.path.join(TESTS_DIR, 'host')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+# a few modules use const() without importing it, MicroPython's compiler knows it anyway
+builtins.const = lambda value: value
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_MAX = _TICKS_PERIOD - 1
+_TICKS_HALF = _TICKS_PERIOD // 2
+_clock_us = [0]
+
+
+def set_time_us(t_us):
+    _clock_us[0] = t_us
+
+
+def advance_us(dt_us):
+    _clock_us[0] += dt_us
+
+
+def advance_ms(dt_ms):
+    _clock_us[0] += dt_ms * 1000
+
+
+def ticks_us():
+    return _clock_us[0] & _TICKS_MAX
+
+
+def ticks_ms():
+    return (_clock_us[0] // 1000) & _TICKS_MAX
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) & _TICKS_MAX
+
+
+def ticks_diff(ticks1, ticks2):
+    diff = (ticks1 - ticks2) & _TICKS_MAX
+    return diff - _TICKS_PERIOD if diff >= _TICKS_HALF else diff
+
+
+def sleep_ms(ms):
+    advance_ms(ms)
+
+
+def sleep_us(us):
+    advance_us(us)
+
+
+time.ticks_us = ticks_us
+time.ticks_ms = ticks_ms
+time.ticks_add = ticks_add
+time.ticks_diff = ticks_diff
+time.sleep_ms = sleep_ms
+time.sleep_us = sleep_us
+
+
+def small_int(value):
+    # MicroPython keeps ints that fit in 31 bits in the object pointer itself, anything else is a heap object
+    return type(value) is int and -(1 << 30) <= value < (1 << 30)
@@ -0,0 +1,87 @@
+# synthetic IMU data for the attitude checks, and the Euler complementary filter the Mahony filter replaced
+# car frame: x forward, y left, z up; angles in degrees, gyro in rad/s
+import math
+import random
+
+G = 9.81
+
+
+class ComplementaryFilter:
+    # MPU6050.update_position before the Mahony filter: Euler angles integrated from the body rates and pulled
+    # towards the accelerometer angles, with a smaller pull while the total acceleration is away from 1g
+    def __init__(self, alpha_stationary = 0.98, alpha_motion = 0.9998):
+        self.alpha_stationary = alpha_stationary
+        self.alpha_motion = alpha_motion
+        self.roll = 0.0
+        self.pitch = 0.0
+        self.yaw = 0.0
+
+    def reset(self, ax, ay, az):
+        self.roll = math.degrees(math.atan2(ay, az))
+        self.pitch = math.degrees(math.atan2(-ax, math.sqrt(ay * ay + az * az)))
+        self.yaw = 0.0
+
+    def update(self, gx, gy, gz, ax, ay, az, dt):
+        accel_roll = math.degrees(math.atan2(ay, az))
+        accel_pitch = math.degrees(math.atan2(-ax, math.sqrt(ay * ay + az * az)))
+        total_g = math.sqrt(ax * ax + ay * ay + az * az)
+        alpha = self.alpha_stationary
+        if total_g < 0.95 * G or total_g > 1.05 * G:
+            alpha = self.alpha_motion
+        self.roll = alpha * (self.roll + math.degrees(gx) * dt) + (1 - alpha) * accel_roll
+        self.pitch = alpha * (self.pitch + math.degrees(gy) * dt) + (1 - alpha) * accel_pitch
+        self.yaw += math.degrees(gz) * dt
+
+
+def trajectory(seconds, dt, roll_deg, pitch_deg, yaw_deg, bias = (0.0, 0.0, 0.0), gyro_noise = 0.0,
+               accel_noise = 0.0, forward_accel = 0.0, seed = 1):
+    # the car rolls, pitches and yaws sinusoidally, all at once, at unrelated frequencies; yields the true roll and
+    # pitch with the gyro and accelerometer readings. forward_accel (m/s^2) is added as a slow surge, the
+    # accelerometer then no longer points up
+    rng = random.Random(seed)
+    frequencies = (0.21, 0.13, 0.05)
+    amplitudes = (math.radians(roll_deg), math.radians(pitch_deg), math.radians(yaw_deg))
+    phases = (0.0, 1.0, 2.0)
+    for i in range(int(seconds / dt)):
+        t = i * dt
+        angles = []
+        rates = []
+        for f, a, ph in zip(frequencies, amplitudes, phases):
+            w = 2 * math.pi * f
+            angles.append(a * math.sin(w * t + ph))
+            rates.append(a * w * math.cos(w * t + ph))
+        roll, pitch, _ = angles
+        droll, dpitch, dyaw = rates
+        # body rates from the ZYX Euler rates
+        gx = droll - dyaw * math.sin(pitch)
+        gy = dpitch * math.cos(roll) + dyaw * math.cos(pitch) * math.sin(roll)
+        gz = -dpitch * math.sin(roll) + dyaw * math.cos(pitch) * math.cos(roll)
+        # specific force: gravity's reaction seen in the body frame, plus the surge along the car's x
+        surge = forward_accel * math.sin(2 * math.pi * 0.3 * t)
+        ax = -math.sin(pitch) * G + surge
+        ay = math.sin(roll) * math.cos(pitch) * G
+        az = math.cos(roll) * math.cos(pitch) * G
+        yield (math.degrees(roll), math.degrees(pitch),
+               gx + bias[0] + rng.gauss(0, gyro_noise), gy + bias[1] + rng.gauss(0, gyro_noise),
+               gz + bias[2] + rng.gauss(0, gyro_noise),
+               ax + rng.gauss(0, accel_noise), ay + rng.gauss(0, accel_noise), az + rng.gauss(0, accel_noise))
+
+
+def angle_errors(attitude, samples, dt, trusted = None):
+    # runs a filter over the samples; returns the RMS and the largest roll/pitch error after the first 5 seconds
+    sum_sq = 0.0
+    worst = 0.0
+    count = 0
+    for i, (roll, pitch, gx, gy, gz, ax, ay, az) in enumerate(samples):
+        if i == 0:
+            attitude.reset(ax, ay, az)
+        if trusted is None:
+            attitude.update(gx, gy, gz, ax, ay, az, dt)
+        else:
+            attitude.update(gx, gy, gz, ax, ay, az, dt, trusted(ax, ay, az))
+        if i * dt >= 5:
+            for error in (attitude.roll - roll, attitude.pitch - pitch):
+                sum_sq += error * error
+                worst = max(worst, abs(error))
+                count += 1
+    return math.sqrt(sum_sq / count), worst
@@ -0,0 +1,108 @@
+# a brushed motor for the host checks: speed follows the pwm with a first-order lag, the encoder edges are
+# fed to MotorPID the way the pin interrupts do, with their timestamps
+# optionally the load (gears, wheels) has Coulomb friction and sits behind a backlash gap: inside the gap the motor
+# only moves its own inertia, and it takes up the gap with an inelastic impact; the encoder is on the motor shaft
+import math
+import hostenv
+
+STEPS_PER_TICK = 100 # plant sub-steps per control tick, the edge timestamps are this fine
+
+
+class MotorPlant:
+    def __init__(self, pid, max_rps = 200, tau = 0.05, friction_pwm = 3000, coulomb_rps2 = 0.0, backlash_rev = 0.0,
+                 motor_inertia = 0.3):
+        self.pid = pid
+        self.max_rps = max_rps # at full pwm; slower than the feed-forward table expects, the PI makes up the rest
+        self.tau = tau # with the load engaged
+        self.friction_pwm = friction_pwm # the driver and the brushes lose this much of the duty
+        self.coulomb_rps2 = coulomb_rps2 # load friction, as the deceleration it gives the whole drivetrain
+        self.backlash_rev = backlash_rev # gap between the motor and the load, in motor revolutions
+        self.motor_inertia = motor_inertia # fraction of the drivetrain inertia on the motor side of the gap
+        self.speed_rps = 0.0 # motor
+        self.load_rps = 0.0 # load, in motor revolutions
+        self.gap = 0.0 # motor ahead of the load, within +-backlash_rev / 2
+        self.position = 0.0 # encoder counts
+
+    def _load_friction(self, push):
+        # Coulomb friction against the load's motion; at rest it holds up to coulomb_rps2 of the push on it
+        if self.load_rps > 0:
+            return self.coulomb_rps2
+        if self.load_rps < 0:
+            return -self.coulomb_rps2
+        return max(-self.coulomb_rps2, min(push, self.coulomb_rps2))
+
+    def _move(self, torque, dt):
+        # torque is the motor's acceleration of the whole drivetrain, rps/s
+        half = self.backlash_rev / 2
+        motor_accel = torque / self.motor_inertia
+        load_accel = -self._load_friction(0.0) / (1 - self.motor_inertia)
+        if (self.gap >= half and motor_accel >= load_accel) or (self.gap <= -half and motor_accel <= load_accel):
+            # engaged, both move together
+            speed = self.speed_rps + (torque - self._load_friction(torque)) * dt
+            if self.speed_rps * speed < 0:
+                speed = 0.0 # friction stops the load, it doesn't turn it around
+            self.speed_rps = speed
+            self.load_rps = speed
+            return
+        load = self.load_rps + load_accel * dt
+        if self.load_rps * load < 0:
+            load = 0.0
+        self.speed_rps += motor_accel * dt
+        self.load_rps = load
+        self.gap += (self.speed_rps - self.load_rps) * dt
+        if self.gap > half or self.gap < -half:
+            # the gap is taken up: the two inertias meet and move on together
+            self.gap = half if self.gap > half else -half
+            self.speed_rps = self.motor_inertia * self.speed_rps + (1 - self.motor_inertia) * self.load_rps
+            self.load_rps = self.speed_rps
+
+    def step(self, pwm, dt_us):
+        pid = self.pid
+        sub_us = dt_us // STEPS_PER_TICK
+        dt = sub_us / 1_000_000
+        drive = max(0, abs(pwm) - self.friction_pwm)
+        if pwm < 0:
+            drive = -drive
+        for _ in range(STEPS_PER_TICK):
+            hostenv.advance_us(sub_us)
+            self._move((drive / 65535 * self.max_rps - self.speed_rps) / self.tau, dt)
+            self.position += self.speed_rps * pid.ppr * dt
+            count = math.floor(self.position)
+            while pid.total_pulse_count < count:
+                pid.total_pulse_count += 1
+                pid.edges.record_edge(hostenv.ticks_us(), 1)
+            while pid.total_pulse_count > count:
+                pid.total_pulse_count -= 1
+                pid.edges.record_edge(hostenv.ticks_us(), -1)
+
+
+class PlantMotor:
+    # the part of Motor the calibrations use, the control loop is run by the test
+    def __init__(self, pid, max_rps):
+        self.pid = pid
+        self.max_rps = max_rps
+        self.pwm = 0
+
+    def set_speed_rps(self, rps):
+        self.pid.set_target_rps(rps)
+
+    def get_speed_rps(self):
+        return self.pid.current_rps
+
+
+def make_pid(fixed_point, mode = 2):
+    from motor import MotorPID
+    pid = MotorPID(0, 1)
+    pid.dt = 0.01
+    pid.update_fixed_params()
+    pid.fixed_point = fixed_point
+    pid.thermal_protection = False
+    pid.logging = False
+    pid.set_mode(mode)
+    return pid
+
+
+def control_tick(pid, plant):
+    # one period of the control loop: the plant runs on the last output, then the controller
+    plant.step(pid.pwm, pid.dt_us)
+    return pid.update_fixed() if pid.fixed_point else pid.update()
@@ -0,0 +1,84 @@
+import math
+import random
+import hostenv
+from attitude import MahonyFilter
+from imu_trajectory import ComplementaryFilter, trajectory, angle_errors
+
+G = 9.81
+
+
+def up_vector(roll, pitch):
+    # gravity seen by a body rolled and pitched by these angles (radians), x forward, y left, z up
+    return (-math.sin(pitch) * G, math.sin(roll) * math.cos(pitch) * G, math.cos(roll) * math.cos(pitch) * G)
+
+
+def test_reset_takes_the_accelerometer_attitude():
+    attitude = MahonyFilter()
+    attitude.reset(*up_vector(math.radians(20), math.radians(-10)))
+    assert abs(attitude.roll - 20) < 1e-6
+    assert abs(attitude.pitch + 10) < 1e-6
+    assert abs(attitude.yaw) < 1e-6
+
+
+def test_gyro_bias_is_estimated_while_standing():
+    random.seed(1)
+    attitude = MahonyFilter()
+    ax, ay, az = up_vector(math.radians(8), math.radians(3))
+    attitude.reset(ax, ay, az)
+    bias = (0.02, -0.015, 0.01) # rad/s, the roll and pitch axes are observable through gravity
+    for _ in range(12000):
+        attitude.update(bias[0] + random.gauss(0, 0.005), bias[1] + random.gauss(0, 0.005), bias[2],
+                        ax + random.gauss(0, 0.2), ay + random.gauss(0, 0.2), az + random.gauss(0, 0.2), 0.01)
+    assert abs(attitude.roll - 8) < 0.3
+    assert abs(attitude.pitch - 3) < 0.3
+    # only the components across gravity are seen: the gravity direction is nearly z here
+    assert abs(attitude.bias_x - bias[0]) < 0.003
+    assert abs(attitude.bias_y - bias[1]) < 0.003
+
+
+def test_rotation_follows_the_gyro():
+    attitude = MahonyFilter(kp = 0.0, ki = 0.0)
+    attitude.reset(0.0, 0.0, G)
+    # 90 deg/s about x for half a second, without an accelerometer correction
+    for _ in range(500):
+        attitude.update(math.radians(90), 0.0, 0.0, 0.0, 0.0, 0.0, 0.001)
+    assert abs(attitude.roll - 45) < 0.1
+    norm = attitude.q0 ** 2 + attitude.q1 ** 2 + attitude.q2 ** 2 + attitude.q3 ** 2
+    assert abs(norm - 1) < 1e-9
+
+
+def test_untrusted_accelerometer_corrects_less():
+    trusted = MahonyFilter()
+    moving = MahonyFilter()
+    for attitude, accel_trusted in ((trusted, True), (moving, False)):
+        attitude.reset(0.0, 0.0, G)
+        # a long acceleration forward tilts the measured gravity backwards
+        for _ in range(100):
+            attitude.update(0.0, 0.0, 0.0, 4.0, 0.0, G, 0.01, accel_trusted)
+    assert abs(moving.pitch) < abs(trusted.pitch) / 5
+    assert moving.bias_y == 0.0
+
+
+def trusted(ax, ay, az):
+    # MPU6050.filter_step trusts the accelerometer within 5% of 1g
+    return (0.95 * G) ** 2 <= ax * ax + ay * ay + az * az <= (1.05 * G) ** 2
+
+
+def test_more_accurate_than_the_complementary_filter():
+    # combined roll, pitch and yaw, where the Euler integration couples the axes
+    scenarios = (({}, 0.3),
+                 ({'bias': (0.02, -0.015, 0.01), 'gyro_noise': 0.005, 'accel_noise': 0.2}, 0.7))
+    for kwargs, max_rms in scenarios:
+        samples = list(trajectory(60, 0.01, 25, 20, 60, **kwargs))
+        mahony_rms, mahony_worst = angle_errors(MahonyFilter(), samples, 0.01, trusted)
+        old_rms, old_worst = angle_errors(ComplementaryFilter(), samples, 0.01)
+        assert mahony_rms < max_rms, kwargs
+        assert mahony_rms < old_rms / 2 and mahony_worst < old_worst / 2, kwargs
+
+
+def test_surge_hurts_it_less_than_the_complementary_filter():
+    samples = list(trajectory(60, 0.01, 25, 20, 60, bias = (0.02, -0.015, 0.01), gyro_noise = 0.005,
+                              accel_noise = 0.2, forward_accel = 3.0))
+    mahony_rms, _ = angle_errors(MahonyFilter(), samples, 0.01, trusted)
+    old_rms, _ = angle_errors(ComplementaryFilter(), samples, 0.01)
+    assert mahony_rms < old_rms
@@ -0,0 +1,95 @@
+import math
+import hostenv
+import utils
+from autotune import RelayExperiment, AutoTune
+from motor_plant import MotorPlant, PlantMotor, make_pid, control_tick
+
+
+def run_relay(hysteresis_rps, slope_rps = 100.0, delay_ms = 50, amplitude_pwm = 1000, setpoint_rps = 60):
+    # integrator with dead time: the speed changes by slope_rps per second for a full relay step, delay_ms later;
+    # its limit cycle is known exactly, a triangle of period 4 * (delay + hysteresis / slope)
+    bias_pwm = 20000
+    experiment = RelayExperiment(setpoint_rps, bias_pwm, amplitude_pwm, hysteresis_rps = hysteresis_rps)
+    gain = slope_rps / amplitude_pwm # rps per second, per pwm away from the bias
+    pending = [bias_pwm] * delay_ms
+    rps = setpoint_rps
+    now_ms = 0
+    while not experiment.done and now_ms < 10_000:
+        pending.append(experiment.step(rps, now_ms))
+        rps += gain * (pending.pop(0) - bias_pwm) / 1000
+        now_ms += 1
+    return experiment
+
+
+def test_relay_finds_the_limit_cycle():
+    slope_rps = 100.0
+    delay_s = 0.05
+    amplitude_pwm = 1000
+    for hysteresis_rps in (0.2, 1.0, 2.0):
+        experiment = run_relay(hysteresis_rps, slope_rps, int(delay_s * 1000), amplitude_pwm)
+        assert experiment.done
+        period_s = 4 * (delay_s + hysteresis_rps / slope_rps)
+        assert abs(experiment.ultimate_period - period_s) <= 0.03 * period_s
+        # the relay's describing function, with the amplitude corrected for the hysteresis
+        amplitude_rps = hysteresis_rps + slope_rps * delay_s
+        ultimate_gain = 4 * amplitude_pwm / (math.pi * math.sqrt(amplitude_rps ** 2 - hysteresis_rps ** 2))
+        assert abs(experiment.ultimate_gain - ultimate_gain) <= 0.03 * ultimate_gain
+
+
+def test_pi_gains_follow_tyreus_luyben():
+    experiment = run_relay(1.0)
+    kp, ki = experiment.pi_gains()
+    assert kp == experiment.ultimate_gain / 3.2
+    assert ki == kp / (2.2 * experiment.ultimate_period)
+    assert RelayExperiment(60, 20000, 1000).pi_gains() is None
+
+
+def tune_on_plant(plant_args):
+    hostenv.set_time_us(1_000_000)
+    pid = make_pid(False)
+    plant = MotorPlant(pid, **plant_args)
+    motor = PlantMotor(pid, 180)
+    tune = AutoTune(motor)
+    tune.start()
+    ticks = 0
+    while tune.is_running() and ticks < 100_000:
+        motor.pwm = control_tick(pid, plant)
+        if ticks % 5 == 0:
+            tune.update()
+        ticks += 1
+    return pid, plant
+
+
+# a drivetrain with friction on the load and backlash between it and the motor: at every relay switch the
+# motor crosses the gap alone before it takes the load again
+NONLINEAR_PLANTS = ({'friction_pwm': 0, 'coulomb_rps2': 150, 'backlash_rev': 0.25},
+                    {'friction_pwm': 0, 'coulomb_rps2': 150, 'backlash_rev': 0.5})
+# target rps, and the speed ripple allowed over the second half of the step; above the period path the count of a
+# 10 ms update is 1/0.12 rps coarse, the PI passes some of that to the motor
+STEPS = ((60, 2.0), (100, 8.0), (30, 1.0), (-30, 1.0), (5, 0.5), (0, 0.0))
+
+
+def test_tuned_gains_are_stable_with_backlash_and_friction(tmp_path, monkeypatch):
+    for i, plant_args in enumerate(NONLINEAR_PLANTS):
+        # each in its own directory, so no plant starts from the gains saved for the other one
+        (tmp_path / str(i)).mkdir()
+        monkeypatch.chdir(tmp_path / str(i))
+        pid, plant = tune_on_plant(plant_args)
+        kp, ki, _ = pid.gear_gains[0]
+        assert (kp, ki) != (250, 1250), plant_args
+        # the tuned gains are in place for the next runs, and saved
+        assert pid.mode == 2 and pid.kp == int(kp)
+        assert utils.load_json_from_file(pid.gains_file)['0'][:2] == [kp, ki]
+        last_rps = pid.target_rps
+        for target_rps, ripple_rps in STEPS:
+            pid.set_target_rps(target_rps)
+            speeds = []
+            for _ in range(200):
+                control_tick(pid, plant)
+                speeds.append(plant.speed_rps)
+            settled = speeds[100:]
+            assert abs(sum(settled) / len(settled) - target_rps) <= max(0.3, 0.01 * abs(target_rps)), (plant_args, target_rps)
+            assert max(settled) - min(settled) <= ripple_rps, (plant_args, target_rps)
+            # no large swing past the target, the reversal through the gap included
+            assert min(last_rps, target_rps) - 12 <= min(speeds) and max(speeds) <= max(last_rps, target_rps) + 12, (plant_args, target_rps)
+            last_rps = target_rps
@@ -0,0 +1,51 @@
+import hostenv
+from battery import BatteryMonitor, soc_from_cell_mv
+
+
+class Pack:
+    # a 2S pack seen through the voltage reader: open-circuit voltage behind an internal resistance
+    def __init__(self, ocv_mv, resistance_mohm):
+        self.ocv_mv = ocv_mv
+        self.resistance_mohm = resistance_mohm
+        self.current_ma = 0
+
+    def read_mv(self):
+        return self.ocv_mv - self.resistance_mohm * self.current_ma // 1000
+
+
+def drive(battery, pack, currents_pm, repeats):
+    for _ in range(repeats):
+        for current_pm in currents_pm:
+            pack.current_ma = current_pm * battery.stall_current_ma // 1000
+            battery.update(current_pm)
+            hostenv.advance_us(25_000)
+
+
+def test_soc_table():
+    assert soc_from_cell_mv(3200) == 0
+    assert soc_from_cell_mv(3790) == 40
+    assert soc_from_cell_mv(3805) == 45
+    assert soc_from_cell_mv(4250) == 100
+
+
+def test_full_pack_at_idle_runs_on_the_parts_list_capacity():
+    battery = BatteryMonitor(Pack(8400, 60))
+    drive(battery, battery.voltage_reader, (0,), 2000)
+    _, ocv_mv, _, soc, runtime_min = battery.get_state()
+    assert ocv_mv == 8400
+    assert soc == 100
+    # 3000 mAh at the 250 mA idle draw
+    assert runtime_min == 720
+
+
+def test_sag_is_added_back_while_driving():
+    pack = Pack(7640, 60)
+    battery = BatteryMonitor(pack)
+    # launches and lifts: the current varies enough for the resistance to be estimated
+    drive(battery, pack, (100, 400, 800, 300, 0, 600), 200)
+    voltage_mv, ocv_mv, resistance_mohm, soc, _ = battery.get_state()
+    assert abs(resistance_mohm - 60) <= 10
+    assert voltage_mv < 7400
+    assert abs(ocv_mv - 7640) <= 20
+    assert soc == 50
+    assert not battery.is_low()
@@ -0,0 +1,57 @@
+import hostenv
+from encoder import EdgeSpeedEstimator
+
+PPR = 12
+
+
+def feed_edges(estimator, rps, edges, start_us = 1000, jitter_us = 0):
+    # evenly spaced edges, every other one moved by jitter_us like an uneven A/B phase; returns the last time
+    period_us = int(1_000_000 / (PPR * abs(rps)))
+    step = 1 if rps > 0 else -1
+    t_us = start_us
+    for i in range(edges):
+        t_us += period_us + (jitter_us if i % 2 else -jitter_us)
+        estimator.record_edge(t_us & 0x3FFFFFFF, step)
+    return t_us
+
+
+def test_steady_speed_in_both_directions():
+    for rps in (0.5, 2, 20, 150, -3, -60):
+        estimator = EdgeSpeedEstimator(PPR)
+        t_us = feed_edges(estimator, rps, 10, jitter_us = 50)
+        speed = estimator.get_speed_crps((t_us + 10) & 0x3FFFFFFF)
+        assert abs(speed - rps * 100) <= max(1, abs(rps)), rps
+
+
+def test_slowing_down_is_bounded_by_the_time_since_the_last_edge():
+    estimator = EdgeSpeedEstimator(PPR)
+    t_us = feed_edges(estimator, 10, 10)
+    period_us = 1_000_000 // (PPR * 10)
+    assert estimator.get_speed_crps(t_us + period_us // 2) == 1000
+    # no edge for two periods: the motor can't be turning faster than half the last speed
+    assert estimator.get_speed_crps(t_us + 2 * period_us) <= 500
+
+
+def test_stopped_after_the_timeout():
+    estimator = EdgeSpeedEstimator(PPR, timeout_us = 250_000)
+    t_us = feed_edges(estimator, 5, 10)
+    assert estimator.get_speed_crps(t_us + 300_000) == 0
+    # the old edges are dropped, a single new one isn't a speed yet
+    estimator.record_edge(t_us + 400_000, 1)
+    assert estimator.get_speed_crps(t_us + 400_010) == 0
+
+
+def test_ticks_wrap_around():
+    estimator = EdgeSpeedEstimator(PPR)
+    t_us = feed_edges(estimator, 20, 10, start_us = 0x3FFFFFFF - 10_000)
+    assert t_us > 0x3FFFFFFF
+    assert abs(estimator.get_speed_crps((t_us + 10) & 0x3FFFFFFF) - 2000) <= 20
+
+
+def test_edge_sequence_wraps_without_growing():
+    estimator = EdgeSpeedEstimator(PPR)
+    estimator.edge_seq = 0x3FFFFFF - 3
+    t_us = feed_edges(estimator, 20, 10)
+    assert estimator.edge_seq < 10
+    assert hostenv.small_int(estimator.edge_seq)
+    assert abs(estimator.get_speed_crps(t_us + 10) - 2000) <= 20
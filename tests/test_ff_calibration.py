@@ -0,0 +1,69 @@
+import hostenv
+from ff_calibration import interpolate_points, fit_ff_table, FFCalibration
+from motor_plant import MotorPlant, PlantMotor, make_pid, control_tick
+
+
+def test_interpolate_points_extrapolates_the_end_segments():
+    points = [(10, 100), (20, 300), (40, 500)]
+    assert interpolate_points(points, 15) == 200
+    assert interpolate_points(points, 30) == 400
+    assert interpolate_points(points, 0) == -100
+    assert interpolate_points(points, 50) == 600
+    assert interpolate_points([(10, 7)], 99) == 7
+
+
+def test_fit_ff_table_follows_the_samples():
+    def pwm(rps):
+        return 1500 + 180 * rps + 0.2 * rps * rps
+    samples = [(rps, pwm(rps)) for rps in range(20, 260, 20)]
+    table = fit_ff_table(samples, 5, 92)
+    assert len(table) == 92
+    # between the samples the parabola is replaced by chords, 0.2 * (20 / 2)^2 off at most
+    for i in range(4, 49):
+        assert abs(table[i] - pwm(i * 5)) <= 21
+
+
+def test_fit_ff_table_is_monotonic_and_clamped():
+    # unsorted, with a noisy dip and a sample past full pwm
+    samples = [(60, 20000), (20, 9000), (40, 8000), (80, 40000), (100, 70000)]
+    table = fit_ff_table(samples, 5, 30)
+    assert all(table[i] <= table[i + 1] for i in range(len(table) - 1))
+    assert max(table) == 65535
+    assert table[0] >= 0
+    assert fit_ff_table([], 5, 30) is None
+
+
+def test_lookup_table_matches_the_cubic():
+    pid = make_pid(True)
+    for crps in range(0, 45000, 37):
+        exact = pid.pwm_feed_forward(crps / 100)
+        assert abs(pid.pwm_feed_forward_lookup(crps) - exact) <= 0.002 * 65535
+    # past the end of the table the last entry holds
+    assert pid.pwm_feed_forward_lookup(10_000_000) == pid.ff_table[pid.ff_table_size - 1]
+
+
+def test_sweep_measures_the_plant(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    hostenv.set_time_us(1_000_000)
+    pid = make_pid(False)
+    plant = MotorPlant(pid)
+    motor = PlantMotor(pid, 180)
+    calibration = FFCalibration(motor)
+    calibration.start()
+    ticks = 0
+    while calibration.is_running() and ticks < 100_000:
+        motor.pwm = control_tick(pid, plant)
+        if ticks % 5 == 0:
+            calibration.update()
+        ticks += 1
+    assert calibration.state == 'done'
+    # the plant needs friction_pwm, then 65535 / max_rps per rps; the table holds it between the set points
+    table = pid.ff_tables[0]
+    for i in range(4, 180 // pid.ff_table_step_rps + 1):
+        need = plant.friction_pwm + i * pid.ff_table_step_rps * 65535 / plant.max_rps
+        assert abs(table[i] - need) <= 0.01 * 65535, i
+    # and it was saved
+    assert pid.mode == 2
+    pid.build_ff_table()
+    pid.load_ff_tables()
+    assert list(pid.ff_tables[0]) == list(table)
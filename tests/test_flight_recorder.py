@@ -0,0 +1,78 @@
+import pytest
+import hostenv
+from flight_recorder import FlightRecorder, MOTOR_FIELDS, FREEZE_NONE, FREEZE_DISCONNECT, decode_log
+from motor_plant import MotorPlant, make_pid, control_tick
+
+
+def record(recorder, first, last):
+    # record n is n * 10 + the field index, so the order of the fields and of the records both show
+    for n in range(first, last):
+        offset = recorder.next_offset()
+        if offset < 0:
+            return
+        for k in range(recorder.n_fields):
+            recorder.buf[offset + k] = n * 10 + k
+
+
+def round_trip(recorder, name):
+    recorder.save(name)
+    with open(name, 'rb') as f:
+        return decode_log(f.read())
+
+
+def test_save_before_the_ring_wraps(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    recorder = FlightRecorder(len(MOTOR_FIELDS), size = 8)
+    record(recorder, 0, 5)
+    reason, columns = round_trip(recorder, 'log.bin')
+    assert reason == FREEZE_NONE
+    assert list(columns) == list(MOTOR_FIELDS)
+    for k, field in enumerate(MOTOR_FIELDS):
+        assert list(columns[field]) == [n * 10 + k for n in range(5)]
+
+
+def test_save_after_the_ring_wraps_keeps_the_newest_in_order(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    recorder = FlightRecorder(len(MOTOR_FIELDS), size = 8, post_trigger = 3)
+    record(recorder, 0, 13)
+    recorder.trigger(FREEZE_DISCONNECT)
+    # only post_trigger more records are written, then it freezes
+    record(recorder, 13, 30)
+    assert recorder.frozen
+    reason, columns = round_trip(recorder, 'log.bin')
+    assert reason == FREEZE_DISCONNECT
+    assert len(columns['time_ms']) == 8
+    assert list(columns['time_ms']) == [n * 10 for n in range(8, 16)]
+    assert list(columns['pwm']) == [n * 10 + 8 for n in range(8, 16)]
+    # re-armed, it starts over
+    recorder.rearm()
+    record(recorder, 40, 42)
+    reason, columns = round_trip(recorder, 'log.bin')
+    assert reason == FREEZE_NONE
+    assert list(columns['rps']) == [403, 413]
+
+
+def test_decode_rejects_other_files():
+    # a log of other fields, and not a log at all
+    with pytest.raises(ValueError):
+        decode_log(b'FRC1' + bytes([3, 0, 0, 0]))
+    with pytest.raises(ValueError):
+        decode_log(b'XXXX' + bytes(4))
+
+
+def test_motor_pid_records_its_fields(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    hostenv.set_time_us(1_000_000)
+    pid = make_pid(True)
+    pid.logging = True
+    plant = MotorPlant(pid)
+    pid.set_target_rps(50)
+    for _ in range(120):
+        control_tick(pid, plant)
+    _, columns = round_trip(pid.recorder, 'motor.bin')
+    assert len(columns['time_ms']) == 120
+    assert list(columns['time_ms']) == sorted(columns['time_ms'])
+    assert columns['target'][-1] == 5000
+    assert columns['pwm'][-1] == pid.pwm
+    assert columns['rps'][-1] == pid.current_crps
+    assert columns['ff'][-1] == pid.pwm_ff
@@ -0,0 +1,75 @@
+import hostenv
+import machine
+import i2c_bus
+from i2c_bus import PRIORITY_HIGH
+
+IMU = 0x68
+TOF = 0x29
+
+
+class SlowI2C(machine.I2C):
+    # every transaction takes a fixed time per device; interleave is run once inside the next ToF read, as the IMU
+    # soft timer callback would if it landed between _begin() and _end()
+    def __init__(self, durations_us):
+        super().__init__()
+        self.durations_us = durations_us
+        self.interleave = None
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        if addr == TOF and self.interleave is not None:
+            callback = self.interleave
+            self.interleave = None
+            callback()
+        hostenv.advance_us(self.durations_us[addr])
+        super().readfrom_mem_into(addr, memaddr, buf)
+
+
+def make_bus():
+    i2c_bus._buses.clear()
+    bus = i2c_bus.get_bus(0, 1, 2)
+    bus.i2c = SlowI2C({IMU: 400, TOF: 150})
+    bus.register(IMU, 'mpu6050', PRIORITY_HIGH)
+    bus.register(TOF, 'vl53l0x')
+    return bus
+
+
+def test_an_interleaved_transaction_keeps_both_devices_stats():
+    hostenv.set_time_us(1_000_000)
+    bus = make_bus()
+    imu_buf = bytearray(14)
+    tof_buf = bytearray(12)
+    imu_start = []
+
+    def imu_callback():
+        imu_start.append(hostenv.ticks_us())
+        bus.readfrom_mem_into(IMU, 0x3B, imu_buf)
+
+    bus.i2c.interleave = imu_callback
+    tof_start = hostenv.ticks_us()
+    bus.readfrom_mem_into(TOF, 0x14, tof_buf)
+    stats = {name: (count, errors, avg, worst) for name, count, errors, avg, worst in bus.get_stats()}
+    assert stats['mpu6050'] == (1, 0, 400, 400)
+    # the ToF read is charged from its own start, the IMU read it waited for included
+    assert stats['vl53l0x'] == (1, 0, 550, 550)
+    assert bus.last_start_us[0] == imu_start[0]
+    assert bus.last_start_us[1] == tof_start
+    assert not bus.busy
+
+
+def test_failed_transaction_is_counted_and_frees_the_bus():
+    hostenv.set_time_us(1_000_000)
+    bus = make_bus()
+
+    def fail():
+        raise OSError(5)
+
+    bus.i2c.interleave = fail
+    try:
+        bus.readfrom_mem_into(TOF, 0x14, bytearray(12))
+    except OSError:
+        pass
+    assert bus.get_stats()[1][:3] == ('vl53l0x', 1, 1)
+    assert not bus.busy
+    bus.readfrom_mem_into(TOF, 0x14, bytearray(12))
+    assert bus.get_stats()[1][:3] == ('vl53l0x', 2, 1)
+    assert bus.collisions == 0
@@ -0,0 +1,97 @@
+import random
+import hostenv
+from motor_plant import MotorPlant, make_pid, control_tick
+
+# state update_fixed() leaves behind, every one has to stay a small int so the hard interrupt doesn't allocate
+FIXED_STATE = ('pwm', 'last_pwm', 'pwm_ff', 'P', 'I', 'I_acc', 'err', 'target_crps', 'filtered_target_crps',
+               'old_filtered_target_crps', 'current_crps', 'time_now', 'real_dt_us', 'current_count', 'last_count',
+               'elapsed_counts', 'pulse_sum', 'pulse_iterator', 'pulse_window', 'pwm_boost', 'new_boost',
+               'pwm_stall_boost', 'pwm_start_boost', 'stall_count')
+EDGE_STATE = ('period_us', 'since_last_us', 'speed_crps', 'edge_seq')
+
+
+def run_profile(fixed_point, profile, check = None):
+    hostenv.set_time_us(1_000_000)
+    pid = make_pid(fixed_point)
+    plant = MotorPlant(pid)
+    settled = []
+    for target_rps, ticks in profile:
+        pid.set_target_rps(target_rps)
+        # means over the second half of the step, the count quantization makes single ticks jitter
+        speed_sum = 0.0
+        pwm_sum = 0
+        for tick in range(ticks):
+            control_tick(pid, plant)
+            if check:
+                check(pid)
+            if tick >= ticks // 2:
+                speed_sum += plant.speed_rps
+                pwm_sum += pid.pwm
+        samples = ticks - ticks // 2
+        settled.append((speed_sum / samples, pwm_sum / samples))
+    return settled
+
+
+PROFILE = ((60, 100), (150, 100), (20, 150), (-40, 150), (0, 100))
+
+
+def test_fixed_point_follows_the_float_controller():
+    floating = run_profile(False, PROFILE)
+    fixed = run_profile(True, PROFILE)
+    for (target_rps, _), (float_rps, float_pwm), (fixed_rps, fixed_pwm) in zip(PROFILE, floating, fixed):
+        assert abs(float_rps - target_rps) <= max(0.5, 0.01 * abs(target_rps))
+        assert abs(fixed_rps - target_rps) <= max(0.5, 0.01 * abs(target_rps))
+        assert abs(fixed_pwm - float_pwm) <= 0.01 * 65535
+
+
+def test_speed_holds_across_the_period_and_count_paths():
+    # from the edge period at crawl speed to the counts at full speed, through the switch between them
+    for fixed_point in (False, True):
+        for target_rps in (3, 10, 40, 60, 90, 170, -40):
+            ((speed_rps, _),) = run_profile(fixed_point, ((target_rps, 300),))
+            assert abs(speed_rps - target_rps) <= max(0.2, 0.005 * abs(target_rps)), (fixed_point, target_rps)
+
+
+def test_update_fixed_keeps_small_ints():
+    def check(pid):
+        for name in FIXED_STATE:
+            assert hostenv.small_int(getattr(pid, name)), name
+        for name in EDGE_STATE:
+            assert hostenv.small_int(getattr(pid.edges, name)), name
+    run_profile(True, PROFILE, check)
+
+
+def reference_window(counts, size, min_pulses):
+    # the list the ring replaced: newest counts first until enough pulses are summed
+    total = 0
+    ticks = 0
+    while abs(total) < min_pulses and ticks < size:
+        total += counts[-1 - ticks]
+        ticks += 1
+    return total, ticks
+
+
+def test_pulse_window_matches_the_list_scan():
+    random.seed(1)
+    for _ in range(200):
+        pid = make_pid(True)
+        pid.period_measurement = False
+        size = pid.pulse_count_list_size
+        counts = [0] * size
+        total = 0
+        rate = random.uniform(-8, 8)
+        for _ in range(300):
+            if random.random() < 0.02:
+                rate = random.uniform(-8, 8)
+            if random.random() < 0.05:
+                rate = 0
+            count = int(random.gauss(rate, 0.8))
+            total += count
+            counts.append(count)
+            counts.pop(0)
+            pid.current_count = total
+            pid.elapsed_counts = total - pid.last_count
+            pid.last_count = total
+            pid.update_pulse_window()
+            expected = reference_window(counts, size, pid.min_pulse_count_fixed)
+            assert (pid.pulse_window_sum(pid.pulse_window), pid.pulse_window) == expected
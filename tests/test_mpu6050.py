@@ -0,0 +1,164 @@
+import struct
+import hostenv
+import machine
+import i2c_bus
+from array import array
+from mpu6050 import MPU6050, MPU6050_ADDR, MPU6050_REG_ACCEL_XOUT_H, MPU6050_REG_FIFO_COUNT_H, MPU6050_REG_FIFO_R_W, \
+    MPU6050_REG_USER_CTRL, USER_CTRL_FIFO_EN, G_CONSTANT
+from imu_fifo import FIFO_FRAME_VALUES, parse_fifo
+
+
+class FakeI2C(machine.I2C):
+    # records the registers read; the FIFO data register is a stream, not a register: every read takes the next bytes
+    def __init__(self, devices):
+        super().__init__()
+        self.devices = devices
+        self.fifo = bytearray()
+        self.reads = []
+        self.last_buf = None
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        self.reads.append(memaddr)
+        self.last_buf = buf
+        if memaddr == MPU6050_REG_FIFO_COUNT_H:
+            buf[:] = struct.pack('>H', len(self.fifo))
+        elif memaddr == MPU6050_REG_FIFO_R_W:
+            buf[:] = self.fifo[:len(buf)]
+            self.fifo = self.fifo[len(buf):]
+        else:
+            super().readfrom_mem_into(addr, memaddr, buf)
+
+
+def make_imu():
+    i2c_bus._buses.clear()
+    imu = MPU6050(0, 1, 2)
+    fake = FakeI2C(imu.i2c.i2c.devices)
+    imu.i2c.i2c = fake
+    return imu, fake
+
+
+def write_burst(fake, values):
+    # ax, ay, az, temperature, gx, gy, gz in LSB
+    fake.registers(MPU6050_ADDR)[MPU6050_REG_ACCEL_XOUT_H:MPU6050_REG_ACCEL_XOUT_H + 14] = struct.pack('>7h', *values)
+
+
+def test_parse_fifo_decodes_whole_frames():
+    frames = [(100, -200, 16384, -32768, 32767, -1), (1, 2, 3, 4, 5, 6), (-7, 8, -9, 10, -11, 12)]
+    buf = b''.join(struct.pack('>6h', *frame) for frame in frames) + b'\x01\x02\x03'
+    out = array('h', [0] * (4 * FIFO_FRAME_VALUES))
+    assert parse_fifo(buf, len(buf), out) == 3
+    assert list(out[:3 * FIFO_FRAME_VALUES]) == [value for frame in frames for value in frame]
+    # frames that don't fit in out are left in the buffer
+    small = array('h', [0] * (2 * FIFO_FRAME_VALUES))
+    assert parse_fifo(buf, len(buf), small) == 2
+
+
+def test_burst_read_is_one_transaction():
+    imu, fake = make_imu()
+    # +-16g and +-250 deg/s are set at start-up
+    write_burst(fake, (2048, -1024, -32768, 340, 131, -262, 65))
+    imu.read_burst()
+    fake.reads.clear()
+    imu.read_burst()
+    assert fake.reads == [MPU6050_REG_ACCEL_XOUT_H]
+    assert abs(imu.accel_x - G_CONSTANT) < 1e-6
+    assert abs(imu.accel_y + G_CONSTANT / 2) < 1e-6
+    assert abs(imu.accel_z + 16 * G_CONSTANT) < 1e-6
+    assert abs(imu.gyro_x - 1.0) < 1e-6
+    assert abs(imu.gyro_y + 2.0) < 1e-6
+    assert abs(imu.gyro_z - 65 / 131) < 1e-6
+    assert imu.temp_raw == 340
+
+
+def test_fifo_drain_filters_every_frame():
+    imu, fake = make_imu()
+    imu.read_sensitivity_factors()
+    imu.fifo_sample_dt = 0.005
+    frames = [(2048, 0, 0, 0, 0, 131 * (i + 1)) for i in range(7)]
+    fake.fifo = bytearray(b''.join(struct.pack('>6h', *frame) for frame in frames) + b'\x00' * 5)
+    imu.drain_fifo(None)
+    assert imu.fifo_samples == 7
+    # read into the view kept for 7 frames, not into a new slice
+    assert fake.last_buf is imu.fifo_views[7]
+    assert abs(imu.gyro_z - 7.0) < 1e-6
+    # the partial frame waits for the next drain
+    assert len(fake.fifo) == 5
+
+
+def test_fifo_overflow_resets_it():
+    imu, fake = make_imu()
+    imu.read_sensitivity_factors()
+    fake.fifo = bytearray(1024)
+    imu.drain_fifo(None)
+    assert imu.fifo_overflows == 1
+    assert imu.fifo_samples == 0
+    assert fake.registers(MPU6050_ADDR)[MPU6050_REG_USER_CTRL] == USER_CTRL_FIFO_EN
+
+
+def test_gyro_refinement_saves_only_when_the_offsets_move(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    imu, fake = make_imu()
+    imu.save_calibration()
+    saves = []
+    save_calibration = imu.save_calibration
+    imu.save_calibration = lambda: (saves.append(list(imu.gyro_offsets)), save_calibration())
+    imu.set_vehicle_stationary(True)
+    # the car stands still with a gyro bias of -2, 1 and -0.5 deg/s; the save interval is let pass every window
+    write_burst(fake, (2048, 0, 0, 0, -262, 131, -65))
+
+    def stand_still(ticks):
+        for tick in range(ticks):
+            imu.read_burst()
+            imu.filter_step(0.01)
+            if tick % imu.refine_samples == 0:
+                hostenv.advance_ms(imu.calibration_save_interval_ms + 1000)
+                imu.update_calibration()
+
+    stand_still(4000)
+    assert abs(imu.gyro_offsets[0] - 2.0) < 0.01
+    assert abs(imu.gyro_offsets[1] + 1.0) < 0.01
+    converged = len(saves)
+    assert converged >= 1
+    # refined every window from now on, by less than the threshold: no more writes
+    refinements = imu.refinements
+    stand_still(20_000)
+    assert imu.refinements >= refinements + 90
+    assert len(saves) == converged
+    assert imu.load_calibration()
+    assert abs(imu.gyro_offsets[0] - saves[-1][0]) < 1e-6
+
+
+def test_calibration_from_another_temperature_is_replaced_at_once(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    imu, fake = make_imu()
+    # saved at 36.5 C, the die now reads 36.53 + 8160 / 340 = 60.5 C
+    imu.save_calibration()
+    write_burst(fake, (2048, 0, 0, 8160, -262, 131, -65))
+    assert imu.load_calibration()
+    assert imu.refine_stale
+    imu.set_vehicle_stationary(True)
+    for _ in range(imu.refine_samples):
+        imu.read_burst()
+        imu.filter_step(0.01)
+    # one quiet window takes the whole bias out, not refine_gain of it
+    assert imu.refinements == 1
+    assert abs(imu.gyro_offsets[0] - 2.0) < 1e-3
+    assert abs(imu.gyro_offsets[2] - 65 / 131) < 1e-3
+    assert not imu.refine_stale
+
+
+def test_no_refinement_while_driving_or_turning():
+    imu, fake = make_imu()
+    write_burst(fake, (2048, 0, 0, 0, -262, 131, -65))
+    # the wheels turn
+    for _ in range(2 * imu.refine_samples):
+        imu.read_burst()
+        imu.filter_step(0.01)
+    assert imu.refinements == 0
+    # the wheels stand but the car turns on the spot, faster than a bias could be
+    imu.set_vehicle_stationary(True)
+    write_burst(fake, (2048, 0, 0, 0, 131 * 10, 0, 0))
+    for _ in range(2 * imu.refine_samples):
+        imu.read_burst()
+        imu.filter_step(0.01)
+    assert imu.refinements == 0
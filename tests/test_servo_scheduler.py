@@ -0,0 +1,65 @@
+import random
+import hostenv
+import machine
+from servo_scheduler import ServoScheduler
+
+
+def make_scheduler(rng):
+    scheduler = ServoScheduler()
+    period_ms = rng.choice((5, 10, 20))
+    for _ in range(4):
+        pwm = machine.PWM(machine.Pin(0))
+        speed_ms = rng.choice((100, 300, 750, 2000, 6000))
+        accel_ms = rng.choice((0, 50, 200, 600, 1200))
+        scheduler.register(pwm, 500, 2500, 50, speed_ms, period_ms, accel_ms)
+    for idx in range(scheduler.n_servos):
+        scheduler.set_target(idx, rng.randrange(500_000, 2_500_001))
+    return scheduler
+
+
+def run_ticks(scheduler, n):
+    # returns False if a tick moved a servo by more than its step limit
+    for _ in range(n):
+        before = list(scheduler.current_ns[:scheduler.n_servos])
+        scheduler.tick(None)
+        for idx in range(scheduler.n_servos):
+            if abs(scheduler.current_ns[idx] - before[idx]) > scheduler.max_step_ns[idx]:
+                return False
+    return True
+
+
+def test_random_retargets_stay_within_the_step_limit_and_arrive():
+    rng = random.Random(7)
+    for _ in range(40):
+        scheduler = make_scheduler(rng)
+        for _ in range(60):
+            # new targets in the middle of moves, reversals included, stretched or at the full limits
+            idx = rng.randrange(scheduler.n_servos)
+            stretch = rng.choice((0, rng.randrange(2, 300)))
+            if rng.random() < 0.5:
+                # close to where it is, often behind it
+                reach = 5 * scheduler.max_step_ns[idx]
+                target = scheduler.current_ns[idx] + rng.randrange(-reach, reach)
+            else:
+                target = rng.randrange(500_000, 2_500_001)
+            scheduler.set_target(idx, target, stretch)
+            assert run_ticks(scheduler, rng.randrange(0, 40))
+        # the slowest servo needs about 3600 ticks for the whole range
+        assert run_ticks(scheduler, 5000)
+        for idx in range(scheduler.n_servos):
+            assert scheduler.current_ns[idx] == scheduler.target_ns[idx]
+            assert scheduler.velocity_ns[idx] == 0
+            assert scheduler.pwms[idx].duty_ns() == scheduler.target_ns[idx]
+
+
+def test_stretched_reversal_keeps_the_step_limit():
+    # moving away from a close target with a long stretch: the acceleration steps round down past the slow top
+    scheduler = ServoScheduler()
+    idx = scheduler.register(machine.PWM(machine.Pin(0)), 500, 2500, 50, 6000, 20, 1200)
+    scheduler.current_ns[idx] = 1_792_485
+    scheduler.target_ns[idx] = 1_790_219
+    scheduler.velocity_ns[idx] = 1702
+    scheduler.plan(idx, 200)
+    assert scheduler.get_eta_ticks(idx) <= 200
+    assert run_ticks(scheduler, scheduler.get_eta_ticks(idx))
+    assert scheduler.current_ns[idx] == 1_790_219
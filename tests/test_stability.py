@@ -0,0 +1,106 @@
+import math
+import hostenv
+from stability import YawStability
+from vehicle_plant import BicycleModel
+
+
+def test_reference_follows_the_bicycle_model():
+    assist = YawStability(wheelbase_mm = 200, max_lateral_mmps2 = 1e9)
+    rate = assist.reference_yaw_rate(10, 1000)
+    assert abs(rate - math.degrees(1000 * math.tan(math.radians(10)) / 200)) < 1e-6
+    # left is +, and reversing turns the other way for the same wheel angle
+    assert assist.reference_yaw_rate(-10, 1000) == -rate
+    assert assist.reference_yaw_rate(10, -1000) == -rate
+
+
+def test_reference_is_limited_by_the_lateral_grip():
+    assist = YawStability(max_lateral_mmps2 = 6000)
+    # 30 degrees at 3 m/s would need far more than 6 m/s^2
+    assert abs(assist.reference_yaw_rate(30, 3000) - math.degrees(6000 / 3000)) < 1e-6
+
+
+def test_oversteer_is_counter_steered_and_throttle_cut():
+    assist = YawStability()
+    reference = assist.reference_yaw_rate(10, 2000)
+    counter_steer = assist.update(reference + 40, 10, 2000, 0.01)
+    assert assist.active
+    assert counter_steer < 0
+    assert abs(assist.excess_dps - (40 - assist.threshold_dps)) < 1e-6
+    assert assist.min_throttle <= assist.throttle < 1.0
+    # to the right the counter-steer goes left
+    assert assist.update(-reference - 40, -10, 2000, 0.01) > 0
+
+
+def test_understeer_and_slow_speed_are_left_alone():
+    assist = YawStability()
+    # turning slower than the model is understeer, the driver's steering already answers it
+    assert assist.update(0.0, 20, 2000, 0.01) == 0.0
+    assert not assist.active
+    # below min_speed_mmps the model isn't trusted
+    assert assist.update(200.0, 0, assist.min_speed_mmps - 1, 0.01) == 0.0
+    assert not assist.active
+
+
+def test_throttle_comes_back_at_the_recovery_rate():
+    assist = YawStability(recovery = 1.0)
+    assist.update(assist.reference_yaw_rate(10, 2000) + 100, 10, 2000, 0.01)
+    cut = assist.throttle
+    assert cut == assist.min_throttle
+    for _ in range(10):
+        assist.update(0.0, 0, 2000, 0.01)
+    assert abs(assist.throttle - (cut + 0.1)) < 1e-9
+    for _ in range(100):
+        assist.update(0.0, 0, 2000, 0.01)
+    assert assist.throttle == 1.0
+
+
+def corner(assist_on, steer_deg, seconds = 4.0):
+    # 3 m/s at full throttle, the driver steers at 0.5 s and straightens at 2 s; the assist runs at 100 Hz on the
+    # yaw rate of the tick before, like the IMU timer. Returns the yaw rate error against the driver's reference,
+    # the yaw rates, the side slip and the counter-steer of every tick
+    car = BicycleModel()
+    car.u = 3.0
+    assist = YawStability()
+    counter_steer = 0.0
+    throttle = 1.0
+    errors = []
+    rates = []
+    slips = []
+    counter_steers = []
+    for tick in range(int(seconds * 100)):
+        driver = steer_deg if 50 <= tick < 200 else 0.0
+        if assist_on:
+            counter_steer = assist.update(car.yaw_rate_dps(), driver, car.speed_mmps(), 0.01)
+            throttle = assist.throttle
+        reference = assist.reference_yaw_rate(driver, car.speed_mmps())
+        for _ in range(10):
+            car.step(driver + counter_steer, throttle, 0.001)
+        errors.append(car.yaw_rate_dps() - reference)
+        rates.append(car.yaw_rate_dps())
+        slips.append(car.slip_deg())
+        counter_steers.append(counter_steer)
+    return assist, errors, rates, slips, counter_steers
+
+
+def rms(values):
+    return math.sqrt(sum(value * value for value in values) / len(values))
+
+
+def test_closed_loop_power_oversteer_is_caught_without_oscillation():
+    for steer_deg in (8, -8):
+        _, errors_off, _, slips_off, _ = corner(False, steer_deg)
+        assist, errors, rates, slips, counter_steers = corner(True, steer_deg)
+        # without the assist the rear lets go and the car spins
+        assert max(abs(slip) for slip in slips_off) > 60
+        assert rms(errors) < rms(errors_off) / 3
+        assert max(abs(slip) for slip in slips) < 35
+        # no swinging from side to side: the counter-steer changes side at most once, when the driver straightens
+        # with the counter-steer still on and the car yaws a little past straight, and that settles within 0.1 s
+        sides = [value > 0 for value in counter_steers if value != 0]
+        assert sum(1 for a, b in zip(sides, sides[1:]) if a != b) <= 1
+        after = [rate * steer_deg / abs(steer_deg) for rate in rates[200:]]
+        assert min(after) > -30
+        assert max(abs(rate) for rate in rates[210:]) < assist.threshold_dps
+        assert max(abs(rate) for rate in rates[-100:]) < 1
+        assert not assist.active
+        assert assist.throttle == 1.0
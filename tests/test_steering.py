@@ -0,0 +1,81 @@
+import math
+import hostenv
+from steering import Steering, SPEED_BUCKETS, expo, lock_factor
+
+
+def make_steering(**kwargs):
+    return Steering(0, **kwargs)
+
+
+def test_expo_keeps_the_ends_and_softens_the_center():
+    for amount in (0.0, 0.3, 1.0):
+        assert expo(1.0, amount) == 1.0
+        assert expo(-1.0, amount) == -1.0
+    assert abs(expo(0.2, 0.3)) < 0.2
+    # monotonic for any amount in 0..1
+    xs = [i / 50 - 1 for i in range(101)]
+    values = [expo(x, 1.0) for x in xs]
+    assert values == sorted(values)
+
+
+def test_lock_keeps_the_lateral_acceleration():
+    assert lock_factor(0, 197, 4000, 30) == 1.0
+    assert lock_factor(500, 197, 4000, 30) == 1.0
+    for speed_mmps in (1500, 2500, 3200):
+        lock = lock_factor(speed_mmps, 197, 4000, 30)
+        angle = math.radians(30 * lock)
+        assert abs(speed_mmps ** 2 * math.tan(angle) / 197 - 4000) < 1e-6
+
+
+def test_tables_match_the_curve():
+    steering = make_steering()
+    for bucket in range(SPEED_BUCKETS):
+        lock = steering.locks[bucket]
+        for position in range(-128, 128):
+            pulse_ns = steering.tables[bucket][position - steering.first_pos]
+            assert pulse_ns == steering._pulse_ns(steering.curve_angle(position, lock))
+    # the lock only gets smaller with speed
+    assert steering.locks == sorted(steering.locks, reverse = True)
+    assert steering.locks[0] == 1.0
+
+
+def test_curve_deadzone_and_ends():
+    steering = make_steering()
+    for position in range(-4, 5):
+        assert steering.curve_angle(position) == steering.center
+    assert steering.curve_angle(-128) == steering.left
+    assert steering.curve_angle(127) == steering.right
+    # x is 0 at the edge of the deadzone, the curve starts one step further out
+    for position in range(6, 128):
+        left = steering.curve_angle(-position) - steering.center
+        right = steering.curve_angle(position) - steering.center
+        assert left > 0 > right
+    half = steering.curve_angle(-128, 0.5) - steering.center
+    assert abs(half - (steering.left - steering.center) / 2) < 1e-9
+
+
+def test_position_follows_the_speed_bucket():
+    steering = make_steering()
+    steering.set_steering_position(-128)
+    full_lock_ns = steering.command_ns
+    assert abs(steering.get_command_wheel_angle() - steering.max_wheel_angle) < 0.1
+    # the lock changes with the speed while the stick is held
+    steering.set_speed_mmps(-3000)
+    assert steering.bucket == 3000 // steering.bucket_mmps
+    assert steering.command_ns < full_lock_ns
+    assert abs(steering.get_command_wheel_angle() - steering.max_wheel_angle * steering.locks[steering.bucket]) < 0.1
+    # past the top bucket and past the ends of the input range
+    steering.set_speed_mmps(100_000)
+    assert steering.bucket == SPEED_BUCKETS - 1
+    steering.set_steering_position(500)
+    assert steering.command_ns == steering.tables[SPEED_BUCKETS - 1][-1]
+
+
+def test_correction_is_clamped_to_the_full_lock():
+    steering = make_steering()
+    steering.set_steering_position(-128)
+    # more left than the full lock stays at the full lock
+    steering.set_correction(10)
+    assert steering.servo.pulse_width_target_us == steering.max_ns // 1000
+    steering.set_correction(-10)
+    assert abs(steering.get_angle() - steering.curve_angle(-128) + 10 * (steering.left - steering.center) / steering.max_wheel_angle) < 0.1
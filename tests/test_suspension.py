@@ -0,0 +1,154 @@
+import math
+import hostenv
+from suspension import Suspension, CORNERS, COL_BOUNCE, COL_BASE
+from articulation import ArticulationAssist
+
+ROLL_WEIGHTS = (-1, 1, -1, 1)
+PITCH_WEIGHTS = (1, 1, -1, -1)
+
+
+class Corner:
+    # a servo corner that reaches its gains at once, within the travel
+    def __init__(self, max_gain_rate = 1.2):
+        self.max_gain_rate = max_gain_rate # travel per second
+        self.base = 0.0
+        self.gain = 0.0
+
+    def set_gains(self, base, gain):
+        self.base = base
+        self.gain = gain
+
+    def position(self):
+        return max(0.0, min(self.base + self.gain, 1.0))
+
+    def get_eta_ms(self):
+        return 0
+
+    def set_arrival_ms(self, ms):
+        pass
+
+
+class Imu:
+    roll = 0.0
+    pitch = 0.0
+
+
+def make_suspension(mode, base_gain = 0.5):
+    suspension = Suspension()
+    corners = [Corner() for _ in range(CORNERS)]
+    for corner in range(CORNERS):
+        suspension.set_corner_servo(corner, corners[corner])
+    imu = Imu()
+    suspension.set_imu(imu)
+    suspension.set_base_gain(base_gain)
+    suspension.set_mode(mode)
+    return suspension, corners, imu
+
+
+def test_axis_gains_stay_in_the_travel():
+    suspension, corners, _ = make_suspension(0)
+    for step in range(32):
+        angle = 2 * math.pi * step / 32
+        suspension.set_axis_gain(1.2 * math.cos(angle), 1.2 * math.sin(angle))
+        suspension.update(None)
+        assert abs(max(abs(corner.gain) for corner in corners) - 0.5) < 1e-6
+        assert all(corner.base == 0.5 for corner in corners)
+    suspension.set_axis_gain(1.0, 0.0)
+    suspension.update(None)
+    assert [corner.gain for corner in corners] == [0.5, -0.5, 0.5, -0.5]
+
+
+def test_a_new_mode_is_a_new_column_mask():
+    suspension, corners, _ = make_suspension(0, base_gain = 0.25)
+    mode = suspension.add_mode((COL_BOUNCE, COL_BASE))
+    suspension.inputs[COL_BOUNCE] = 0.125
+    suspension.mode = mode
+    suspension.update(None)
+    assert [corner.gain for corner in corners] == [0.125] * CORNERS
+    assert [corner.base for corner in corners] == [0.25] * CORNERS
+
+
+def run_leveling(suspension, corners, imu, roll_deg, pitch_deg, seconds):
+    # the chassis tilts by the terrain minus what the corners take out: 6.5 degrees of roll and 2.5 of pitch per
+    # unit of weighted travel; returns the largest roll and pitch seen in the last second
+    ticks = int(seconds * suspension.control_loop_freq)
+    worst = 0.0
+    for tick in range(ticks):
+        imu.roll = roll_deg - 6.5 * sum(w * corner.position() for w, corner in zip(ROLL_WEIGHTS, corners))
+        imu.pitch = pitch_deg - 2.5 * sum(w * corner.position() for w, corner in zip(PITCH_WEIGHTS, corners))
+        suspension.update(None)
+        if tick >= ticks - suspension.control_loop_freq:
+            worst = max(worst, abs(imu.roll), abs(imu.pitch))
+    return worst
+
+
+def test_leveling_takes_out_the_slope():
+    suspension, corners, imu = make_suspension(1)
+    # needs 0.19 of roll and 0.2 of pitch output, within the 0.5 the travel allows
+    assert run_leveling(suspension, corners, imu, 5.0, 2.0, 5) < suspension.leveling.deadband + 0.2
+    for corner in corners:
+        assert 0.0 <= corner.position() <= 1.0
+
+
+def test_leveling_recovers_from_saturation_without_windup():
+    suspension, corners, imu = make_suspension(1)
+    # more roll than the travel can take out, for long enough to wind up an integrator
+    run_leveling(suspension, corners, imu, 20.0, 0.0, 10)
+    assert suspension.saturated or suspension.leveling.roll_output == suspension.leveling.max_output
+    # back on flat ground the corners return without a long overshoot
+    assert run_leveling(suspension, corners, imu, 0.0, 0.0, 3) < suspension.leveling.deadband + 0.2
+
+
+def test_allocation_is_slew_limited():
+    suspension, corners, imu = make_suspension(1)
+    imu.roll = 20.0
+    last = [corner.position() for corner in corners]
+    for _ in range(50):
+        suspension.update(None)
+        for corner in range(CORNERS):
+            step = abs(suspension.totals[corner] - last[corner])
+            assert step <= suspension.max_step[corner] + 1e-6
+            assert 0.0 <= suspension.totals[corner] <= 1.0
+            last[corner] = suspension.totals[corner]
+
+
+def run_articulation(free_warp, seconds = 15, dt = 0.02):
+    # the terrain needs free_warp for all four wheels to touch: short of it the car stands on a diagonal and the
+    # warp tilts it, 30 mm per warp unit at the lifted corner; past it the wheels are all down and nothing tilts
+    # returns the warps and the ticks with a lifted wheel, after the first 10 seconds
+    assist = ArticulationAssist(dt)
+    warps = []
+    lifted = 0
+    for tick in range(int(seconds / dt)):
+        output = assist.output
+        short = free_warp - output if free_warp > 0 else output - free_warp
+        height_mm = 30 * max(0.0, short)
+        # standing on fl-rr tilts with roll_mm == pitch_mm, on fr-rl with roll_mm == -pitch_mm
+        roll_mm = -height_mm if free_warp > 0 else height_mm
+        pitch_mm = -height_mm
+        assist.update(math.degrees(roll_mm / assist.half_track), math.degrees(pitch_mm / assist.half_wheelbase))
+        if tick * dt >= 10:
+            warps.append(assist.warp)
+            lifted += short > 0.001
+    return assist, warps, lifted
+
+
+def test_articulation_warps_towards_the_lifted_wheel():
+    for free_warp in (0.3, -0.3):
+        assist, warps, lifted = run_articulation(free_warp)
+        # the warp leaks back until the dither lifts a wheel again, then steps out: it stays past the free warp
+        if free_warp > 0:
+            assert min(warps) > free_warp - assist.dither
+        else:
+            assert max(warps) < free_warp + assist.dither
+        assert max(abs(warp) for warp in warps) <= assist.max_warp
+        assert lifted < len(warps) / 4
+
+
+def test_articulation_relaxes_on_flat_ground():
+    assist = ArticulationAssist(0.02)
+    assist.warp = 0.3
+    for _ in range(int(20 / 0.02)):
+        assist.update(0.0, 0.0)
+    assert abs(assist.warp) < 0.3 * math.exp(-assist.leak * 20) + 0.01
+    assert abs(abs(assist.output - assist.warp) - assist.dither) < 1e-9
@@ -0,0 +1,120 @@
+import math
+import hostenv
+from motor import Motor
+from gearbox import Gearbox
+from transmission import AutoTransmission, LOW_GEAR, HIGH_GEAR
+from drivetrain_plant import DrivetrainPlant
+
+
+class Drive:
+    # Motor, Gearbox and AutoTransmission on the drivetrain plant; the motor loop and the transmission both run
+    # every 10 ms. The plant's friction and top speed put it close to the fitted feed-forward curve
+    def __init__(self, road_load_rps2 = 100):
+        hostenv.set_time_us(1_000_000)
+        self.motor = Motor(0, 1, 2, 3)
+        self.gearbox = Gearbox(4)
+        self.motor.start_control_loop(fixed_point = True)
+        pid = self.motor.pid
+        pid.thermal_protection = False
+        pid.logging = False
+        pid.set_mode(2)
+        self.plant = DrivetrainPlant(pid, self.gearbox, road_load_rps2 = road_load_rps2, max_rps = 330, tau = 0.02,
+                                     friction_pwm = 10500)
+        self.transmission = AutoTransmission(self.motor, self.gearbox)
+        self.transmission.set_enabled(True)
+        self.log = [] # (ms, state, gear, drive cut, integral) per tick
+
+    def run(self, stick, seconds):
+        # stick: percent, or a function of the time in seconds
+        motor = self.motor
+        for _ in range(int(seconds * 100)):
+            ms = len(self.log) * 10
+            self.transmission.set_speed_percent(stick(ms / 1000) if callable(stick) else stick)
+            # the motor sets its direction on its first tick
+            forward = getattr(motor, 'dir_is_front', True)
+            self.plant.step(motor.pwm if forward else -motor.pwm, motor.pid.dt_us)
+            motor.control_irq_fixed(None)
+            self.transmission.update()
+            self.log.append((ms, self.transmission.state, self.gearbox.gear, motor.pid.shift_cut, motor.pid.I))
+
+    def shifts(self, since_ms = 0):
+        # (ms, new gear) for every gear change after since_ms
+        changes = []
+        for prev, cur in zip(self.log, self.log[1:]):
+            if cur[0] > since_ms and cur[2] != prev[2]:
+                changes.append((cur[0], cur[2]))
+        return changes
+
+
+def phases(log):
+    # the states in order with how long each lasted, a state repeated after another is a new entry
+    runs = []
+    for ms, state, _, _, _ in log:
+        if runs and runs[-1][0] == state:
+            runs[-1][2] = ms
+        else:
+            runs.append([state, ms, ms])
+    return [(state, end - start + 10) for state, start, end in runs]
+
+
+def test_full_throttle_and_lift_shift_once_each_way_in_sequence():
+    drive = Drive()
+    drive.run(100, 6)
+    drive.run(15, 6)
+    assert [gear for _, gear in drive.shifts()] == [HIGH_GEAR, LOW_GEAR]
+    transmission = drive.transmission
+    assert transmission.shifts == 2
+    states = phases(drive.log)
+    assert [state for state, _ in states] == ['idle'] + ['cutting', 'shifting', 'engaging', 'idle'] * 2
+    for state, ms in states:
+        if state == 'cutting':
+            assert ms >= transmission.cut_ms
+        elif state == 'shifting':
+            assert ms >= transmission.shift_ms
+        elif state == 'engaging':
+            assert ms <= transmission.engage_timeout_ms
+    for prev, cur in zip(drive.log, drive.log[1:]):
+        # the drive is cut for the whole sequence and, from the motor tick after the cut, the integral has nothing
+        # to wind up on
+        assert cur[3] == (cur[1] != 'idle')
+        if prev[3] and cur[3]:
+            assert cur[4] == 0
+    # the gear only moves at the end of the cut
+    for prev, cur in zip(drive.log, drive.log[1:]):
+        if cur[2] != prev[2]:
+            assert (prev[1], cur[1]) == ('cutting', 'shifting')
+    # the motor is held near the new gear's speed, the dogs meet with a small jolt
+    assert drive.plant.engagements == 2
+    assert drive.plant.worst_jolt_rps < 30
+
+
+def test_no_hunting_around_the_shift_points():
+    # the stick swings slowly around where low gear reaches the upshift speed (about 29%), then around where high
+    # gear falls to the downshift speed (about 21%), each swing staying out of the other threshold; the band
+    # between the gears takes each with one shift. The measured speed moves in steps of about 8 rps, the
+    # swings keep that far from the other threshold
+    drive = Drive()
+    drive.run(lambda t: 30 + 3 * math.sin(2 * math.pi * t / 3), 15)
+    assert len(drive.shifts()) == 1
+    assert drive.gearbox.gear == HIGH_GEAR
+    start = drive.log[-1][0]
+    drive.run(lambda t: 21 - 3 * math.sin(2 * math.pi * t / 3), 15)
+    assert len(drive.shifts(start)) == 1
+    assert drive.gearbox.gear == LOW_GEAR
+
+
+def test_climbing_a_grade_downshifts_once():
+    drive = Drive()
+    drive.run(60, 6)
+    assert drive.gearbox.gear == HIGH_GEAR
+    start = drive.log[-1][0]
+    # too steep for high gear: it downshifts, and low gear gets to the upshift speed but works too hard on it to
+    # be allowed back up, high gear would bog down
+    drive.plant.road_load_rps2 = 7000
+    drive.run(60, 15)
+    assert [gear for _, gear in drive.shifts(start)] == [LOW_GEAR]
+    assert drive.transmission.get_load() > drive.transmission.max_upshift_load
+    # off the grade it goes back up
+    drive.plant.road_load_rps2 = 100
+    drive.run(60, 6)
+    assert drive.gearbox.gear == HIGH_GEAR
@@ -0,0 +1,54 @@
+# a dynamic bicycle model of the car for the stability checks: lateral velocity and yaw rate from a front and a rear
+# tyre whose force saturates at the grip; the rear tyre's drive force takes from its lateral grip (friction circle),
+# so full throttle in a corner is power oversteer. SI units inside, the assist's units (deg, mm/s) at the edges
+import math
+
+G = 9.81
+
+
+class BicycleModel:
+    def __init__(self, mass = 1.6, wheelbase = 0.197, front_share = 0.5, mu = 0.65, cornering_stiffness = 100.0,
+                 max_drive = 3.0, drag = 0.25, steer_rate_dps = 500, max_wheel_angle = 30):
+        self.mass = mass
+        self.a = wheelbase * (1 - front_share) # centre of mass to the front axle
+        self.b = wheelbase * front_share # and to the rear axle
+        self.inertia = mass * self.a * self.b
+        self.front_grip = mu * mass * G * front_share
+        self.rear_grip = mu * mass * G * (1 - front_share)
+        self.cornering_stiffness = cornering_stiffness # N per rad of slip angle, per axle
+        self.max_drive = max_drive # N at full throttle
+        self.drag = drag # N per (m/s)^2
+        self.steer_rate_dps = steer_rate_dps # the steering servo's speed at the wheels
+        self.max_wheel_angle = max_wheel_angle
+        self.u = 0.0 # forward speed, m/s
+        self.v = 0.0 # lateral speed, + left
+        self.r = 0.0 # yaw rate, rad/s, + left
+        self.wheel_angle = 0.0 # deg, + left
+
+    def _tyre(self, slip, grip):
+        # linear for small slip angles, saturating at the grip
+        return grip * math.tanh(self.cornering_stiffness * slip / grip)
+
+    def step(self, steer_deg, throttle, dt):
+        # steer_deg: where the steering servo is sent; throttle: 0..1 of the drive force
+        steer = max(-self.max_wheel_angle, min(steer_deg, self.max_wheel_angle))
+        max_move = self.steer_rate_dps * dt
+        self.wheel_angle += max(-max_move, min(steer - self.wheel_angle, max_move))
+        delta = math.radians(self.wheel_angle)
+        u = max(self.u, 0.1)
+        drive = throttle * self.max_drive
+        rear_lateral = math.sqrt(max(self.rear_grip ** 2 - drive ** 2, 0.0)) + 1e-6
+        front = self._tyre(delta - (self.v + self.a * self.r) / u, self.front_grip)
+        rear = self._tyre(-(self.v - self.b * self.r) / u, rear_lateral)
+        self.u += ((drive - front * math.sin(delta) - self.drag * self.u * self.u) / self.mass + self.v * self.r) * dt
+        self.v += ((front * math.cos(delta) + rear) / self.mass - self.u * self.r) * dt
+        self.r += (self.a * front * math.cos(delta) - self.b * rear) / self.inertia * dt
+
+    def yaw_rate_dps(self):
+        return math.degrees(self.r)
+
+    def speed_mmps(self):
+        return self.u * 1000
+
+    def slip_deg(self):
+        return math.degrees(math.atan2(self.v, max(self.u, 0.1)))